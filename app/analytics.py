@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""Queries of the analytics dashboard, over the ``consultation_rollup`` table.
+
+Only the filters that are set end up in the ``WHERE`` clause, so each request
+reads the slice it asks for through an index instead of the whole history.
+Time buckets are the day, month or year of ``dim_date``, computed with
+``date_trunc`` on the rollup date.
+"""
+from psycopg import sql
+from psycopg.rows import namedtuple_row
+
+BUCKETS = ["day", "month", "year"]
+
+SCHEMA = [
+    """
+    CREATE INDEX IF NOT EXISTS consultation_rollup_date
+    ON consultation_rollup (date);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS client_zip
+    ON client (zip);
+    """,
+]
+
+# filter: condition on the rollup row `r`, used when the filter is set
+CONDITIONS = {
+    "start": "r.date >= %(start)s::date",
+    "end": "r.date < %(end)s::date + 1",
+    "client": "r.VAT = %(client)s",
+    "zip": "r.VAT IN (SELECT VAT FROM client WHERE zip = %(zip)s)",
+}
+
+
+def where(filters):
+    conditions = [condition for name, condition in CONDITIONS.items() if filters.get(name)]
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def series(filters, bucket):
+    """Query of the totals per time bucket, for a ``KeysetPage`` on ``("bucket",)``."""
+    # `bucket` is one of BUCKETS and the conditions are constants: nothing here comes from the request.
+    return sql.SQL(f"""
+        SELECT *
+        FROM (
+            SELECT date_trunc('{BUCKETS[BUCKETS.index(bucket)]}', r.date) AS bucket,
+                COUNT(*) AS consultations, COUNT(DISTINCT r.VAT) AS clients,
+                SUM(r.num_procedures)::bigint AS total_procedures,
+                SUM(r.num_diagnostic_codes)::bigint AS total_diagnostic_codes
+            FROM consultation_rollup AS r
+            {where(filters)}
+            GROUP BY 1
+        ) AS s
+        WHERE {{keyset}}
+        ORDER BY {{order}}
+        LIMIT {{limit}};
+    """)
+
+
+def totals(filters):
+    return f"""
+        SELECT COUNT(*) AS consultations, COUNT(DISTINCT r.VAT) AS clients,
+            COALESCE(SUM(r.num_procedures), 0)::bigint AS total_procedures,
+            COALESCE(SUM(r.num_diagnostic_codes), 0)::bigint AS total_diagnostic_codes
+        FROM consultation_rollup AS r
+        {where(filters)};
+    """
+
+
+def top_clients(filters):
+    """Query of the ``%(top)s`` clients with the most procedures."""
+    return f"""
+        SELECT r.VAT, cl.name, COUNT(*) AS consultations,
+            SUM(r.num_procedures)::bigint AS total_procedures,
+            SUM(r.num_diagnostic_codes)::bigint AS total_diagnostic_codes
+        FROM consultation_rollup AS r
+        JOIN client AS cl ON cl.VAT = r.VAT
+        {where(filters)}
+        GROUP BY r.VAT, cl.name
+        ORDER BY total_procedures DESC, r.VAT
+        LIMIT %(top)s;
+    """
+
+
+def summary(conn, filters, top):
+    """The totals and the ``top`` clients, in one round trip."""
+    params = {**filters, "top": top}
+    with conn.pipeline():
+        totals_cur = conn.cursor(row_factory=namedtuple_row)
+        totals_cur.execute(totals(filters), params)
+        top_cur = conn.cursor(row_factory=namedtuple_row)
+        top_cur.execute(top_clients(filters), params)
+
+    bundle = {"totals": totals_cur.fetchone(), "top_clients": top_cur.fetchall()}
+    totals_cur.close()
+    top_cur.close()
+    return bundle
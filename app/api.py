@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+"""Queries of the JSON API (``/api/v1``).
+
+The documents are built by Postgres itself (``json_build_object``,
+``json_agg``) and sent as text, so they are never parsed and serialized again
+in Python. Lists are sent as NDJSON, one object per line, read in batches
+from a server-side cursor: a response holds one batch in memory, however
+long the list.
+"""
+from db import connection
+
+# Rows fetched from the server-side cursor, and sent, at a time.
+BATCH = 1000
+
+CLIENT = """
+    json_build_object('vat', c.VAT, 'name', c.name, 'birth_date', c.birth_date, 'street', c.street,
+                      'city', c.city, 'zip', c.zip, 'gender', c.gender)
+"""
+
+APPOINTMENT = """
+    json_build_object('vat_doctor', a.VAT_doctor, 'date_timestamp', a.date_timestamp,
+                      'vat_client', a.VAT_client, 'description', a.description)
+"""
+
+# A consultation `co` with its procedures, diagnostics and nurses.
+CONSULTATION = """
+    json_build_object(
+        'vat_doctor', co.VAT_doctor, 'date_timestamp', co.date_timestamp,
+        'soap_s', co.SOAP_S, 'soap_o', co.SOAP_O, 'soap_a', co.SOAP_A, 'soap_p', co.SOAP_P,
+        'procedures', COALESCE((
+            SELECT json_agg(json_build_object('name', pc.name, 'type', p.type, 'description', pc.description)
+                            ORDER BY pc.name)
+            FROM procedure_in_consultation AS pc
+            JOIN procedure AS p ON p.name = pc.name
+            WHERE pc.VAT_doctor = co.VAT_doctor AND pc.date_timestamp = co.date_timestamp
+        ), '[]'),
+        'diagnostics', COALESCE((
+            SELECT json_agg(json_build_object('id', dc.ID, 'description', dc.description) ORDER BY dc.ID)
+            FROM consultation_diagnostic AS cd
+            JOIN diagnostic_code AS dc ON dc.ID = cd.ID
+            WHERE cd.VAT_doctor = co.VAT_doctor AND cd.date_timestamp = co.date_timestamp
+        ), '[]'),
+        'nurses', COALESCE((
+            SELECT json_agg(json_build_object('vat', e.VAT, 'name', e.name) ORDER BY e.VAT)
+            FROM consultation_assistant AS ca
+            JOIN employee AS e ON e.VAT = ca.VAT_nurse
+            WHERE ca.VAT_doctor = co.VAT_doctor AND ca.date_timestamp = co.date_timestamp
+        ), '[]')
+    )
+"""
+
+GET_CLIENT = f"""
+    SELECT {CLIENT}::text
+    FROM client AS c
+    WHERE c.VAT = %(VAT)s;
+"""
+
+LIST_CLIENTS = f"""
+    SELECT {CLIENT}::text
+    FROM client AS c
+    WHERE %(city)s::text IS NULL OR c.city = %(city)s
+    ORDER BY c.VAT;
+"""
+
+# The client with all its appointments and, for those that took place, the consultation.
+CLIENT_HISTORY = f"""
+    SELECT (
+        {CLIENT}::jsonb || jsonb_build_object('appointments', COALESCE((
+            SELECT json_agg(
+                {APPOINTMENT}::jsonb || jsonb_build_object('consultation', (
+                    SELECT {CONSULTATION}
+                    FROM consultation AS co
+                    WHERE co.VAT_doctor = a.VAT_doctor AND co.date_timestamp = a.date_timestamp
+                ))
+                ORDER BY a.date_timestamp DESC)
+            FROM appointment AS a
+            WHERE a.VAT_client = c.VAT
+        ), '[]'))
+    )::text
+    FROM client AS c
+    WHERE c.VAT = %(VAT)s;
+"""
+
+LIST_APPOINTMENTS = f"""
+    SELECT {APPOINTMENT}::text
+    FROM appointment AS a
+    WHERE (%(client)s::text IS NULL OR a.VAT_client = %(client)s)
+        AND (%(doctor)s::text IS NULL OR a.VAT_doctor = %(doctor)s)
+        AND (%(start)s::date IS NULL OR a.date_timestamp >= %(start)s::date)
+        AND (%(end)s::date IS NULL OR a.date_timestamp < %(end)s::date + 1)
+    ORDER BY a.date_timestamp, a.VAT_doctor;
+"""
+
+GET_CONSULTATION = f"""
+    SELECT ({CONSULTATION}::jsonb || jsonb_build_object('vat_client', a.VAT_client))::text
+    FROM consultation AS co
+    JOIN appointment AS a ON a.VAT_doctor = co.VAT_doctor AND a.date_timestamp = co.date_timestamp
+    WHERE co.VAT_doctor = %(VAT_doctor)s AND co.date_timestamp = %(date_timestamp)s;
+"""
+
+LIST_CONSULTATIONS = f"""
+    SELECT ({CONSULTATION}::jsonb || jsonb_build_object('vat_client', a.VAT_client))::text
+    FROM consultation AS co
+    JOIN appointment AS a ON a.VAT_doctor = co.VAT_doctor AND a.date_timestamp = co.date_timestamp
+    WHERE (%(client)s::text IS NULL OR a.VAT_client = %(client)s)
+        AND (%(doctor)s::text IS NULL OR co.VAT_doctor = %(doctor)s)
+        AND (%(start)s::date IS NULL OR co.date_timestamp >= %(start)s::date)
+        AND (%(end)s::date IS NULL OR co.date_timestamp < %(end)s::date + 1)
+    ORDER BY co.date_timestamp, co.VAT_doctor;
+"""
+
+LIST_PROCEDURES = """
+    SELECT json_build_object('name', p.name, 'type', p.type)::text
+    FROM procedure AS p
+    ORDER BY p.name;
+"""
+
+LIST_DIAGNOSTIC_CODES = """
+    SELECT json_build_object('id', dc.ID, 'description', dc.description)::text
+    FROM diagnostic_code AS dc
+    ORDER BY dc.ID;
+"""
+
+LIST_NURSES = """
+    SELECT json_build_object('vat', e.VAT, 'name', e.name)::text
+    FROM nurse AS n
+    JOIN employee AS e ON e.VAT = n.VAT
+    ORDER BY e.VAT;
+"""
+
+
+def fetch_document(query, params, replica=False):
+    """The JSON text of the single document ``query`` returns, or None."""
+    with connection(replica=replica) as conn:
+        row = conn.execute(query, params).fetchone()
+    return row[0] if row else None
+
+
+def stream_documents(query, params, name="api_list", replica=False):
+    """Yield the documents of ``query`` as NDJSON, ``BATCH`` lines at a time."""
+    with connection(replica=replica) as conn:
+        with conn.cursor(name=name) as cur:
+            cur.itersize = BATCH
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(BATCH)
+                if not rows:
+                    break
+                yield "".join(row[0] + "\n" for row in rows)
@@ -1,21 +1,61 @@
 #!/usr/bin/python3
+import functools
+import hmac
+import io
 import os
+import tempfile
+import time
 from logging.config import dictConfig
+import click
 import psycopg
+from flask import abort
+from flask import before_render_template
 from flask import flash
 from flask import Flask
+from flask import g
+from flask import get_flashed_messages
 from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import send_file
+from flask import session
+from flask import stream_template
+from flask import stream_with_context
+from flask import template_rendered
 from flask import url_for
+from jinja2 import FileSystemBytecodeCache
+from psycopg import sql
 from psycopg.rows import namedtuple_row
+from datetime import date
 from datetime import datetime
+from db import DATABASE_URL
+from db import connection
+from db import pool_stats
+from db import REPLICA_CHECK_INTERVAL
+from db import REPLICA_MAX_LAG
+from db import REPLICA_URLS
+from db import replica_stats
+import rollup
+from paging import KeysetPage
+import search as client_search
+import consultation as consultation_loader
+import history
+import availability
+import refdata
+import importer
+import metrics
+import slowlog
+import versions
+import api
+import batch_edit
+import analytics
+import queries
+import migrations
+import exports
+import warmup
 
 
-# # postgres://{user}:{password}@{hostname}:{port}/{database-name}
-DATABASE_URL = os.environ.get("DATABASE_URL", "postgres://db:db@postgres/db")
-
 def validate_date(date):
     try:
         # Try to parse date using the correct format
@@ -50,189 +90,283 @@ log = app.logger
 
 app.secret_key = DATABASE_URL
 
+# Compiled templates are kept on disk, so that restarted workers load them instead of compiling them again.
+# None: Jinja's private per-user directory in the temporary directory; empty: no cache.
+TEMPLATE_CACHE_DIR = app.config.get("TEMPLATE_CACHE_DIR")
+
+def template_cache(pattern):
+    """The bytecode cache of the templates, or None if ``TEMPLATE_CACHE_DIR`` is empty or unsafe.
+
+    The cached files are unmarshalled and run, so a configured directory is
+    only used if it belongs to this user and nobody else can write to it.
+    """
+    if TEMPLATE_CACHE_DIR is None:
+        return FileSystemBytecodeCache(pattern=pattern)
+    if not TEMPLATE_CACHE_DIR:
+        return None
+    os.makedirs(TEMPLATE_CACHE_DIR, mode=0o700, exist_ok=True)
+    status = os.stat(TEMPLATE_CACHE_DIR)
+    if status.st_uid != os.getuid() or status.st_mode & 0o077:
+        log.warning(f"Not caching templates in {TEMPLATE_CACHE_DIR}: it must belong to this user "
+                    "and be private (mode 0700).")
+        return None
+    return FileSystemBytecodeCache(TEMPLATE_CACHE_DIR, pattern)
+
+bytecode_cache = template_cache("flask-%s.cache")
+if bytecode_cache is not None:
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": bytecode_cache}
+
+
+@app.before_request
+def start_metrics():
+    metrics.start_request(request.endpoint or "unmatched")
+
+@app.after_request
+def record_status(response):
+    g.status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_metrics(exception=None):
+    metrics.finish_request(request.method, g.get("status", 500))
+
+def use_replica():
+    """Whether the reads of this request may go to a replica.
+
+    Not for a while after the user's own writes, so that they see them:
+    replicas that lag more than REPLICA_MAX_LAG are not read from.
+    """
+    g.read_only = True
+    return time.time() - session.get("wrote_at", 0) > REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL
+
+@app.after_request
+def pin_to_primary(response):
+    if REPLICA_URLS and request.method == "POST" and not g.get("read_only") and response.status_code < 400:
+        session["wrote_at"] = time.time()
+    return response
+
+@before_render_template.connect_via(app)
+def start_render(sender, template, context, **extra):
+    metrics.start_render()
+
+@template_rendered.connect_via(app)
+def finish_render(sender, template, context, **extra):
+    metrics.finish_render()
+
+def chunked(pieces, size):
+    """Join the small pieces a streamed template yields into chunks of at least ``size`` characters."""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+def render_page(template, **context):
+    """Render a page whose rows are read from a server-side cursor while it renders (see KeysetPage).
+
+    The page is streamed, so its first bytes go out before the rows are
+    read and the whole HTML is never held in memory. With
+    FLASK_STREAM_PAGES=0 its rows are fetched and it is rendered in full
+    first, e.g. to get a proper error page instead of a truncated one while
+    debugging.
+    """
+    # Taken out of the session now: the session cookie is saved before a streamed body starts,
+    # so messages popped while streaming would be shown again on the next page. base.html gets
+    # the same messages, kept on the request.
+    get_flashed_messages()
+    if not app.config.get("STREAM_PAGES", True):
+        for value in context.values():
+            if isinstance(value, KeysetPage):
+                value.fetch()
+        return render_template(template, **context)
+    return app.response_class(chunked(stream_template(template, **context), app.config.get("STREAM_CHUNK_SIZE", 8192)),
+                              mimetype="text/html")
+
+def dashboard_filters():
+    """The filters of the dashboard and the errors found in them; invalid ones are dropped."""
+    filters = {"start": request.args.get("from") or None, "end": request.args.get("to") or None,
+               "client": request.args.get("client") or None, "zip": request.args.get("zip") or None}
+    errors = []
+    for name, label in (("start", "From"), ("end", "To")):
+        if filters[name] and not validate_date(filters[name]):
+            errors.append(f"{label} date is invalid")
+            filters[name] = None
+    return filters, errors
+
+def dashboard_view():
+    """Filters, bucket, top-N and page of rows requested from the dashboard."""
+    filters, errors = dashboard_filters()
+    bucket = request.args.get("bucket", "month")
+    bucket = bucket if bucket in analytics.BUCKETS else "month"
+    top = max(1, min(request.args.get("top", 10, type=int), app.config.get("DASHBOARD_MAX_TOP", 100)))
+    size = request.args.get("size", app.config.get("DASHBOARD_PAGE_SIZE", 50), type=int)
+    size = max(1, min(size, app.config.get("DASHBOARD_MAX_PAGE_SIZE", 500)))
+    replica = use_replica()
+
+    with connection(replica=replica) as conn:
+        bundle = analytics.summary(conn, filters, top)
+        app.logger.debug(f"Found {len(bundle['top_clients'])} top client(s).")
+
+    rows = KeysetPage.from_args(request.args, analytics.series(filters, bucket), filters, key=("bucket",),
+                                size=size, name="dashboard", replica=replica)
+    return {"filters": filters, "errors": errors, "bucket": bucket, "top": top, "rows": rows, **bundle}
+
 @app.route("/", methods=["GET"])
 @app.route("/dashboard", methods=["GET"])
 def dashboard():
-
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT VAT, Date, SUM (num_procedures) AS total_procedures, 
-                    SUM (num_diagnostic_codes) AS total_diagnostic_codes
-                FROM facts_consultations
-                GROUP BY CUBE (VAT, Date);
-            """)
-            facts_consultations = cur.fetchall()
-            app.logger.debug(f"Found {len(facts_consultations)} rows.")
-    
-    return render_template("dashboard/dashboard.html", facts_consultations=facts_consultations)
+    view = dashboard_view()
+    for error in view.pop("errors"):
+        flash(error)
+    link_args = {key: value for key, value in request.args.items() if not key.startswith(("after_", "before_"))}
+
+    return render_page("dashboard/dashboard.html", buckets=analytics.BUCKETS, link_args=link_args, **view)
+
+@app.route("/dashboard/data", methods=["GET"])
+def dashboard_data():
+    view = dashboard_view()
+    if view["errors"]:
+        return jsonify({"error": ", ".join(view["errors"])}), 400
+
+    rows = [{**row._asdict(), "bucket": row.bucket.date().isoformat()} for row in view["rows"]]
+    page = view["rows"]
+    return jsonify({
+        "filters": view["filters"],
+        "bucket": view["bucket"],
+        "totals": view["totals"]._asdict(),
+        "top_clients": [client._asdict() for client in view["top_clients"]],
+        "rows": rows,
+        "previous": {key: str(value) for key, value in page.previous_args().items()} if page.has_previous else None,
+        "next": {key: str(value) for key, value in page.next_args().items()} if page.has_next else None,
+    })
+
+def clients_page_size():
+    size = request.args.get("size", app.config.get("CLIENTS_PAGE_SIZE", 50), type=int)
+    return max(1, min(size, app.config.get("CLIENTS_MAX_PAGE_SIZE", 500)))
 
 @app.route("/clients", methods=["GET"])
 def clients():
-
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
+    clients = KeysetPage.from_args(request.args, sql.SQL("""
+                SELECT VAT, name, birth_date, street, city, zip, gender
                 FROM client
-                ORDER BY name ASC;
-            """)
-            clients = cur.fetchall()
-            app.logger.debug(f"Found {len(clients)} rows.")
+                WHERE {keyset}
+                ORDER BY {order}
+                LIMIT {limit};
+            """), {}, key=("name", "VAT"), size=clients_page_size(), name="clients", replica=use_replica())
 
-    return render_template("clients/clients.html", clients=clients)
+    return render_page("clients/clients.html", clients=clients, search=None)
 
-@app.route("/clients2", methods=["POST"])
+@app.route("/clients2", methods=["GET", "POST"])
 def clients2():
-    search = request.form.get("search")
+    search = request.values.get("search", "")
+    clients = client_search.search_page(request.args, search, limit=app.config.get("SEARCH_LIMIT", 100),
+                                        size=clients_page_size(), replica=use_replica())
+
+    return render_page("clients/clients.html", clients=clients or [], search=search,
+                       search_limit=app.config.get("SEARCH_LIMIT", 100))
+
+@app.route("/clients/search", methods=["GET"])
+def clients_search():
+    search = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 10, type=int), app.config.get("SEARCH_LIMIT", 100)))
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection(replica=use_replica()) as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE name ILIKE %(search_like)s
-                OR VAT = %(search)s
-                OR street ILIKE %(search_like)s
-                OR city ILIKE %(search_like)s
-                OR zip ILIKE %(search_like)s
-                ORDER BY name ASC;
-            """, {'search': search, 'search_like': '%' + search + '%'})
-            clients = cur.fetchall()
+            clients = client_search.search_clients(cur, search, limit=limit)
             app.logger.debug(f"Found {len(clients)} rows.")
 
-    return render_template("clients/clients.html", clients=clients)
+    return jsonify([{"vat": client.vat, "name": client.name, "city": client.city, "zip": client.zip}
+                    for client in clients])
 
-@app.route("/client/<VAT>", methods=["GET"])
-def client_vat(VAT):
+def revalidating():
+    # Pending flash messages are only shown if the page is sent again.
+    return bool(request.if_none_match) and not session.get("_flashes")
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT a.*, 
-                    CASE WHEN c.VAT_doctor IS NOT NULL THEN TRUE ELSE FALSE END AS is_in_consultation
-                FROM appointment AS a
-                LEFT JOIN consultation AS c
-                    ON a.VAT_doctor = c.VAT_doctor AND a.date_timestamp = c.date_timestamp
-                WHERE a.VAT_client = %(VAT)s
-                ORDER BY a.date_timestamp DESC;
-            """, {"VAT": VAT})
-            appointments = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} appointment(s).")
-            
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s
-                ORDER BY c.date_timestamp;
-            """, {"VAT": VAT})
-            consultations = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
+def not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
 
-    return render_template("clients/client_vat.html", client = client, consultations = consultations, appointments = appointments)
+def with_etag(body, etag):
+    response = app.make_response(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def timeline_size():
+    size = request.args.get("size", app.config.get("TIMELINE_PAGE_SIZE", 20), type=int)
+    return max(1, min(size, app.config.get("TIMELINE_MAX_PAGE_SIZE", 200)))
+
+@app.route("/client/<VAT>", methods=["GET"])
+def client_vat(VAT):
+    before = history.before_from_args(request.args)
+
+    with connection(replica=use_replica()) as conn:
+        if revalidating():
+            etag = versions.etag("client", history.load(conn, VAT, "version")["version"].version)
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+
+        # The version is read first, so the page is never newer than its ETag says.
+        bundle = history.load(conn, VAT, "version", "client", "timeline", before=before, size=timeline_size())
+        app.logger.debug(f"Found {len(bundle['timeline'])} appointment(s).")
+
+    return with_etag(render_template("clients/client_vat.html", **bundle),
+                     versions.etag("client", bundle["version"].version))
+
+@app.route("/client/<VAT>/timeline", methods=["GET"])
+def client_timeline(VAT):
+    """An older page of the timeline, as JSON, with the table rows to append to the page."""
+    with connection(replica=use_replica()) as conn:
+        bundle = history.load(conn, VAT, "client", "timeline", before=history.before_from_args(request.args),
+                              size=timeline_size())
+    if bundle["client"] is None:
+        return jsonify({"error": "VAT client does not exist"}), 404
+
+    return jsonify({
+        "appointments": [{**appointment._asdict(), "date_timestamp": appointment.date_timestamp.isoformat(sep=" ")}
+                         for appointment in bundle["timeline"]],
+        "html": render_template("clients/timeline_rows.html", **bundle),
+        "older": bundle["older"],
+    })
+
+@app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/soap", methods=["GET"])
+def consultation_soap(VAT, VAT_doctor, date_timestamp):
+    """The SOAP notes of a consultation, as an HTML fragment, when it is expanded in the timeline."""
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "consultation")
+    if bundle["consultation"] is None:
+        return "Consultation does not exist", 404
+
+    return render_template("clients/soap_notes.html", **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>", methods=["GET"])
 def consultation_desc(VAT, VAT_doctor, date_timestamp):
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT *
-                FROM appointment
-                WHERE VAT_client = %(VAT)s AND VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            appointment = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} appointment(s).")
-            
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            consultation = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
-            
-            cur.execute("""
-                SELECT pc.name, pc.VAT_doctor, pc.date_timestamp, pc.description
-                FROM procedure_in_consultation AS pc
-                JOIN consultation AS c ON c.VAT_doctor = pc.VAT_doctor AND c.date_timestamp = pc.date_timestamp
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s
-                ORDER BY pc.date_timestamp;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            procedures = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} procedure(s).")
-            
-            cur.execute("""
-                SELECT dc.ID, dc.description
-                FROM diagnostic_code AS dc
-                JOIN consultation_diagnostic AS cd ON cd.ID = dc.ID
-                JOIN consultation AS c ON c.VAT_doctor = cd.VAT_doctor AND c.date_timestamp = cd.date_timestamp
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s
-                ORDER BY cd.date_timestamp;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            diagnosis = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} diagnosi(s).")
-            
-            
-            cur.execute("""
-                SELECT n.VAT, e.name
-                FROM nurse AS n
-                JOIN employee AS e ON e.VAT = n.VAT
-                JOIN consultation_assistant AS ca ON ca.VAT_nurse = n.VAT
-                JOIN consultation AS c ON c.VAT_doctor = ca.VAT_doctor AND c.date_timestamp = ca.date_timestamp
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            nurses = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} nurse(s).")
-
-    return render_template("clients/consultation_desc.html", client = client, consultation = consultation, appointment = appointment, procedures = procedures, diagnosis = diagnosis, nurses = nurses)
+    with connection(replica=use_replica()) as conn:
+        if revalidating():
+            etag = versions.etag("consultation", consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp,
+                                                                          "version")["version"].version)
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "version",
+                                          "client", "appointment", "consultation", "procedures", "diagnosis", "nurses")
+
+    return with_etag(render_template("clients/consultation_desc.html", **bundle),
+                     versions.etag("consultation", bundle["version"].version))
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/update_consultation", methods=["POST"])
 def update_consultation_dashboard(VAT, VAT_doctor, date_timestamp):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            consultation = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            
-    return render_template("clients/update_consultation.html", consultation = consultation, client = client)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "consultation", "client")
+
+    return render_template("clients/update_consultation.html", **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/update_consultation2", methods=["POST"])
 def update_consultation(VAT, VAT_doctor, date_timestamp):
@@ -247,7 +381,7 @@ def update_consultation(VAT, VAT_doctor, date_timestamp):
         flash(error)
         return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/update_consultation')
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 UPDATE consultation
@@ -264,26 +398,10 @@ def update_consultation(VAT, VAT_doctor, date_timestamp):
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/update_appointment", methods=["POST"])
 def update_appointment_dashboard(VAT, VAT_doctor, date_timestamp):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM appointment
-                WHERE VAT_client = %(VAT)s AND VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            appointment = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} appointment(s).")
-            
-            cur.execute("""
-                    SELECT *
-                    FROM client
-                    WHERE VAT = %(VAT)s;
-                """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            
-    return render_template("clients/update_appointment.html", appointment = appointment, client = client)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "appointment", "client")
+
+    return render_template("clients/update_appointment.html", **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/update_appointment2", methods=["POST"])
 def update_appointment(VAT, VAT_doctor, date_timestamp):
@@ -295,7 +413,7 @@ def update_appointment(VAT, VAT_doctor, date_timestamp):
         flash(error)
         return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/update_appointment')
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 UPDATE appointment
@@ -310,29 +428,10 @@ def update_appointment(VAT, VAT_doctor, date_timestamp):
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/update_procedure/<name>", methods=["POST"])
 def update_procedure_dashboard(VAT, VAT_doctor, date_timestamp, name):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT pc.name, pc.VAT_doctor, pc.date_timestamp, pc.description
-                FROM procedure_in_consultation AS pc
-                JOIN consultation AS c ON c.VAT_doctor = pc.VAT_doctor AND c.date_timestamp = pc.date_timestamp
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s 
-                    AND pc.name = %(name)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "name": name})
-            procedure = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} procedure(s).")
-            
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            
-    return render_template("clients/update_procedure.html", procedure = procedure, client = client)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "procedure", "client", name=name)
+
+    return render_template("clients/update_procedure.html", **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/update_procedure2/<name>", methods=["POST"])
 def update_procedure(VAT, VAT_doctor, date_timestamp, name):
@@ -344,7 +443,7 @@ def update_procedure(VAT, VAT_doctor, date_timestamp, name):
         flash(error)
         return redirect('/client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/update_procedure' + '/' + name)
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 UPDATE procedure_in_consultation
@@ -367,7 +466,7 @@ def delete_procedure(VAT, VAT_doctor, date_timestamp, name):
         flash(error)
         return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp)
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 DELETE FROM procedure_charting
@@ -384,6 +483,8 @@ def delete_procedure(VAT, VAT_doctor, date_timestamp, name):
                 DELETE FROM procedure_in_consultation
                 WHERE date_timestamp = %(date_timestamp)s AND VAT_doctor = %(VAT_doctor)s AND name = %(name)s;
             """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "name": name})
+            if cur.rowcount:
+                rollup.bump(cur, VAT_doctor, date_timestamp, procedures=-cur.rowcount)
             
             conn.commit()
 
@@ -399,7 +500,7 @@ def delete_nurse(VAT, VAT_doctor, date_timestamp, VAT_nurse):
         flash(error)
         return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp)
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 DELETE FROM consultation_assistant
@@ -420,7 +521,7 @@ def delete_diagnostic(VAT, VAT_doctor, date_timestamp, ID):
         flash(error)
         return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp)
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 DELETE FROM prescription
@@ -431,6 +532,8 @@ def delete_diagnostic(VAT, VAT_doctor, date_timestamp, ID):
                 DELETE FROM consultation_diagnostic
                 WHERE date_timestamp = %(date_timestamp)s AND VAT_doctor = %(VAT_doctor)s AND ID = %(ID)s;
             """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "ID": ID})
+            if cur.rowcount:
+                rollup.bump(cur, VAT_doctor, date_timestamp, diagnostic_codes=-cur.rowcount)
             
             conn.commit()
 
@@ -443,42 +546,26 @@ def add_procedure(VAT, VAT_doctor, date_timestamp):
     
     error = ""
     
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT name
-                FROM procedure;
-                """)
-            db_procedures = cur.fetchall()
-            db_procedures = [row.name for row in db_procedures]
-            app.logger.debug(f"Found {cur.rowcount} db_procedure(s).")
-            
-            cur.execute("""
-                SELECT name
-                FROM procedure_in_consultation
-                WHERE date_timestamp = %(date_timestamp)s AND VAT_doctor = %(VAT_doctor)s;
-                """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            db_names = cur.fetchall()
-            db_names = [row.name for row in db_names]
-            app.logger.debug(f"Found {cur.rowcount} db_procedure(s).")
-    
     name = request.form.get("name")
-    
-    if name not in(db_procedures) or name in(db_names):
-        error = "Invalid procedure name"
 
-    if error != "":
-        flash(error)
-        return redirect('/client/' + VAT + '/' + VAT_doctor  + '/' + date_timestamp + '/add_procedure')
+    with connection() as conn:
+        with conn.cursor(row_factory=namedtuple_row) as cur:
+            in_consultation = queries.run(conn, queries.HAS_PROCEDURE, {"VAT_doctor": VAT_doctor,
+                                          "date_timestamp": date_timestamp, "name": name}) is not None
+            
+            if name not in refdata.procedures(conn) or in_consultation:
+                error = "Invalid procedure name"
 
+            if error != "":
+                flash(error)
+                return redirect('/client/' + VAT + '/' + VAT_doctor  + '/' + date_timestamp + '/add_procedure')
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 INSERT INTO procedure_in_consultation (name, VAT_doctor, date_timestamp, description)
                 VALUES
                 (%(name)s, %(VAT_doctor)s, %(date_timestamp)s, %(description)s);
             """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "name": name, "description": description})
+            rollup.bump(cur, VAT_doctor, date_timestamp, procedures=1)
             
             conn.commit()
 
@@ -489,28 +576,18 @@ def add_procedure(VAT, VAT_doctor, date_timestamp):
 def add_nurse(VAT, VAT_doctor, date_timestamp):
     
     error = ""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT VAT
-                FROM nurse;
-                """)
-            db_VAT_nurses = cur.fetchall()
-            db_VAT_nurses = [row.vat for row in db_VAT_nurses]
-            app.logger.debug(f"Found {cur.rowcount} db_VAT_nurses.")
-    
     VAT_nurse = request.form.get("VAT")
-    
-    if VAT_nurse not in(db_VAT_nurses):
-        error = "Invalid VAT_nurse"
 
-    if error != "":
-        flash(error)
-        
-        return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/add_nurse')
-
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
+            if VAT_nurse not in refdata.nurses(conn):
+                error = "Invalid VAT_nurse"
+
+            if error != "":
+                flash(error)
+                
+                return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/add_nurse')
+
             cur.execute("""
                 INSERT INTO consultation_assistant(VAT_doctor, date_timestamp, VAT_nurse)
                 VALUES
@@ -527,41 +604,26 @@ def add_nurse(VAT, VAT_doctor, date_timestamp):
 def add_diagnostic2(VAT, VAT_doctor, date_timestamp):
     
     error = ""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    ID = request.form.get("ID")
+
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT ID
-                FROM diagnostic_code;
-                """)
-            db_ID = cur.fetchall()
-            db_ID = [row.id for row in db_ID]
-            app.logger.debug(f"Found {cur.rowcount} db_ID(s).")
-            
-            cur.execute("""
-                SELECT ID
-                FROM consultation_diagnostic
-                WHERE date_timestamp = %(date_timestamp)s AND VAT_doctor = %(VAT_doctor)s;               ;
-                """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            db_ID2 = cur.fetchall()
-            db_ID2 = [row.id for row in db_ID2]
-            app.logger.debug(f"Found {cur.rowcount} db_ID2(s).")
+            in_consultation = queries.run(conn, queries.HAS_DIAGNOSTIC, {"VAT_doctor": VAT_doctor,
+                                          "date_timestamp": date_timestamp, "ID": ID}) is not None
             
-    ID = request.form.get("ID")
-    
-    if ID not in(db_ID) or ID in(db_ID2):
-        error = "Invalid ID"
+            if ID not in refdata.diagnostic_codes(conn) or in_consultation:
+                error = "Invalid ID"
 
-    if error != "":
-        flash(error)
-        return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/add_diagnostic')
+            if error != "":
+                flash(error)
+                return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/add_diagnostic')
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 INSERT INTO consultation_diagnostic (VAT_doctor, date_timestamp, ID)
                 VALUES
                 (%(VAT_doctor)s, %(date_timestamp)s, %(ID)s);
             """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "ID": ID})
+            rollup.bump(cur, VAT_doctor, date_timestamp, diagnostic_codes=1)
             
             conn.commit()
 
@@ -570,158 +632,123 @@ def add_diagnostic2(VAT, VAT_doctor, date_timestamp):
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/add_procedure", methods=["GET"])
 def add_procedure_dashboard(VAT, VAT_doctor, date_timestamp):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            consultation = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
-            cur.execute("""
-                SELECT name
-                FROM procedure_in_consultation;
-                """)
-            db_procedures = cur.fetchall()
-            db_procedures = [row.name for row in db_procedures]
-            app.logger.debug(f"Found {cur.rowcount} db_procedure(s).")
-            
-    
-    return render_template("clients/add_procedure.html", client = client, consultation = consultation, procedures_names = db_procedures)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "client", "consultation")
+    procedures_names = sorted(refdata.procedures())
+
+    return render_template("clients/add_procedure.html", procedures_names = procedures_names, **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/add_nurse", methods=["GET"])
 def add_nurse_dashboard(VAT, VAT_doctor, date_timestamp):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            consultation = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
-            cur.execute("""
-                SELECT VAT
-                FROM nurse;
-                """)
-            db_VAT_nurses = cur.fetchall()
-            db_VAT_nurses = [row.vat for row in db_VAT_nurses]
-            app.logger.debug(f"Found {cur.rowcount} db_VAT_nurses.")
-                    
-            
-    return render_template("clients/add_nurse.html", client = client, consultation = consultation, VAT_nurses = db_VAT_nurses)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "client", "consultation")
+    VAT_nurses = sorted(refdata.nurses())
+
+    return render_template("clients/add_nurse.html", VAT_nurses = VAT_nurses, **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/add_diagnostic", methods=["GET"])
 def add_diagnostic(VAT, VAT_doctor, date_timestamp):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            consultation = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
-            cur.execute("""
-                SELECT ID
-                FROM diagnostic_code;
-                """)
-            db_ID = cur.fetchall()
-            db_ID = [row.id for row in db_ID]
-            app.logger.debug(f"Found {cur.rowcount} db_ID(s).")
-            
-            
-    return render_template("clients/add_diagnostic.html", client = client, consultation = consultation, IDs = db_ID)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp, "client", "consultation")
+    IDs = sorted(refdata.diagnostic_codes())
+
+    return render_template("clients/add_diagnostic.html", IDs = IDs, **bundle)
+
+@app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/edit_consultation", methods=["GET"])
+def edit_consultation_dashboard(VAT, VAT_doctor, date_timestamp):
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp,
+                                          "client", "consultation", "procedures", "diagnosis", "nurses")
+    # From the primary: a copy read from a lagging replica would be cached for REFDATA_TTL.
+    procedures_names = sorted(refdata.procedures())
+    IDs = sorted(refdata.diagnostic_codes())
+    VAT_nurses = sorted(refdata.nurses())
+
+    return render_template("clients/edit_consultation.html", procedures_names = procedures_names, IDs = IDs,
+                           VAT_nurses = VAT_nurses, new_rows = app.config.get("EDIT_NEW_PROCEDURES", 3), **bundle)
+
+@app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/edit_consultation2", methods=["POST"])
+def edit_consultation(VAT, VAT_doctor, date_timestamp):
+    changes = batch_edit.parse(request.form)
+
+    with connection() as conn:
+        errors = batch_edit.apply(conn, VAT_doctor, date_timestamp, changes)
+        if errors:
+            for error in errors:
+                flash(error)
+            return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/edit_consultation')
+
+        conn.commit()
+
+    flash('Consultation updated successfully.')
+    return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp)
+
+def clinic_slots():
+    return availability.day_slots(app.config.get("CLINIC_OPENS", "09:00"), app.config.get("CLINIC_CLOSES", "18:00"),
+                                  app.config.get("SLOT_MINUTES", 60))
+
+def availability_window():
+    start = request.args.get("start")
+    start = date.fromisoformat(start) if start and validate_date(start) else date.today()
+    days = request.args.get("days", app.config.get("AVAILABILITY_DAYS", 14), type=int)
+    return start, max(1, min(days, app.config.get("AVAILABILITY_MAX_DAYS", 62)))
 
 @app.route("/client/<VAT>/new_appointment", methods=["GET"])
 def add_appointment_dashboard(VAT):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    start, days = availability_window()
+
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT *
-                FROM appointment;
-            """)
-            appointments = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} appointment(s).")      
-                     
-    available_slots = ['9:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00', '16:00', '17:00']
-    return render_template("clients/add_appointment.html", client = client, appointments = appointments, available_slots = available_slots)
+            client = queries.run(conn, queries.CLIENT, {"VAT": VAT})
+
+            available_slots = availability.free_slots(cur, start, days, clinic_slots(),
+                                                      app.config.get("SLOT_MINUTES", 60))
+            app.logger.debug(f"Found free slots on {len(available_slots)} day(s).")
+
+    return render_template("clients/add_appointment.html", client = client, available_slots = available_slots, start = start, days = days)
+
+@app.route("/availability", methods=["GET"])
+def available_slots():
+    start, days = availability_window()
+
+    with connection() as conn:
+        with conn.cursor(row_factory=namedtuple_row) as cur:
+            slots = availability.free_slots(cur, start, days, clinic_slots(), app.config.get("SLOT_MINUTES", 60))
+
+    return jsonify({"start": start.isoformat(), "days": days,
+                    "slot_minutes": app.config.get("SLOT_MINUTES", 60), "slots": slots})
+
+@app.route("/availability/next", methods=["GET"])
+def next_free_slots():
+    start, days = availability_window()
+    n = max(1, min(request.args.get("n", 10, type=int), app.config.get("NEXT_SLOTS_MAX", 100)))
+    specialization = request.args.get("specialization") or None
+
+    with connection() as conn:
+        with conn.cursor(row_factory=namedtuple_row) as cur:
+            slots = availability.next_free(cur, start, days, clinic_slots(), app.config.get("SLOT_MINUTES", 60),
+                                           n, specialization=specialization)
+            app.logger.debug(f"Found {len(slots)} free slot(s).")
+
+    return jsonify(slots)
 
 @app.route("/client/<VAT>/new_appointment_doctor", methods=["POST"])
 def add_appointment_doctor_dashboard(VAT):
-    date = request.form.get("date")
-    time = request.form.get("time") + ":00"
-    datetime_str = date + " " + time
-    format_str = "%Y-%m-%d %H:%M:%S"
-    datetime_obj = datetime.strptime(datetime_str, format_str)
-    date_timestamp = datetime.timestamp(datetime_obj)
-    date_timestamp = datetime_obj.strftime(format_str)
+    slot = request.form.get("slot")
+    if not slot:
+        slot = f"{request.form.get('date')} {request.form.get('time')}"
+    try:
+        datetime_obj = datetime.strptime(slot, "%Y-%m-%d %H:%M")
+    except ValueError:
+        abort(400, "The slot must be a date and a time, as YYYY-MM-DD HH:MM.")
+    date_timestamp = datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
 
     
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-                
-            
-            cur.execute("""
-                SELECT e.name, d.specialization, d.email, d.biography, e.VAT
-                FROM doctor AS d JOIN employee as e ON e.VAT = d.VAT
-                WHERE d.VAT NOT IN(
-                    SELECT d1.VAT 
-                    FROM doctor AS d1
-                    JOIN appointment AS a ON a.VAT_doctor = d1.VAT
-                    WHERE a.date_timestamp = %(date_timestamp)s
-                )
-                ORDER BY e.VAT;
-            """, {"date_timestamp": date_timestamp})
-            doctors = cur.fetchall()
-            app.logger.debug(f"Found {cur.rowcount} doctor(s).")           
-            
+    with connection() as conn:
+        client = queries.run(conn, queries.CLIENT, {"VAT": VAT})
+        doctors = queries.run(conn, queries.FREE_DOCTORS, {"date_timestamp": date_timestamp})
+        app.logger.debug(f"Found {len(doctors)} doctor(s).")
+
     return render_template("clients/add_appointment_doctor.html", client = client, doctors = doctors, date_timestamp = date_timestamp)
 
 @app.route("/client/<VAT>/<date_timestamp>/new_appointment2", methods=["POST"])
@@ -735,7 +762,7 @@ def add_appointment2(VAT, date_timestamp):
         
         return redirect('/client/' + VAT)
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                         
@@ -765,31 +792,20 @@ def add_client2():
     gender = request.form.get("gender")
     zip_code = request.form.get("zip")
     
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT VAT
-                FROM client;
-                """)
-            
-            db_VAT_client = cur.fetchall()
-            db_VAT_client = [row.vat for row in db_VAT_client]
-            app.logger.debug(f"Found {cur.rowcount} db_VAT_client(s).")
-    
-    error = ""
-        
-    if VAT in db_VAT_client:
-        error = 'VAT client already exists'
-        
-    if not validate_date(birth_date):
-        error = "birthdate is invalid"
-        
-    if error != "":
-        flash(error)
-        return render_template("clients/new_client.html")
+            error = ""
+
+            if queries.run(conn, queries.CLIENT, {"VAT": VAT}) is not None:
+                error = 'VAT client already exists'
+                
+            if not validate_date(birth_date):
+                error = "birthdate is invalid"
+                
+            if error != "":
+                flash(error)
+                return render_template("clients/new_client.html")
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 INSERT INTO client(VAT, name, birth_date, street, city, zip, gender)
                 VALUES
@@ -803,36 +819,60 @@ def add_client2():
     flash('Client created successfully.')
     return redirect('/dashboard')
 
+def import_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return "ndjson" if filename.lower().endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+@app.route("/import", methods=["GET"])
+def import_dashboard():
+
+    return render_template("clients/import.html", kinds = list(importer.KINDS))
+
+@app.route("/import2", methods=["POST"])
+def import_data():
+    kind = request.form.get("kind")
+    upload = request.files.get("file")
+
+    error = ""
+
+    if kind not in importer.KINDS:
+        error = "Invalid kind of data"
+
+    if upload is None or upload.filename == "":
+        error = "No file selected"
+
+    if error != "":
+        flash(error)
+        return redirect('/import')
+
+    stream = io.TextIOWrapper(upload.stream, encoding="utf-8", newline="")
+    rejects = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    try:
+        with connection() as conn:
+            result = importer.import_file(conn, kind, stream, import_format(upload.filename, request.form.get("format")),
+                                          rejects, validate_date)
+            conn.commit()
+    except UnicodeDecodeError:
+        # Nothing was imported: the transaction was rolled back.
+        flash("The file is not valid UTF-8")
+        return redirect('/import')
+    app.logger.info(f"Imported {result['imported']} {kind}, rejected {result['rejected']}.")
+
+    rejects.seek(0)
+    response = send_file(rejects, mimetype="text/csv", as_attachment=True, download_name=f"{kind}-rejected.csv")
+    response.headers["X-Imported-Rows"] = str(result["imported"])
+    response.headers["X-Rejected-Rows"] = str(result["rejected"])
+    return response
+
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/create_consultation", methods=["GET"])
 def add_consultation_dashboard(VAT, VAT_doctor, date_timestamp):
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                SELECT *
-                FROM client
-                WHERE VAT = %(VAT)s;
-            """, {"VAT": VAT})
-            client = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} client(s).")
-            
-            cur.execute("""
-                SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
-                FROM consultation AS c
-                JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            consultation = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} consultation(s).")
-            
-            cur.execute("""
-                SELECT *
-                FROM appointment
-                WHERE VAT_client = %(VAT)s AND VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s;
-            """, {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp})
-            appointment = cur.fetchone()
-            app.logger.debug(f"Found {cur.rowcount} appointment(s).")
-            
-    return render_template("clients/create_consultation.html", client = client, consultation = consultation, appointment = appointment)
+    with connection(replica=use_replica()) as conn:
+        bundle = consultation_loader.load(conn, VAT, VAT_doctor, date_timestamp,
+                                          "client", "consultation", "appointment")
+
+    return render_template("clients/create_consultation.html", **bundle)
 
 @app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>/create_consultation2", methods=["POST"])
 def add_consultation2(VAT, VAT_doctor, date_timestamp):
@@ -847,13 +887,14 @@ def add_consultation2(VAT, VAT_doctor, date_timestamp):
         flash(error)
         return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp + '/update_consultation')
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute("""
                 INSERT INTO consultation (VAT_doctor, date_timestamp, SOAP_S, SOAP_O, SOAP_A, SOAP_P)
                 VALUES
                 (%(VAT_doctor)s, %(date_timestamp)s, %(soap_s)s, %(soap_o)s, %(soap_a)s, %(soap_p)s);
             """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "soap_s": soap_s, "soap_o": soap_o, "soap_a": soap_a, "soap_p": soap_p})
+            rollup.bump(cur, VAT_doctor, date_timestamp)
         
             conn.commit()
 
@@ -862,5 +903,213 @@ def add_consultation2(VAT, VAT_doctor, date_timestamp):
     
     return redirect('/' + 'client' + '/' + VAT + '/' + VAT_doctor + '/' + date_timestamp)
 
+@app.cli.command("migrate")
+def migrate():
+    """Apply the pending schema migrations: the tables and indexes the app needs on top of the clinic schema."""
+    with connection() as conn:
+        names = migrations.apply(conn)
+    for name in names:
+        log.info(f"Applied migration: {name}.")
+    log.info("Schema is up to date.")
+
+@app.cli.command("init-schema")
+def init_schema():
+    """Same as migrate."""
+    migrate.callback()
+
+@app.cli.command("check-plans")
+def check_plans():
+    """Fail if a query of the busiest pages reads a large table sequentially."""
+    with connection() as conn:
+        failures = migrations.check_plans(conn)
+    if failures is None:
+        raise click.ClickException("No consultation with a procedure to check the plans with; seed the database first.")
+    for name, tables in failures.items():
+        click.echo(f"{name}: sequential scan on {', '.join(tables)}", err=True)
+    if failures:
+        raise click.ClickException(f"{len(failures)} of {len(migrations.PLAN_CHECKS)} queries fall back to a sequential scan.")
+    click.echo(f"All {len(migrations.PLAN_CHECKS)} queries use indexes.")
+
+@app.cli.command("rebuild-rollup")
+def rebuild_rollup():
+    """Recompute the consultation_rollup table from the base tables."""
+    with connection() as conn:
+        rows = rollup.rebuild(conn)
+    log.info(f"Rebuilt consultation_rollup with {rows} rows.")
+
+@app.cli.command("import-data")
+@click.argument("kind", type=click.Choice(list(importer.KINDS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), help="Defaults to the file extension.")
+@click.option("--rejects", type=click.Path(dir_okay=False), help="Defaults to <path>.rejected.csv.")
+def import_data_command(kind, path, fmt, rejects):
+    """Bulk import clients or appointments from a CSV or NDJSON file."""
+    rejects = rejects or path + ".rejected.csv"
+
+    try:
+        with open(path, encoding="utf-8", newline="") as stream, open(rejects, "wb") as rejects_file:
+            with connection() as conn:
+                result = importer.import_file(conn, kind, stream, import_format(path, fmt), rejects_file, validate_date)
+                conn.commit()
+    except UnicodeDecodeError as error:
+        raise click.ClickException(f"{path} is not valid UTF-8, nothing was imported: {error}")
+
+    click.echo(f"Imported {result['imported']} {kind}, rejected {result['rejected']} (see {rejects}).")
+
+@app.cli.command("export")
+@click.argument("kind", type=click.Choice(list(exports.EXPORTS)))
+@click.option("--format", "fmt", type=click.Choice(list(exports.FORMATS)), default="csv", show_default=True)
+@click.option("--from", "start", help="First date (YYYY-MM-DD).")
+@click.option("--to", "end", help="Last date (YYYY-MM-DD).")
+@click.option("--zip", "zip_code", help="Only the clients of this zip code.")
+@click.option("--client", help="Only this VAT client.")
+@click.option("--doctor", help="Only this VAT doctor (histories only).")
+@click.option("--output", type=click.Path(dir_okay=False), default="-", help="Defaults to the standard output.")
+def export_command(kind, fmt, start, end, zip_code, client, doctor, output):
+    """Export the consultation facts or the client histories as CSV or NDJSON."""
+    for value in (start, end):
+        if value and not validate_date(value):
+            raise click.BadParameter("from and to must be dates (YYYY-MM-DD)")
+    filters = {"start": start, "end": end, "zip": zip_code, "client": client, "doctor": doctor}
+    unsupported = exports.unsupported(kind, filters)
+    if unsupported:
+        raise click.BadParameter(f"{kind} cannot be filtered by {', '.join(unsupported)}")
+
+    size = 0
+    with click.open_file(output, "wb") as stream:
+        for chunk in exports.stream(kind, fmt, filters):
+            stream.write(chunk)
+            size += len(chunk)
+    if output != "-":
+        click.echo(f"Exported {size} bytes of {kind} to {output}.")
+
+def api_document(document, missing):
+    if document is None:
+        return jsonify({"error": missing}), 404
+    return app.response_class(document, mimetype="application/json")
+
+def api_list(query, params):
+    return app.response_class(stream_with_context(api.stream_documents(query, params, replica=use_replica())),
+                              mimetype="application/x-ndjson")
+
+def api_filters():
+    start = request.args.get("from")
+    end = request.args.get("to")
+    for value in (start, end):
+        if value and not validate_date(value):
+            return None
+    return {"client": request.args.get("client"), "doctor": request.args.get("doctor"),
+            "start": start or None, "end": end or None}
+
+@app.route("/api/v1/clients", methods=["GET"])
+def api_clients():
+    return api_list(api.LIST_CLIENTS, {"city": request.args.get("city")})
+
+@app.route("/api/v1/clients/<VAT>", methods=["GET"])
+def api_client(VAT):
+    return api_document(api.fetch_document(api.GET_CLIENT, {"VAT": VAT}, replica=use_replica()), "VAT client does not exist")
+
+@app.route("/api/v1/clients/<VAT>/history", methods=["GET"])
+def api_client_history(VAT):
+    return api_document(api.fetch_document(api.CLIENT_HISTORY, {"VAT": VAT}, replica=use_replica()), "VAT client does not exist")
+
+@app.route("/api/v1/appointments", methods=["GET"])
+def api_appointments():
+    filters = api_filters()
+    if filters is None:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD)"}), 400
+    return api_list(api.LIST_APPOINTMENTS, filters)
+
+@app.route("/api/v1/consultations", methods=["GET"])
+def api_consultations():
+    filters = api_filters()
+    if filters is None:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD)"}), 400
+    return api_list(api.LIST_CONSULTATIONS, filters)
+
+@app.route("/api/v1/consultations/<VAT_doctor>/<date_timestamp>", methods=["GET"])
+def api_consultation(VAT_doctor, date_timestamp):
+    if not importer.validate_timestamp(date_timestamp):
+        return jsonify({"error": "date_timestamp must be YYYY-MM-DD HH:MM:SS"}), 400
+    return api_document(api.fetch_document(api.GET_CONSULTATION,
+                                           {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp},
+                                           replica=use_replica()),
+                        "Consultation does not exist")
+
+@app.route("/api/v1/procedures", methods=["GET"])
+def api_procedures():
+    return api_list(api.LIST_PROCEDURES, {})
+
+@app.route("/api/v1/diagnostic-codes", methods=["GET"])
+def api_diagnostic_codes():
+    return api_list(api.LIST_DIAGNOSTIC_CODES, {})
+
+@app.route("/api/v1/nurses", methods=["GET"])
+def api_nurses():
+    return api_list(api.LIST_NURSES, {})
+
+@app.route("/export/<any(facts, histories):kind>.<any(csv, ndjson):fmt>", methods=["GET"])
+def export(kind, fmt):
+    filters = api_filters()
+    if filters is None:
+        return jsonify({"error": "from and to must be dates (YYYY-MM-DD)"}), 400
+    filters["zip"] = request.args.get("zip")
+    unsupported = exports.unsupported(kind, filters)
+    if unsupported:
+        return jsonify({"error": f"{kind} cannot be filtered by {', '.join(unsupported)}"}), 400
+    response = app.response_class(stream_with_context(exports.stream(kind, fmt, filters, replica=use_replica())),
+                                  mimetype=exports.FORMATS[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename={kind}.{fmt}"
+    return response
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return app.response_class("ok\n", mimetype="text/plain")
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    ready = warmup.ready(app)
+    state = warmup.state()
+    return jsonify({"ready": ready, "warmed": state["warmed"], "database": state["database"],
+                    "startup_seconds": state["startup_seconds"], "steps": state["steps"]}), 200 if ready else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics_export():
+    body, content_type = metrics.export()
+    return body, 200, {"Content-Type": content_type}
+
+def admin_only(view):
+    """Ask for HTTP basic authentication with the FLASK_ADMIN_PASSWORD password (any user name).
+
+    Without an admin password configured, the view is forbidden.
+    """
+    @functools.wraps(view)
+    def check(*args, **kwargs):
+        password = app.config.get("ADMIN_PASSWORD")
+        if not password:
+            return app.response_class("Set FLASK_ADMIN_PASSWORD to use the admin pages.\n", status=403,
+                                      mimetype="text/plain")
+        auth = request.authorization
+        if auth is None or not hmac.compare_digest((auth.password or "").encode(), str(password).encode()):
+            return app.response_class("Authentication required.\n", status=401, mimetype="text/plain",
+                                      headers={"WWW-Authenticate": 'Basic realm="admin"'})
+        return view(*args, **kwargs)
+    return check
+
+@app.route("/debug/pool", methods=["GET"])
+@admin_only
+def pool_status():
+    return jsonify({**pool_stats(), "replicas": replica_stats()})
+
+@app.route("/debug/refdata", methods=["GET"])
+@admin_only
+def refdata_status():
+    return jsonify(refdata.cache.stats())
+
+@app.route("/debug/slow-queries", methods=["GET"])
+@admin_only
+def slow_queries():
+    return render_template("debug/slow_queries.html", entries = slowlog.recorder.recent(), threshold = slowlog.SLOW_QUERY_MS)
+
 if __name__ == "__main__":
     app.run()
\ No newline at end of file
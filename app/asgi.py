@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+"""asyncio entry point, an alternative to ``wsgi.py``.
+
+The pages that issue several independent queries are served by async views
+that run those queries concurrently on an ``AsyncConnectionPool``. Every other
+route is handed to the regular Flask app, which runs in a thread pool, so the
+same routes and templates are served either way.
+
+    hypercorn asgi:app --bind 0.0.0.0:8080 --workers 2
+"""
+import asyncio
+import time
+from contextlib import AsyncExitStack
+
+import psycopg
+from asgiref.wsgi import WsgiToAsgi
+from psycopg_pool import AsyncConnectionPool
+from psycopg_pool import PoolTimeout
+from quart import Quart
+from quart import g
+from quart import make_response
+from quart import render_template
+from quart import request
+from quart import session
+from werkzeug.exceptions import HTTPException
+
+import consultation as consultation_loader
+import db
+import history
+import metrics
+import versions
+import warmup
+from app import template_cache
+from app import app as wsgi_app
+
+async_app = Quart(__name__)
+async_app.config.from_prefixed_env()
+async_app.secret_key = wsgi_app.secret_key
+# Its own files: templates compiled for async rendering differ from the WSGI app's.
+bytecode_cache = template_cache("quart-%s.cache")
+if bytecode_cache is not None:
+    async_app.jinja_options = {**async_app.jinja_options, "bytecode_cache": bytecode_cache}
+log = async_app.logger
+
+pool = None
+
+
+@async_app.before_serving
+async def open_pool():
+    # Runs in each worker once its event loop is up, i.e. after the fork.
+    global pool
+
+    pool = AsyncConnectionPool(
+        conninfo=db.DATABASE_URL,
+        min_size=db.POOL_MIN_SIZE,
+        max_size=db.POOL_MAX_SIZE,
+        max_idle=db.POOL_MAX_IDLE,
+        max_lifetime=db.POOL_MAX_LIFETIME,
+        timeout=db.POOL_TIMEOUT,
+        check=AsyncConnectionPool.check_connection,
+        connection_class=metrics.TimedAsyncConnection,
+        open=False,
+    )
+    await pool.open()
+
+    # The pool of the WSGI routes, the templates of both apps and the reference data.
+    await asyncio.to_thread(warmup.run, wsgi_app)
+    warmup.compile_templates(async_app)
+    try:
+        await warm_pool()
+    except (PoolTimeout, psycopg.Error) as error:
+        log.warning(f"Warm-up of the async pool failed: {error}")
+
+
+async def warm_pool():
+    """Run the queries of the async pages once on each of the ``min_size`` connections of the pool."""
+    await pool.wait(timeout=warmup.WARMUP_TIMEOUT)
+    pages = [
+        (history.PARTS, history.params(warmup.NO_CLIENT, size=async_app.config.get("TIMELINE_PAGE_SIZE", 20))),
+        (consultation_loader.PARTS, warmup.NO_CONSULTATION),
+    ]
+    async with AsyncExitStack() as stack:
+        conns = [await stack.enter_async_context(pool.connection()) for _ in range(pool.min_size)]
+        for conn in conns:
+            for queries, params in pages:
+                for query in queries.values():
+                    if query.prepare:
+                        async with conn.cursor(row_factory=query.rows) as cur:
+                            await query.execute(cur, params)
+
+
+@async_app.after_serving
+async def close_pool():
+    await pool.close()
+
+
+@async_app.before_request
+async def start_metrics():
+    metrics.start_request(request.endpoint or "unmatched")
+
+
+@async_app.after_request
+async def record_status(response):
+    g.status = response.status_code
+    return response
+
+
+@async_app.teardown_request
+async def finish_metrics(exception=None):
+    metrics.finish_request(request.method, g.get("status", 500))
+
+
+async def fetch_parts(queries, params, *parts):
+    """Run the ``parts`` of ``queries`` concurrently, each on its own pooled connection."""
+
+    async def fetch(part):
+        query = queries[part]
+        start = time.perf_counter()
+        async with pool.connection() as conn:
+            metrics.connection_acquired(time.perf_counter() - start)
+            async with conn.cursor(row_factory=query.rows) as cur:
+                await query.execute(cur, params)
+                return await query.result(cur)
+
+    results = await asyncio.gather(*(fetch(part) for part in parts))
+    return dict(zip(parts, results))
+
+
+def revalidating():
+    return bool(request.if_none_match) and not session.get("_flashes")
+
+
+def not_modified(etag):
+    response = async_app.response_class("", status=304)
+    response.set_etag(etag)
+    return response
+
+
+async def with_etag(body, etag):
+    response = await make_response(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def timeline_size():
+    size = request.args.get("size", async_app.config.get("TIMELINE_PAGE_SIZE", 20), type=int)
+    return max(1, min(size, async_app.config.get("TIMELINE_MAX_PAGE_SIZE", 200)))
+
+
+@async_app.route("/client/<VAT>", methods=["GET"])
+async def client_vat(VAT):
+    size = timeline_size()
+    params = history.params(VAT, history.before_from_args(request.args), size)
+    # Read before the page, never concurrently with it, so the page is never newer than its ETag says.
+    etag = versions.etag("client", (await fetch_parts(history.PARTS, params, "version"))["version"].version)
+    if revalidating() and request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    bundle = await fetch_parts(history.PARTS, params, "client", "timeline")
+    bundle["timeline"], bundle["older"] = history.page(bundle["timeline"], size)
+    log.debug(f"Found {len(bundle['timeline'])} appointment(s).")
+
+    return await with_etag(await render_template("clients/client_vat.html", **bundle), etag)
+
+
+@async_app.route("/client/<VAT>/<VAT_doctor>/<date_timestamp>", methods=["GET"])
+async def consultation_desc(VAT, VAT_doctor, date_timestamp):
+    params = {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp}
+    etag = versions.etag("consultation", (await fetch_parts(consultation_loader.PARTS, params, "version"))["version"].version)
+    if revalidating() and request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    bundle = await fetch_parts(consultation_loader.PARTS, params,
+                               "client", "appointment", "consultation", "procedures", "diagnosis", "nurses")
+
+    return await with_etag(await render_template("clients/consultation_desc.html", **bundle), etag)
+
+
+wsgi_fallback = WsgiToAsgi(wsgi_app)
+
+
+def is_async_route(scope):
+    adapter = async_app.url_map.bind("localhost")
+    try:
+        adapter.match(scope["path"], method=scope["method"])
+    except HTTPException:
+        return False
+    return True
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http" and not is_async_route(scope):
+        await wsgi_fallback(scope, receive, send)
+    else:
+        await async_app(scope, receive, send)
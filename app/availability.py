@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+"""Free appointment slots over a window of days."""
+from collections import Counter
+from collections import defaultdict
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+
+# Appointments over the window, for the availability page.
+BOOKED = """
+    SELECT VAT_doctor, date_timestamp
+    FROM appointment
+    WHERE date_timestamp >= %(start)s AND date_timestamp < %(end)s;
+"""
+
+# Appointments of some doctors over the window, for the booking suggestions.
+OCCUPANCY = """
+    SELECT VAT_doctor, date_timestamp
+    FROM appointment
+    WHERE date_timestamp >= %(start)s AND date_timestamp < %(end)s
+        AND VAT_doctor = ANY(%(doctors)s);
+"""
+
+
+def day_slots(opens="09:00", closes="18:00", minutes=60):
+    """Start times of the slots of a clinic day, e.g. 09:00, 10:00, ..., 17:00."""
+    current = datetime.combine(date.min, time.fromisoformat(opens))
+    end = datetime.combine(date.min, time.fromisoformat(closes))
+    step = timedelta(minutes=minutes)
+
+    slots = []
+    while current + step <= end:
+        slots.append(current.time())
+        current += step
+    return slots
+
+
+def free_slots(cur, start, days, slots, minutes, now=None):
+    """Return ``{"YYYY-MM-DD": ["HH:MM", ...]}`` of the slots where a doctor is free.
+
+    Only appointments inside ``[start, start + days)`` are read. An
+    appointment takes the slot of ``minutes`` that contains it, as in
+    ``next_free``. Days without any free slot, and slots that already
+    started, are left out.
+    """
+    now = now or datetime.now()
+    window_start = datetime.combine(start, time.min)
+    window_end = window_start + timedelta(days=days)
+
+    cur.execute("""
+        SELECT COUNT(*)
+        FROM doctor;
+    """)
+    doctors = cur.fetchone()[0]
+
+    occupancy = Occupancy(slots, minutes)
+    cur.execute(BOOKED, {"start": window_start, "end": window_end})
+    for row in cur.fetchall():
+        occupancy.book(row[0], row[1])
+    # (day, slot index): doctors booked then
+    booked = Counter((day, index) for (doctor, day), bitmap in occupancy.bitmaps.items()
+                     for index in range(len(slots)) if (bitmap >> index) & 1)
+
+    available = {}
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        free = []
+        for index, slot in enumerate(slots):
+            moment = datetime.combine(day, slot)
+            if moment > now and booked[(day, index)] < doctors:
+                free.append(slot.strftime("%H:%M"))
+        if free:
+            available[day.isoformat()] = free
+    return available
+
+
+class Occupancy:
+    """Per-doctor, per-day bitmaps of booked slots: bit ``i`` set means slot ``i`` is taken."""
+
+    def __init__(self, slots, minutes):
+        self.slots = slots
+        self.minutes = minutes
+        self.first = slots[0].hour * 60 + slots[0].minute if slots else 0
+        self.bitmaps = defaultdict(int)
+
+    def load(self, cur, doctors, start, end):
+        """Mark the appointments of ``doctors`` between the ``start`` and ``end`` days, in one query."""
+        cur.execute(OCCUPANCY, {"start": datetime.combine(start, time.min), "end": datetime.combine(end, time.min),
+              "doctors": list(doctors)})
+        for row in cur:
+            self.book(row[0], row[1])
+
+    def slot_of(self, moment):
+        """Index of the slot that contains ``moment``, or None outside clinic hours."""
+        index = (moment.hour * 60 + moment.minute - self.first) // self.minutes
+        if 0 <= index < len(self.slots):
+            return index
+        return None
+
+    def book(self, doctor, moment):
+        index = self.slot_of(moment)
+        if index is not None:
+            self.bitmaps[(doctor, moment.date())] |= 1 << index
+
+    def is_free(self, doctor, day, index):
+        return not (self.bitmaps.get((doctor, day), 0) >> index) & 1
+
+
+def next_free(cur, start, horizon, slots, minutes, n, specialization=None, now=None, chunk=14):
+    """Return the earliest ``n`` free (doctor, timestamp) pairs from ``start``.
+
+    Doctors can be restricted to a ``specialization``. Appointments are read
+    ``chunk`` days at a time, and never beyond ``horizon`` days from ``start``.
+    """
+    now = now or datetime.now()
+
+    cur.execute("""
+        SELECT d.VAT, e.name, d.specialization
+        FROM doctor AS d
+        JOIN employee AS e ON e.VAT = d.VAT
+        WHERE %(specialization)s::text IS NULL OR d.specialization = %(specialization)s
+        ORDER BY d.VAT;
+    """, {"specialization": specialization})
+    doctors = cur.fetchall()
+
+    found = []
+    offset = 0
+    while doctors and slots and offset < horizon and len(found) < n:
+        span = min(chunk, horizon - offset)
+        first_day = start + timedelta(days=offset)
+        occupancy = Occupancy(slots, minutes)
+        occupancy.load(cur, [doctor[0] for doctor in doctors], first_day, first_day + timedelta(days=span))
+
+        for day in (first_day + timedelta(days=i) for i in range(span)):
+            for index, slot in enumerate(slots):
+                moment = datetime.combine(day, slot)
+                if moment <= now:
+                    continue
+                for VAT, name, doctor_specialization in doctors:
+                    if occupancy.is_free(VAT, day, index):
+                        found.append({"vat_doctor": VAT, "name": name, "specialization": doctor_specialization,
+                                      "date_timestamp": moment.strftime("%Y-%m-%d %H:%M:%S")})
+                        if len(found) == n:
+                            return found
+        offset += span
+    return found
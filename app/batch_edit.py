@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""Edits a consultation in one go: SOAP notes, procedures, diagnostics and nurse.
+
+All the submitted changes are checked by a single set-based query, then
+applied in a single pipeline, in one transaction: either all of them are
+saved or none is.
+"""
+import rollup
+
+VALIDATE = """
+    SELECT 'Consultation does not exist' AS error
+    WHERE NOT EXISTS (
+        SELECT 1 FROM consultation
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+    )
+    UNION ALL
+    SELECT 'Invalid procedure name: ' || x.name
+    FROM unnest(%(add_procedures)s::text[]) AS x(name)
+    WHERE NOT EXISTS (SELECT 1 FROM procedure AS p WHERE p.name = x.name)
+        OR (x.name <> ALL(%(remove_procedures)s::text[]) AND EXISTS (
+            SELECT 1 FROM procedure_in_consultation AS pc
+            WHERE pc.VAT_doctor = %(VAT_doctor)s AND pc.date_timestamp = %(date_timestamp)s AND pc.name = x.name
+        ))
+    UNION ALL
+    SELECT 'Invalid ID: ' || x.ID
+    FROM unnest(%(add_diagnostics)s::text[]) AS x(ID)
+    WHERE NOT EXISTS (SELECT 1 FROM diagnostic_code AS dc WHERE dc.ID = x.ID)
+        OR (x.ID <> ALL(%(remove_diagnostics)s::text[]) AND EXISTS (
+            SELECT 1 FROM consultation_diagnostic AS cd
+            WHERE cd.VAT_doctor = %(VAT_doctor)s AND cd.date_timestamp = %(date_timestamp)s AND cd.ID = x.ID
+        ))
+    UNION ALL
+    SELECT 'Invalid VAT_nurse: ' || x.VAT
+    FROM unnest(%(add_nurses)s::text[]) AS x(VAT)
+    WHERE NOT EXISTS (SELECT 1 FROM nurse AS n WHERE n.VAT = x.VAT)
+    UNION ALL
+    SELECT 'A consultation has at most one nurse'
+    WHERE cardinality(%(add_nurses)s::text[]) + (
+        SELECT COUNT(*) FROM consultation_assistant AS ca
+        WHERE ca.VAT_doctor = %(VAT_doctor)s AND ca.date_timestamp = %(date_timestamp)s
+            AND ca.VAT_nurse <> ALL(%(remove_nurses)s::text[])
+    ) > 1;
+"""
+
+# name: statement; run in this order, removals before additions.
+STATEMENTS = {
+    "soap": """
+        UPDATE consultation
+        SET SOAP_S = %(soap_s)s, SOAP_O = %(soap_o)s, SOAP_A = %(soap_a)s, SOAP_P = %(soap_p)s
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND %(soap_s)s::text IS NOT NULL;
+    """,
+    "remove_charting": """
+        DELETE FROM procedure_charting
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND name = ANY(%(remove_procedures)s::text[]);
+    """,
+    "remove_imaging": """
+        DELETE FROM procedure_imaging
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND name = ANY(%(remove_procedures)s::text[]);
+    """,
+    "remove_procedures": """
+        DELETE FROM procedure_in_consultation
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND name = ANY(%(remove_procedures)s::text[]);
+    """,
+    "add_procedures": """
+        INSERT INTO procedure_in_consultation (name, VAT_doctor, date_timestamp, description)
+        SELECT x.name, %(VAT_doctor)s, %(date_timestamp)s, x.description
+        FROM unnest(%(add_procedures)s::text[], %(procedure_descriptions)s::text[]) AS x(name, description);
+    """,
+    "remove_prescriptions": """
+        DELETE FROM prescription
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND ID = ANY(%(remove_diagnostics)s::text[]);
+    """,
+    "remove_diagnostics": """
+        DELETE FROM consultation_diagnostic
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND ID = ANY(%(remove_diagnostics)s::text[]);
+    """,
+    "add_diagnostics": """
+        INSERT INTO consultation_diagnostic (VAT_doctor, date_timestamp, ID)
+        SELECT %(VAT_doctor)s, %(date_timestamp)s, x.ID
+        FROM unnest(%(add_diagnostics)s::text[]) AS x(ID);
+    """,
+    "remove_nurses": """
+        DELETE FROM consultation_assistant
+        WHERE VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s
+            AND VAT_nurse = ANY(%(remove_nurses)s::text[]);
+    """,
+    "add_nurses": """
+        INSERT INTO consultation_assistant (VAT_doctor, date_timestamp, VAT_nurse)
+        SELECT %(VAT_doctor)s, %(date_timestamp)s, x.VAT
+        FROM unnest(%(add_nurses)s::text[]) AS x(VAT);
+    """,
+}
+
+
+def unique(values):
+    """The non-empty ``values``, without duplicates, in order."""
+    return list(dict.fromkeys(value.strip() for value in values if value and value.strip()))
+
+
+def parse(form):
+    """Read the changes submitted by the edit form.
+
+    Procedures to add come as parallel ``procedure_name``/``procedure_description``
+    lists; rows without a name are ignored.
+    """
+    procedures = {}
+    for name, description in zip(form.getlist("procedure_name"), form.getlist("procedure_description")):
+        if name and name.strip():
+            procedures.setdefault(name.strip(), description or "")
+
+    soap = {field: form.get(field) for field in ("soap_s", "soap_o", "soap_a", "soap_p")}
+    if any(value is None for value in soap.values()):
+        soap = dict.fromkeys(soap)
+
+    return {
+        **soap,
+        "add_procedures": list(procedures),
+        "procedure_descriptions": list(procedures.values()),
+        "remove_procedures": unique(form.getlist("remove_procedure")),
+        "add_diagnostics": unique(form.getlist("add_diagnostic")),
+        "remove_diagnostics": unique(form.getlist("remove_diagnostic")),
+        "add_nurses": unique(form.getlist("add_nurse")),
+        "remove_nurses": unique(form.getlist("remove_nurse")),
+    }
+
+
+def apply(conn, VAT_doctor, date_timestamp, changes):
+    """Validate and save ``changes``; return the list of errors, empty on success.
+
+    Nothing is written, and the caller has nothing to roll back, when there
+    are errors. On success the caller commits.
+    """
+    params = {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, **changes}
+
+    with conn.cursor() as cur:
+        cur.execute(VALIDATE, params)
+        errors = [row[0] for row in cur.fetchall()]
+    if errors:
+        return errors
+
+    cursors = {}
+    with conn.pipeline():
+        for name, statement in STATEMENTS.items():
+            cur = conn.cursor()
+            cur.execute(statement, params)
+            cursors[name] = cur
+    counts = {name: cur.rowcount for name, cur in cursors.items()}
+    for cur in cursors.values():
+        cur.close()
+
+    procedures = counts["add_procedures"] - counts["remove_procedures"]
+    diagnostic_codes = counts["add_diagnostics"] - counts["remove_diagnostics"]
+    if procedures or diagnostic_codes:
+        with conn.cursor() as cur:
+            rollup.bump(cur, VAT_doctor, date_timestamp, procedures=procedures, diagnostic_codes=diagnostic_codes)
+    return []
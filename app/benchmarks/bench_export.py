@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""Measure the throughput and the memory of the streaming exports.
+
+Every export (facts and histories, CSV and NDJSON) of the database pointed to
+by ``DATABASE_URL`` is streamed to nowhere, once over all the rows and once
+over the last ``--days`` days, reporting rows and megabytes per second and
+the peak of Python memory held while streaming, which should not grow with
+the number of rows. For contrast, the same rows are then fetched into a list,
+as a page rendering them would.
+
+Seed a large dataset first, e.g. ``python benchmarks/datagen.py --scale 30``.
+
+    python benchmarks/bench_export.py --days 30
+"""
+import argparse
+import gc
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import date
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exports  # noqa: E402
+from db import connection  # noqa: E402
+
+
+def peak_rss():
+    """Peak resident memory of this process so far, in megabytes (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def drain(kind, fmt, filters):
+    """(rows, bytes, seconds) of streaming the export and dropping every chunk."""
+    lines = size = 0
+    start = time.perf_counter()
+    for chunk in exports.stream(kind, fmt, filters):
+        lines += chunk.count(b"\n")
+        size += len(chunk)
+    seconds = time.perf_counter() - start
+    # The CSV header is a line too.
+    return lines - (fmt == "csv"), size, seconds
+
+
+def traced_peak(function, *args):
+    """Peak bytes allocated by Python while ``function(*args)`` runs."""
+    gc.collect()
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def materialize(kind, filters):
+    """Fetch every row of the export into a list."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(exports.statement(kind, filters), filters)
+            return len(cur.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=30, help="days of the smaller export (default: 30)")
+    parser.add_argument("--zip", help="only export the clients of this zip code")
+    args = parser.parse_args()
+
+    scopes = {
+        "all rows": {"start": None, "end": None, "zip": args.zip, "client": None},
+        f"last {args.days} days": {"start": (date.today() - timedelta(days=args.days)).isoformat(),
+                                   "end": date.today().isoformat(), "zip": args.zip, "client": None},
+    }
+
+    for kind in exports.EXPORTS:
+        for fmt in exports.FORMATS:
+            print(f"{kind}.{fmt}")
+            for label, filters in scopes.items():
+                drain(kind, fmt, {**filters, "start": date.today().isoformat()})  # warm up the pool
+                rows, size, seconds = drain(kind, fmt, filters)
+                peak = traced_peak(drain, kind, fmt, filters)
+                print(f"  {label:>16}: {rows} rows, {size / 1e6:.1f} MB in {seconds:.2f}s, "
+                      f"{rows / seconds:.0f} rows/s, {size / 1e6 / seconds:.1f} MB/s, "
+                      f"{peak / 1e6:.2f} MB Python peak")
+    print(f"Peak RSS after streaming: {peak_rss():.0f} MB")
+
+    for kind in exports.EXPORTS:
+        filters = scopes["all rows"]
+        peak = traced_peak(materialize, kind, filters)
+        print(f"{kind} fetched into a list: {peak / 1e6:.1f} MB Python peak")
+    print(f"Peak RSS after fetching into lists: {peak_rss():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
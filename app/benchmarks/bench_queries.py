@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""Measure what the query catalog saves: parsing and planning, and row allocations.
+
+1. The queries of the client and consultation pages are run ``--repeat``
+   times on one connection, never prepared (parsed and planned every time)
+   and prepared on the server (planned once), against the database pointed to
+   by ``DATABASE_URL``, which must hold at least one consultation.
+2. ``--rows`` synthetic client rows are fetched as namedtuples and as the
+   slotted rows of the catalog, comparing the time and the memory they take.
+
+    python benchmarks/bench_queries.py --repeat 2000 --rows 200000
+"""
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.rows import namedtuple_row
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import queries  # noqa: E402
+from db import DATABASE_URL  # noqa: E402
+
+PAGES = [queries.CLIENT_VERSION, queries.CLIENT, queries.CLIENT_TIMELINE, queries.APPOINTMENT, queries.CONSULTATION,
+         queries.PROCEDURES, queries.DIAGNOSES, queries.NURSES]
+
+SAMPLE = """
+    SELECT a.VAT_client AS "VAT", a.VAT_doctor AS "VAT_doctor", a.date_timestamp AS "date_timestamp",
+        NULL::timestamp AS "before_date", NULL::text AS "before_doctor", 21 AS "limit"
+    FROM consultation AS c
+    JOIN appointment AS a ON a.VAT_doctor = c.VAT_doctor AND a.date_timestamp = c.date_timestamp
+    LIMIT 1;
+"""
+
+SYNTHETIC_CLIENTS = queries.Query("synthetic_clients", """
+    SELECT lpad(i::text, 9, '0') AS VAT, 'Client ' || i AS name, DATE '1980-01-01' + i % 10000 AS birth_date,
+        i || ' Main St' AS street, 'Lisbon' AS city, '1000-001' AS zip, 'F' AS gender
+    FROM generate_series(1, %(rows)s) AS i;
+""", queries.CLIENT.columns)
+
+
+def run_pages(conn, params, repeat, prepare):
+    """Seconds taken by each run of all the page queries."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for query in PAGES:
+            with conn.cursor(row_factory=query.rows) as cur:
+                cur.execute(query.sql, params, prepare=prepare)
+                query.result(cur)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def fetch_rows(conn, rows, row_factory):
+    """(seconds, bytes allocated) to fetch ``rows`` synthetic clients with ``row_factory``."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with conn.cursor(row_factory=row_factory) as cur:
+        cur.execute(SYNTHETIC_CLIENTS.sql, {"rows": rows})
+        fetched = cur.fetchall()
+    seconds = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del fetched
+    return seconds, allocated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1000, help="runs of the page queries (default: 1000)")
+    parser.add_argument("--rows", type=int, default=100000, help="synthetic rows fetched (default: 100000)")
+    args = parser.parse_args()
+
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        # Only the explicit prepare=True of the catalog prepares anything.
+        conn.prepare_threshold = None
+        params = conn.cursor(row_factory=dict_row).execute(SAMPLE).fetchone()
+        if params is None:
+            sys.exit("No consultation in the database; seed it first (benchmarks/loadtest.py --seed).")
+
+        print(f"{len(PAGES)} page queries x {args.repeat}")
+        for label, prepare in (("parsed and planned every time", False), ("prepared", True)):
+            run_pages(conn, params, min(args.repeat, 50), prepare)  # warm up
+            timings = run_pages(conn, params, args.repeat, prepare)
+            print(f"  {label:>30}: mean {statistics.mean(timings) * 1000:.3f} ms, "
+                  f"p50 {statistics.median(timings) * 1000:.3f} ms per page set")
+
+        print(f"{args.rows} rows fetched")
+        for label, row_factory in (("namedtuple_row", namedtuple_row), ("catalog slotted rows", SYNTHETIC_CLIENTS.rows)):
+            fetch_rows(conn, min(args.rows, 1000), row_factory)  # warm up
+            seconds, allocated = fetch_rows(conn, args.rows, row_factory)
+            print(f"  {label:>30}: {seconds * 1000:.1f} ms, {allocated / args.rows:.0f} bytes per row held")
+
+
+if __name__ == "__main__":
+    main()
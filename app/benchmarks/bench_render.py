@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""Measure the time to first byte and the memory of the list pages, rendered in full and streamed.
+
+1. gunicorn (one worker, one thread) is started on the database pointed to by
+   ``DATABASE_URL`` with ``FLASK_STREAM_PAGES=0``, which fetches all the
+   rows of a page and renders it in full before sending it, as every page
+   did before it was streamed, then with ``=1``. The client list and the
+   dashboard are requested with pages of every ``--sizes`` rows,
+   ``--repeat`` times each. The median time to the first byte of the body
+   and to the last one are reported, with the peak resident memory of the
+   worker after each size (read from /proc, so Linux only). Each mode gets
+   a fresh worker, and sizes go up, so the peak is that of the largest page
+   so far.
+2. Every template is compiled without a bytecode cache, into an empty one
+   and out of a filled one, as a restarted worker would.
+
+Results are printed and saved as JSON under ``benchmarks/results``. Seed a
+large dataset first, e.g. ``python benchmarks/datagen.py --scale 10``.
+
+    python benchmarks/bench_render.py --sizes 50,500,5000 --repeat 5
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
+from jinja2 import FileSystemLoader
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from db import DATABASE_URL  # noqa: E402
+from loadtest import RESULTS_DIR  # noqa: E402
+from loadtest import git_commit  # noqa: E402
+from loadtest import wait_until_ready  # noqa: E402
+
+PAGES = {
+    "clients": "/clients?size={size}",
+    "dashboard": "/dashboard?bucket=day&size={size}",
+}
+
+
+def serve(port, stream):
+    return subprocess.Popen(
+        ["gunicorn", "wsgi:app", "--bind", f"127.0.0.1:{port}", "--workers", "1", "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=dict(os.environ, DATABASE_URL=DATABASE_URL, FLASK_STREAM_PAGES=str(int(stream)),
+                 FLASK_CLIENTS_MAX_PAGE_SIZE="1000000", FLASK_DASHBOARD_MAX_PAGE_SIZE="1000000"),
+    )
+
+
+def worker_peak_rss(server):
+    """Peak resident memory of the gunicorn worker, in megabytes."""
+    with open(f"/proc/{server.pid}/task/{server.pid}/children") as f:
+        worker = f.read().split()[0]
+    with open(f"/proc/{worker}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def fetch(port, path):
+    """(seconds to the first byte of the body, seconds to the last, bytes) of ``GET path``."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+    start = time.perf_counter()
+    conn.request("GET", path)
+    response = conn.getresponse()
+    first = response.read(1)
+    first_byte = time.perf_counter() - start
+    size = len(first) + len(response.read())
+    conn.close()
+    return first_byte, time.perf_counter() - start, size
+
+
+def measure_pages(port, stream, sizes, repeat):
+    """{page: {size: {ttfb_ms, total_ms, mb, peak_rss_mb}}} in one mode."""
+    label = "streamed" if stream else "rendered in full"
+    results = {name: {} for name in PAGES}
+    server = serve(port, stream)
+    try:
+        wait_until_ready(port, server)
+        for size in sizes:
+            for name, path in PAGES.items():
+                path = path.format(size=size)
+                fetch(port, path)  # warm up
+                runs = [fetch(port, path) for _ in range(repeat)]
+                results[name][size] = {
+                    "ttfb_ms": round(statistics.median(run[0] for run in runs) * 1000, 1),
+                    "total_ms": round(statistics.median(run[1] for run in runs) * 1000, 1),
+                    "mb": round(runs[0][2] / 1e6, 2),
+                }
+            rss = worker_peak_rss(server)
+            for name in PAGES:
+                results[name][size]["peak_rss_mb"] = round(rss)
+                print(f"  {label:>16} {name:>9} {size:>7} rows: TTFB {results[name][size]['ttfb_ms']:8.1f} ms, "
+                      f"total {results[name][size]['total_ms']:8.1f} ms, {results[name][size]['mb']:6.2f} MB, "
+                      f"worker peak RSS {rss:.0f} MB")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return results
+
+
+def compile_templates(cache_dir):
+    """Seconds to compile every template with a fresh environment, as a new worker does."""
+    cache = FileSystemBytecodeCache(cache_dir, "flask-%s.cache") if cache_dir else None
+    env = Environment(loader=FileSystemLoader(os.path.join(APP_DIR, "templates")), bytecode_cache=cache)
+    start = time.perf_counter()
+    for name in env.list_templates():
+        env.get_template(name)
+    return time.perf_counter() - start
+
+
+def counts(value):
+    return [int(part) for part in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=counts, default=[50, 500, 5000], help="comma-separated rows per page")
+    parser.add_argument("--repeat", type=int, default=5, help="requests per page and size (default: 5)")
+    parser.add_argument("--port", type=int, default=8098)
+    parser.add_argument("--output", help="JSON file to write, by default one in benchmarks/results")
+    args = parser.parse_args()
+
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+    }
+
+    print("Pages")
+    results["pages"] = {("streamed" if stream else "rendered in full"): measure_pages(args.port, stream,
+                                                                                     sorted(args.sizes), args.repeat)
+                        for stream in (False, True)}
+
+    print("Templates")
+    results["templates_ms"] = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for label, directory in (("no bytecode cache", None), ("empty cache", cache_dir), ("filled cache", cache_dir)):
+            results["templates_ms"][label] = round(compile_templates(directory) * 1000, 1)
+            print(f"  {label:>17}: {results['templates_ms'][label]:.1f} ms")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"render-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""Compare the indexed client search with the former ILIKE scan of clients2.
+
+A synthetic ``client`` table is generated in a scratch schema of the database
+pointed to by ``DATABASE_URL``; the app's own tables are left untouched.
+
+    python benchmarks/bench_search.py --rows 500000 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from db import DATABASE_URL  # noqa: E402
+
+SCHEMA = "bench_search"
+
+LEGACY_SEARCH = """
+    SELECT *
+    FROM client
+    WHERE name ILIKE %(search_like)s
+    OR VAT = %(search)s
+    OR street ILIKE %(search_like)s
+    OR city ILIKE %(search_like)s
+    OR zip ILIKE %(search_like)s
+    ORDER BY name ASC;
+"""
+
+CREATE_CLIENT = """
+    CREATE TABLE client(
+        VAT VARCHAR(20),
+        name VARCHAR(80) NOT NULL,
+        birth_date DATE NOT NULL,
+        street VARCHAR(255) NOT NULL,
+        city VARCHAR(30) NOT NULL,
+        zip VARCHAR(12) NOT NULL,
+        gender CHAR(1) NOT NULL,
+        PRIMARY KEY(VAT),
+        CHECK(LENGTH(zip) >= 2)
+    );
+"""
+
+POPULATE_CLIENT = """
+    INSERT INTO client (VAT, name, birth_date, street, city, zip, gender)
+    SELECT lpad(i::text, 9, '0'),
+        w.first[1 + floor(random() * array_length(w.first, 1))::int] || ' '
+            || w.last[1 + floor(random() * array_length(w.last, 1))::int],
+        DATE '1940-01-01' + floor(random() * 25000)::int,
+        (1 + floor(random() * 999))::int || ' ' || w.streets[1 + floor(random() * array_length(w.streets, 1))::int] || ' St',
+        w.cities[1 + floor(random() * array_length(w.cities, 1))::int],
+        lpad(floor(random() * 10000000)::int::text, 7, '0'),
+        CASE WHEN random() < 0.5 THEN 'M' ELSE 'F' END
+    FROM generate_series(1, %(rows)s) AS i,
+        (SELECT
+            ARRAY['Afonso', 'Ana', 'Beatriz', 'Carlos', 'Diogo', 'Inês', 'João', 'Margarida', 'Maria',
+                'Mariana', 'Pedro', 'Rui', 'Sofia', 'Tomás', 'Tiago', 'Rita'] AS first,
+            ARRAY['Almeida', 'Alemão', 'Costa', 'Daniel', 'Ferreira', 'Fonseca', 'Gomes', 'Martins',
+                'Oliveira', 'Pereira', 'Rodrigues', 'Santos', 'Silva', 'Sousa'] AS last,
+            ARRAY['Viana da Mota', 'Estalagem', 'Carlos Mardel', 'Oak', 'Pine', 'Elm', 'Main',
+                'Liberdade', 'Almirante Reis', 'Rovisco Pais'] AS streets,
+            ARRAY['Lisbon', 'Porto', 'Coimbra', 'Braga', 'Faro', 'Aveiro', 'Setúbal', 'Évora'] AS cities
+        ) AS w;
+"""
+
+TERMS = {
+    "exact VAT": "000012345",
+    "name prefix": "Marg",
+    "substring": "Mardel",
+    "typo": "Fonsceca",
+    "city": "Coimbra",
+}
+
+
+def timed(cur, query, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(query, params)
+        rows = len(cur.fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+    return rows, timings
+
+
+def report(label, term, rows, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{label:<8} {term:<12} rows={rows:<7} median={statistics.median(timings):9.2f}ms p95={p95:9.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seed", type=float, default=0.42)
+    parser.add_argument("--keep", action="store_true", help="do not drop the scratch schema at the end")
+    args = parser.parse_args()
+
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        with conn.cursor() as cur:
+            # Installed up front so it lives in public, not in the scratch schema.
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+            cur.execute(f"CREATE SCHEMA {SCHEMA};")
+            cur.execute(f"SET search_path TO {SCHEMA}, public;")
+            cur.execute(CREATE_CLIENT)
+            cur.execute("SELECT setseed(%(seed)s);", {"seed": args.seed})
+            start = time.perf_counter()
+            cur.execute(POPULATE_CLIENT, {"rows": args.rows})
+            cur.execute("ANALYZE client;")
+            print(f"Generated {args.rows} clients in {time.perf_counter() - start:.1f}s")
+
+            for term, value in TERMS.items():
+                params = {"search": value, "search_like": "%" + value + "%"}
+                report("legacy", term, *timed(cur, LEGACY_SEARCH, params, args.repeat))
+
+            start = time.perf_counter()
+            for statement in search.SCHEMA:
+                cur.execute(statement)
+            cur.execute("ANALYZE client;")
+            print(f"Built search indexes in {time.perf_counter() - start:.1f}s")
+
+            for term, value in TERMS.items():
+                rows, timings = [], []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    rows = search.search_clients(cur, value, args.limit)
+                    timings.append((time.perf_counter() - start) * 1000)
+                report("search", term, len(rows), timings)
+
+            if not args.keep:
+                cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE;")
+
+
+if __name__ == "__main__":
+    main()
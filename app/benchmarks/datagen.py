@@ -0,0 +1,410 @@
+#!/usr/bin/python3
+"""Deterministic synthetic dataset of the whole clinic schema, loaded with COPY.
+
+The database pointed to by ``DATABASE_URL`` is recreated from ``schema.sql``
+(this DROPS every table of the clinic, so only point it at a scratch
+database) and filled with ``--scale`` units of data: one unit is 4000
+clients, 10 doctors, 4 nurses and 2 receptionists, and about 35000
+appointments over the last two years and the next two months, so a scale of
+30 gives about a million appointments.
+
+- Doctors work weekdays, one appointment per hour from 09:00 to 18:00 (the
+  app's default slots), take days off, and are more or less busy; the next
+  days are more booked than the following weeks.
+- Visits per client are skewed: a tenth of the clients make almost half of
+  the appointments.
+- Nine past appointments in ten became a consultation, with one nurse,
+  mostly 0 to 2 procedures and diagnostics picked by popularity,
+  prescriptions for some diagnostics, charting of several teeth for charting
+  procedures and an image for radiographies.
+
+The same ``--seed``, ``--scale`` and ``--today`` always give the same rows,
+whatever the number of ``--jobs``: every client chunk and every doctor has
+its own random generator. Clients, staff and reference tables are loaded in
+parallel, then the appointments and what hangs from them, in parallel across
+doctors, each process with its own connection and COPY streams.
+
+    python benchmarks/datagen.py --scale 30 --seed 42 --jobs 8
+"""
+import argparse
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from datetime import datetime
+from datetime import time as day_time
+from datetime import timedelta
+
+import psycopg
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from db import DATABASE_URL  # noqa: E402
+
+CLIENTS_PER_UNIT = 4000
+DOCTORS_PER_UNIT = 10
+NURSES_PER_UNIT = 4
+RECEPTIONISTS_PER_UNIT = 2
+# Clients generated and copied by one task.
+CLIENT_CHUNK = 50000
+
+DAYS_BACK = 730
+DAYS_AHEAD = 60
+OPENS, CLOSES = 9, 18
+# A client rank is u ** VISITS_SKEW of the client count, u uniform in [0, 1).
+VISITS_SKEW = 3
+
+FIRST_NAMES = ["Afonso", "Ana", "Beatriz", "Carlos", "Diogo", "Inês", "João", "Margarida", "Maria", "Mariana",
+               "Pedro", "Rui", "Sofia", "Tomás", "Tiago", "Rita", "Francisco", "Leonor", "Duarte", "Matilde"]
+LAST_NAMES = ["Almeida", "Alemão", "Costa", "Daniel", "Ferreira", "Fonseca", "Gomes", "Martins", "Oliveira",
+              "Pereira", "Rodrigues", "Santos", "Silva", "Sousa", "Carvalho", "Lopes", "Marques", "Ribeiro"]
+STREETS = ["Rua Viana da Mota", "Rua da Estalagem", "Rua Carlos Mardel", "Avenida da Liberdade",
+           "Avenida Almirante Reis", "Avenida Rovisco Pais", "Rua de Santa Catarina", "Rua Augusta",
+           "Rua do Carmo", "Avenida da Boavista"]
+# city: (weight, first digit of the zip codes)
+CITIES = {"Lisbon": (30, 1), "Porto": (20, 4), "Coimbra": (8, 3), "Braga": (8, 4), "Faro": (5, 8),
+          "Aveiro": (5, 3), "Setúbal": (6, 2), "Évora": (3, 7), "Sintra": (8, 2), "Amadora": (7, 2)}
+
+SPECIALIZATIONS = {"General dentistry": 5, "Orthodontics": 2, "Periodontics": 1, "Endodontics": 1,
+                   "Oral surgery": 1, "Pediatric dentistry": 1}
+
+# (name, type, popularity)
+PROCEDURES = [
+    ("Dental cleaning", "cleaning", 30), ("Filling", "filling", 20), ("Radiography", "radiography", 15),
+    ("Dental charting", "dental charting", 12), ("Fluoride treatment", "cleaning", 6),
+    ("Root canal", "endodontics", 5), ("Extraction", "surgery", 4), ("Crown", "prosthodontics", 3),
+    ("Scaling and root planing", "periodontics", 3), ("Sealant", "prevention", 3), ("Whitening", "cosmetic", 2),
+    ("Braces adjustment", "orthodontics", 2), ("Implant", "surgery", 1), ("Bridge", "prosthodontics", 1),
+]
+
+# (ID, description, popularity)
+DIAGNOSTIC_CODES = [
+    ("K02.5", "Dental caries on pit and fissure surface penetrating into dentin", 20),
+    ("K02.3", "Arrested dental caries", 8), ("K02.9", "Dental caries, unspecified", 10),
+    ("K03.6", "Deposits (accretions) on teeth", 12), ("K05.1", "Chronic gingivitis", 14),
+    ("K05.3", "Chronic periodontitis", 6), ("K04.0", "Pulpitis", 5), ("K04.7", "Periapical abscess", 2),
+    ("K08.1", "Complete loss of teeth", 1), ("K07.3", "Anomalies of tooth position", 4),
+    ("K01.1", "Impacted teeth", 3), ("K06.0", "Gingival recession", 4), ("K00.6", "Disturbances in tooth eruption", 2),
+    ("K03.1", "Abrasion of teeth", 3), ("K08.8", "Toothache", 6),
+]
+# (ID1, ID2, type)
+DIAGNOSTIC_CODE_RELATIONS = [("K02.5", "K04.0", "progression"), ("K04.0", "K04.7", "progression"),
+                             ("K05.1", "K05.3", "progression"), ("K05.3", "K06.0", "progression"),
+                             ("K02.9", "K02.5", "specialization"), ("K02.9", "K02.3", "specialization")]
+
+MEDICATIONS = [("Amoxicillin", "Bial"), ("Amoxicillin", "Generis"), ("Ibuprofen", "Bayer"), ("Ibuprofen", "Generis"),
+               ("Paracetamol", "Bial"), ("Chlorhexidine mouthwash", "GSK"), ("Metronidazole", "Pfizer"),
+               ("Clindamycin", "Pfizer"), ("Fluoride toothpaste", "Colgate"), ("Benzocaine gel", "Bayer")]
+# diagnostic ID prefix: medications prescribed for it
+TREATMENTS = {"K02": [0, 2, 4, 8], "K03": [5, 8], "K04": [0, 1, 6, 7, 2], "K05": [5, 6, 0], "K06": [5, 8],
+              "K07": [2, 4], "K08": [2, 4, 9], "K01": [0, 2, 7], "K00": [4, 9]}
+DOSAGES = ["1 tablet every 8 hours for 7 days", "1 tablet every 12 hours for 5 days", "Rinse twice a day",
+           "Apply 3 times a day", "1 tablet when in pain, up to 3 a day"]
+
+TOOTH_NAMES = ["Central incisor", "Lateral incisor", "Canine", "First premolar", "Second premolar", "First molar",
+               "Second molar", "Third molar"]
+TEETH = [(str(quadrant), str(number)) for quadrant in range(1, 5) for number in range(1, 9)]
+
+DESCRIPTIONS = ["Regular checkup", "Toothache", "Cleaning", "Follow-up", "Broken tooth", "Orthodontic review",
+                "Sensitivity to cold", "Bleeding gums"]
+SOAP = {
+    "S": ["Pain when chewing.", "No complaints.", "Sensitivity to cold drinks.", "Bleeding when brushing.",
+          "Came for a routine checkup.", "Pain since last week."],
+    "O": ["Caries on 36.", "Plaque and calculus.", "Gingival inflammation.", "No lesions found.",
+          "Fractured cusp on 24.", "Good oral hygiene."],
+    "A": ["Dental caries.", "Gingivitis.", "Healthy dentition.", "Periodontitis.", "Pulpitis."],
+    "P": ["Filling.", "Cleaning in 6 months.", "Improve brushing, floss daily.", "Root canal next visit.",
+          "Follow-up in 2 weeks."],
+}
+
+# Procedures and diagnostics per consultation: (counts, weights)
+PROCEDURE_COUNTS = ([0, 1, 2, 3, 4], [35, 40, 17, 6, 2])
+DIAGNOSTIC_COUNTS = ([0, 1, 2, 3], [40, 40, 15, 5])
+
+# table: columns, in COPY order
+COLUMNS = {
+    "client": "VAT, name, birth_date, street, city, zip, gender",
+    "phone_number_client": "VAT, phone",
+    "employee": "VAT, name, birth_date, street, city, zip, IBAN, salary",
+    "phone_number_employee": "VAT, phone",
+    "receptionist": "VAT",
+    "nurse": "VAT",
+    "doctor": "VAT, specialization, biography, email",
+    "permanent_doctor": "VAT, years",
+    "trainee_doctor": "VAT, supervisor",
+    "supervison_report": "VAT, date_timestamp, description, evaluation",
+    "procedure": "name, type",
+    "diagnostic_code": "ID, description",
+    "diagnostic_code_relation": "ID1, ID2, type",
+    "medication": "name, lab",
+    "teeth": "quadrant, number, name",
+    "appointment": "VAT_doctor, date_timestamp, VAT_client, description",
+    "consultation": "VAT_doctor, date_timestamp, SOAP_S, SOAP_O, SOAP_A, SOAP_P",
+    "consultation_assistant": "VAT_doctor, date_timestamp, VAT_nurse",
+    "procedure_in_consultation": "name, VAT_doctor, date_timestamp, description",
+    "consultation_diagnostic": "VAT_doctor, date_timestamp, ID",
+    "prescription": "VAT_doctor, date_timestamp, ID, name, lab, dosage, description",
+    "procedure_charting": "name, VAT_doctor, date_timestamp, quadrant, number, description, measure",
+    "procedure_imaging": "name, VAT_doctor, date_timestamp, file",
+}
+
+# Children after their parents, so each activity task can load them in one transaction.
+ACTIVITY_TABLES = ["appointment", "consultation", "consultation_assistant", "procedure_in_consultation",
+                   "consultation_diagnostic", "prescription", "procedure_charting", "procedure_imaging"]
+
+
+def rng_for(seed, *key):
+    """A random generator of its own for ``key``, the same on every run with ``seed``."""
+    return random.Random(":".join(str(part) for part in (seed, *key)))
+
+
+def client_vat(index):
+    return f"{index:09d}"
+
+
+def employee_vat(index):
+    return f"E{index:08d}"
+
+
+def make_plan(url, scale, seed, today):
+    """What every task needs to know of the dataset; small enough to send to each process."""
+    clients = max(100, round(CLIENTS_PER_UNIT * scale))
+    doctors = max(4, round(DOCTORS_PER_UNIT * scale))
+    nurses = max(2, round(NURSES_PER_UNIT * scale))
+    receptionists = max(1, round(RECEPTIONISTS_PER_UNIT * scale))
+
+    # Spreads the busiest client ranks over the whole VAT range.
+    stride = 7919
+    while math.gcd(stride, clients) != 1:
+        stride += 2
+
+    return {
+        "url": url, "seed": seed, "today": today, "clients": clients, "stride": stride,
+        "doctors": [employee_vat(i) for i in range(1, doctors + 1)],
+        "nurses": [employee_vat(i) for i in range(doctors + 1, doctors + nurses + 1)],
+        "receptionists": [employee_vat(i) for i in range(doctors + nurses + 1, doctors + nurses + receptionists + 1)],
+    }
+
+
+def copy_rows(cur, table, rows):
+    with cur.copy(f"COPY {table} ({COLUMNS[table]}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+    return len(rows)
+
+
+def person(rng):
+    """Name, birth date, street, city and zip code of someone."""
+    city = rng.choices(list(CITIES), weights=[weight for weight, _ in CITIES.values()])[0]
+    return (f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            date(1940, 1, 1) + timedelta(days=rng.randrange(25000)),
+            f"{rng.choice(STREETS)} {rng.randint(1, 300)}", city,
+            f"{CITIES[city][1]}{rng.randrange(1000):03d}-{rng.randrange(1000):03d}")
+
+
+def phones(rng, VAT):
+    numbers = {f"9{rng.choice('1236')}{rng.randrange(10 ** 7):07d}" for _ in range(rng.choice([1, 1, 1, 2]))}
+    return [(VAT, number) for number in sorted(numbers)]
+
+
+def load_clients(plan, first, last):
+    """Clients ``first`` to ``last - 1`` and their phone numbers."""
+    rng = rng_for(plan["seed"], "clients", first)
+    clients, phone_numbers = [], []
+    for index in range(first, last):
+        VAT = client_vat(index)
+        name, birth_date, street, city, zip_code = person(rng)
+        clients.append((VAT, name, birth_date, street, city, zip_code, rng.choice("MF")))
+        phone_numbers.extend(phones(rng, VAT))
+
+    with psycopg.connect(plan["url"]) as conn:
+        with conn.cursor() as cur:
+            return {"client": copy_rows(cur, "client", clients),
+                    "phone_number_client": copy_rows(cur, "phone_number_client", phone_numbers)}
+
+
+def load_staff(plan):
+    """Employees, with their roles; one doctor in five is a trainee supervised by a permanent doctor."""
+    rng = rng_for(plan["seed"], "staff")
+    rows = {table: [] for table in ("employee", "phone_number_employee", "receptionist", "nurse", "doctor",
+                                    "permanent_doctor", "trainee_doctor", "supervison_report")}
+
+    for VAT in plan["doctors"] + plan["nurses"] + plan["receptionists"]:
+        name, birth_date, street, city, zip_code = person(rng)
+        birth_date = min(max(birth_date, date(1950, 1, 1)), date(2000, 1, 1))
+        rows["employee"].append((VAT, name, birth_date, street, city, zip_code,
+                                 f"PT50{int(VAT[1:]):021d}", rng.randrange(1200, 6000, 50)))
+        rows["phone_number_employee"].extend(phones(rng, VAT))
+
+    permanent = [VAT for index, VAT in enumerate(plan["doctors"]) if index == 0 or rng.random() >= 0.2]
+    for index, VAT in enumerate(plan["doctors"]):
+        specialization = rng.choices(list(SPECIALIZATIONS), weights=list(SPECIALIZATIONS.values()))[0]
+        rows["doctor"].append((VAT, specialization, f"Graduated in dental medicine, works in {specialization.lower()}.",
+                               f"doctor{index + 1}@clinic.pt"))
+        if VAT in permanent:
+            rows["permanent_doctor"].append((VAT, rng.randint(1, 30)))
+            continue
+        rows["trainee_doctor"].append((VAT, rng.choice(permanent)))
+        for month in range(12):
+            rows["supervison_report"].append((
+                VAT, datetime.combine(plan["today"] - timedelta(days=30 * (month + 1)), day_time(18)),
+                rng.choice(["Good progress.", "Needs to improve charting.", "Excellent with patients."]),
+                rng.choice([3, 3.5, 4, 4.5, 5])))
+
+    rows["nurse"] = [(VAT,) for VAT in plan["nurses"]]
+    rows["receptionist"] = [(VAT,) for VAT in plan["receptionists"]]
+
+    with psycopg.connect(plan["url"]) as conn:
+        with conn.cursor() as cur:
+            return {table: copy_rows(cur, table, table_rows) for table, table_rows in rows.items()}
+
+
+def load_reference(plan):
+    """Procedures, diagnostic codes, medications and teeth."""
+    rows = {
+        "procedure": [(name, kind) for name, kind, _ in PROCEDURES],
+        "diagnostic_code": [(ID, description) for ID, description, _ in DIAGNOSTIC_CODES],
+        "diagnostic_code_relation": DIAGNOSTIC_CODE_RELATIONS,
+        "medication": MEDICATIONS,
+        "teeth": [(quadrant, number, TOOTH_NAMES[int(number) - 1]) for quadrant, number in TEETH],
+    }
+    with psycopg.connect(plan["url"]) as conn:
+        with conn.cursor() as cur:
+            return {table: copy_rows(cur, table, table_rows) for table, table_rows in rows.items()}
+
+
+def pick(rng, population, weights, k):
+    """``k`` distinct items of ``population``, more popular ones first."""
+    picked = []
+    while len(picked) < k:
+        item = rng.choices(population, weights=weights)[0]
+        if item not in picked:
+            picked.append(item)
+    return picked
+
+
+def doctor_activity(plan, index, VAT):
+    """The rows of every table of ``ACTIVITY_TABLES`` for one doctor."""
+    rng = rng_for(plan["seed"], "doctor", VAT)
+    rows = {table: [] for table in ACTIVITY_TABLES}
+    clients, stride = plan["clients"], plan["stride"]
+    today = plan["today"]
+    busy = rng.uniform(0.55, 0.9)
+    usual_nurse = plan["nurses"][index % len(plan["nurses"])]
+    procedure_names = [name for name, _, _ in PROCEDURES]
+    procedure_weights = [weight for _, _, weight in PROCEDURES]
+    procedure_types = {name: kind for name, kind, _ in PROCEDURES}
+    codes = [ID for ID, _, _ in DIAGNOSTIC_CODES]
+    code_weights = [weight for _, _, weight in DIAGNOSTIC_CODES]
+
+    for offset in range(-DAYS_BACK, DAYS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        if day.weekday() >= 5 or rng.random() < 0.08:
+            continue
+        rate = busy if offset < 0 else busy * max(0.1, 1 - offset / DAYS_AHEAD)
+        for hour in range(OPENS, CLOSES):
+            if rng.random() >= rate:
+                continue
+            moment = datetime.combine(day, day_time(hour))
+            rank = int(clients * rng.random() ** VISITS_SKEW)
+            rows["appointment"].append((VAT, moment, client_vat(rank * stride % clients + 1), rng.choice(DESCRIPTIONS)))
+            if offset >= 0 or rng.random() >= 0.9:
+                continue
+
+            rows["consultation"].append((VAT, moment, *(rng.choice(SOAP[part]) for part in "SOAP")))
+            nurse = usual_nurse if rng.random() < 0.75 else rng.choice(plan["nurses"])
+            rows["consultation_assistant"].append((VAT, moment, nurse))
+
+            count = rng.choices(*PROCEDURE_COUNTS)[0]
+            for name in pick(rng, procedure_names, procedure_weights, count):
+                rows["procedure_in_consultation"].append((name, VAT, moment, "Done without complications."))
+                if procedure_types[name] == "dental charting":
+                    for quadrant, number in sorted(rng.sample(TEETH, rng.randint(4, 12))):
+                        rows["procedure_charting"].append((name, VAT, moment, quadrant, number, "Pocket depth",
+                                                           round(rng.uniform(0.5, 6), 2)))
+                elif procedure_types[name] == "radiography":
+                    rows["procedure_imaging"].append((name, VAT, moment, f"xray/{VAT}/{moment:%Y%m%d%H}.png"))
+
+            count = rng.choices(*DIAGNOSTIC_COUNTS)[0]
+            for ID in pick(rng, codes, code_weights, count):
+                rows["consultation_diagnostic"].append((VAT, moment, ID))
+                chance = rng.random()
+                if chance < 0.5:
+                    treatments = TREATMENTS[ID[:3]]
+                    for medication in rng.sample(treatments, 1 if chance < 0.4 else min(2, len(treatments))):
+                        name, lab = MEDICATIONS[medication]
+                        rows["prescription"].append((VAT, moment, ID, name, lab, rng.choice(DOSAGES),
+                                                     "Take after meals."))
+    return rows
+
+
+def load_activity(plan, doctors):
+    """Appointments and consultations of ``doctors``, a list of (index, VAT), one doctor at a time."""
+    counts = Counter()
+    with psycopg.connect(plan["url"]) as conn:
+        with conn.cursor() as cur:
+            for index, VAT in doctors:
+                for table, table_rows in doctor_activity(plan, index, VAT).items():
+                    counts[table] += copy_rows(cur, table, table_rows)
+    return counts
+
+
+def reset(url):
+    """Recreate the clinic tables from schema.sql."""
+    with open(os.path.join(APP_DIR, "schema.sql")) as f:
+        schema = f.read()
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute(schema)
+
+
+def generate(url, scale, seed, jobs, today=None):
+    """Recreate the clinic tables and fill them; return the number of rows per table."""
+    reset(url)
+    plan = make_plan(url, scale, seed, today or date.today())
+    doctors = list(enumerate(plan["doctors"]))
+    # Several chunks per process, so a process that got busy doctors doesn't hold up the others.
+    size = max(1, math.ceil(len(doctors) / (jobs * 4)))
+
+    counts = Counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        base = [pool.submit(load_reference, plan), pool.submit(load_staff, plan)]
+        base += [pool.submit(load_clients, plan, first, min(first + CLIENT_CHUNK, plan["clients"] + 1))
+                 for first in range(1, plan["clients"] + 1, CLIENT_CHUNK)]
+        for future in base:
+            counts.update(future.result())
+
+        activity = [pool.submit(load_activity, plan, doctors[first:first + size])
+                    for first in range(0, len(doctors), size)]
+        for future in activity:
+            counts.update(future.result())
+
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute("ANALYZE;")
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1, help="dataset size: 4000 clients and 10 doctors per unit")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="processes loading in parallel")
+    parser.add_argument("--today", type=date.fromisoformat, help="day the appointments are around (default: today)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(DATABASE_URL, args.scale, args.seed, args.jobs, args.today)
+    subprocess.run(["flask", "--app", "app", "migrate"], cwd=APP_DIR, check=True)
+
+    for table, rows in counts.items():
+        print(f"{table:>26}: {rows}")
+    print(f"Generated in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
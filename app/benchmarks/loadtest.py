@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+"""HTTP load test of the app under gunicorn, sweeping worker and thread counts.
+
+The database pointed to by ``DATABASE_URL`` is (re)created from ``schema.sql``
+and filled with a dataset of the given ``--scale`` when ``--seed`` is passed;
+this DROPS every table of the clinic, so only point it at a scratch database.
+For each ``--workers`` x ``--threads`` combination gunicorn is started on a
+local port and ``--concurrency`` clients replay a weighted mix of page views,
+bookings and edits for ``--duration`` seconds. Requests/s and p50/p95/p99
+latency per route are printed and saved as JSON under ``benchmarks/results``.
+
+    python benchmarks/loadtest.py --seed --scale 2 --workers 1,2,4 --threads 1,4 --duration 30
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import quote
+from urllib.parse import urlencode
+
+import psycopg
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import datagen  # noqa: E402
+from db import DATABASE_URL  # noqa: E402
+
+RESULTS_DIR = os.path.join(APP_DIR, "benchmarks", "results")
+
+
+def seed(scale, random_seed, jobs):
+    """Recreate the clinic tables and fill them with a synthetic dataset of ``scale`` units (see datagen.py)."""
+    start = time.perf_counter()
+    rows = datagen.generate(DATABASE_URL, scale, random_seed, jobs)
+
+    for command in ("migrate", "check-plans"):
+        subprocess.run(["flask", "--app", "app", command], cwd=APP_DIR, check=True)
+    print(f"Seeded {rows['client']} clients and {rows['appointment']} appointments in {time.perf_counter() - start:.1f}s")
+
+
+def sample(size):
+    """Keys the scenarios pick from: clients, consultations and search terms."""
+    with psycopg.connect(DATABASE_URL) as conn:
+        clients = [row[0] for row in conn.execute("""
+            SELECT VAT
+            FROM client
+            ORDER BY random()
+            LIMIT %(size)s;
+        """, {"size": size})]
+        consultations = conn.execute("""
+            SELECT a.VAT_client, c.VAT_doctor, c.date_timestamp
+            FROM consultation AS c
+            JOIN appointment AS a ON a.VAT_doctor = c.VAT_doctor AND a.date_timestamp = c.date_timestamp
+            ORDER BY random()
+            LIMIT %(size)s;
+        """, {"size": size}).fetchall()
+        terms = [row[0] for row in conn.execute("""
+            SELECT split_part(name, ' ', 1)
+            FROM client
+            ORDER BY random()
+            LIMIT %(size)s;
+        """, {"size": size})]
+
+    if not clients or not consultations:
+        sys.exit("The database has no clients or consultations: run with --seed first.")
+    return {
+        "clients": clients,
+        "consultations": [(VAT, VAT_doctor, str(date_timestamp)) for VAT, VAT_doctor, date_timestamp in consultations],
+        "terms": terms,
+    }
+
+
+class Client:
+    """One keep-alive connection that records ``(route, seconds, status)`` of every request."""
+
+    def __init__(self, port, record):
+        self.port = port
+        self.record = record
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+    def request(self, route, method, path, form=None):
+        body = urlencode(form) if form is not None else None
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if form is not None else {}
+
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            data, status = b"", 0
+        self.record(route, time.perf_counter() - start, status)
+        return status, data
+
+    def close(self):
+        self.conn.close()
+
+
+def consultation_path(VAT, VAT_doctor, date_timestamp):
+    return f"/client/{quote(VAT)}/{quote(VAT_doctor)}/{quote(date_timestamp)}"
+
+
+def browse_dashboard(client, keys, rng):
+    client.request("dashboard", "GET", "/dashboard")
+
+
+def browse_clients(client, keys, rng):
+    client.request("clients", "GET", "/clients")
+
+
+def search_clients(client, keys, rng):
+    client.request("clients2", "POST", "/clients2", {"search": rng.choice(keys["terms"])})
+
+
+def view_client(client, keys, rng):
+    client.request("client_vat", "GET", f"/client/{quote(rng.choice(keys['clients']))}")
+
+
+def view_consultation(client, keys, rng):
+    client.request("consultation_desc", "GET", consultation_path(*rng.choice(keys["consultations"])))
+
+
+def book_appointment(client, keys, rng):
+    VAT = quote(rng.choice(keys["clients"]))
+    client.request("new_appointment", "GET", f"/client/{VAT}/new_appointment")
+
+    status, data = client.request("availability_next", "GET", "/availability/next?n=20")
+    if status != 200 or not json.loads(data):
+        return
+    # Several clients race for the earliest slots; picking among 20 keeps conflicts rare.
+    slot = rng.choice(json.loads(data))
+    client.request("new_appointment_doctor", "POST", f"/client/{VAT}/new_appointment_doctor",
+                   {"slot": slot["date_timestamp"][:16]})
+    client.request("new_appointment2", "POST", f"/client/{VAT}/{quote(slot['date_timestamp'])}/new_appointment2",
+                   {"VAT_doctor": slot["vat_doctor"], "description": "Booked by the load test"})
+
+
+def edit_consultation(client, keys, rng):
+    path = consultation_path(*rng.choice(keys["consultations"]))
+    client.request("update_appointment2", "POST", path + "/update_appointment2",
+                   {"description": f"Edited by the load test {rng.random():.6f}"})
+    client.request("update_consultation2", "POST", path + "/update_consultation2",
+                   {"soap_s": "Pain when chewing.", "soap_o": "Caries on 36.", "soap_a": "Dental caries.",
+                    "soap_p": f"Filling, revised {rng.random():.6f}."})
+
+
+# scenario: weight
+SCENARIOS = {
+    browse_dashboard: 5,
+    browse_clients: 15,
+    search_clients: 15,
+    view_client: 25,
+    view_consultation: 25,
+    book_appointment: 5,
+    edit_consultation: 10,
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(timings, statuses, elapsed):
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "rps": round(len(timings) / elapsed, 1),
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 2) if timings else None,
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 2) if timings else None,
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 2) if timings else None,
+        "errors": sum(count for status, count in statuses.items() if status == 0 or status >= 500),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def drive(port, keys, concurrency, duration, warmup, random_seed):
+    """Replay the scenarios from ``concurrency`` threads; only requests after ``warmup`` seconds count."""
+    timings = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measuring = started + warmup
+    deadline = measuring + duration
+
+    def record(route, seconds, status):
+        if time.perf_counter() - seconds >= measuring:
+            with lock:
+                timings[route].append(seconds)
+                statuses[route][status] += 1
+
+    def run(index):
+        rng = random.Random(random_seed * 1000 + index)
+        client = Client(port, record)
+        scenarios, weights = list(SCENARIOS), list(SCENARIOS.values())
+        while time.perf_counter() < deadline:
+            rng.choices(scenarios, weights)[0](client, keys, rng)
+        client.close()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - measuring
+
+    routes = {route: summarize(timings[route], statuses[route], elapsed) for route in sorted(timings)}
+    everything = [seconds for route in timings for seconds in timings[route]]
+    total_statuses = defaultdict(int)
+    for route in statuses:
+        for status, count in statuses[route].items():
+            total_statuses[status] += count
+    return {"routes": routes, "total": summarize(everything, total_statuses, elapsed)}
+
+
+def wait_until_ready(port, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"gunicorn exited with code {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    sys.exit(f"The app did not answer on port {port} within {timeout}s")
+
+
+def serve(workers, threads, port):
+    return subprocess.Popen(
+        ["gunicorn", "wsgi:app", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+         "--threads", str(threads), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=dict(os.environ, DATABASE_URL=DATABASE_URL),
+    )
+
+
+def report(run):
+    print(f"\nworkers={run['workers']} threads={run['threads']} concurrency={run['concurrency']}")
+    print(f"{'route':<24} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6}")
+    for route, stats in list(run["routes"].items()) + [("total", run["total"])]:
+        print(f"{route:<24} {stats['requests']:>8} {stats['rps']:>8} {stats['p50_ms'] or 0:>9} "
+              f"{stats['p95_ms'] or 0:>9} {stats['p99_ms'] or 0:>9} {stats['errors']:>6}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def counts(value):
+    return [int(part) for part in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", action="store_true", help="recreate and fill the database first (drops all tables)")
+    parser.add_argument("--scale", type=float, default=1, help="dataset size: 4000 clients and 10 doctors per unit")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="processes loading the dataset")
+    parser.add_argument("--workers", type=counts, default=[2], help="comma-separated gunicorn worker counts")
+    parser.add_argument("--threads", type=counts, default=[1], help="comma-separated gunicorn thread counts")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous clients")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds per combination")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before each measurement")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--output", help="JSON file to write, by default one in benchmarks/results")
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.scale, args.random_seed, args.jobs)
+    keys = sample(1000)
+
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": {scenario.__name__: weight for scenario, weight in SCENARIOS.items()},
+        "runs": [],
+    }
+
+    for workers in args.workers:
+        for threads in args.threads:
+            server = serve(workers, threads, args.port)
+            try:
+                wait_until_ready(args.port, server)
+                run = drive(args.port, keys, args.concurrency, args.duration, args.warmup, args.random_seed)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait()
+            run = {"workers": workers, "threads": threads, "concurrency": args.concurrency, **run}
+            results["runs"].append(run)
+            report(run)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+"""Loads the rows shown on the consultation page and its form pages.
+
+All the requested queries are sent in a single pipeline, so a page costs one
+network round trip however many parts it needs.
+"""
+import queries
+
+# name: query
+PARTS = {
+    "version": queries.CONSULTATION_VERSION,
+    "client": queries.CLIENT,
+    "appointment": queries.APPOINTMENT,
+    "consultation": queries.CONSULTATION,
+    "procedures": queries.PROCEDURES,
+    "procedure": queries.PROCEDURE,
+    "diagnosis": queries.DIAGNOSES,
+    "nurses": queries.NURSES,
+}
+
+
+def load(conn, VAT, VAT_doctor, date_timestamp, *parts, name=None):
+    """Return a dict with the rows of each of the requested ``parts``.
+
+    Children rows are joined straight to the appointment, which pins both the
+    consultation and the client, instead of going through the consultation.
+    """
+    params = {"VAT": VAT, "VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp, "name": name}
+
+    cursors = {}
+    with conn.pipeline():
+        for part in parts:
+            cur = conn.cursor(row_factory=PARTS[part].rows)
+            PARTS[part].execute(cur, params)
+            cursors[part] = cur
+
+    bundle = {}
+    for part, cur in cursors.items():
+        bundle[part] = PARTS[part].result(cur)
+        cur.close()
+    return bundle
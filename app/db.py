@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+import atexit
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg
+from psycopg_pool import ConnectionPool
+from psycopg_pool import PoolTimeout
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# # postgres://{user}:{password}@{hostname}:{port}/{database-name}
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgres://db:db@postgres/db")
+# Comma-separated URLs of read replicas of DATABASE_URL, if any.
+REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+POOL_MIN_SIZE = int(os.environ.get("DATABASE_POOL_MIN_SIZE", 2))
+POOL_MAX_SIZE = int(os.environ.get("DATABASE_POOL_MAX_SIZE", 10))
+# Seconds a connection above min_size may stay idle before being closed.
+POOL_MAX_IDLE = float(os.environ.get("DATABASE_POOL_MAX_IDLE", 300))
+# Seconds after which a connection is closed and replaced, whatever its usage.
+POOL_MAX_LIFETIME = float(os.environ.get("DATABASE_POOL_MAX_LIFETIME", 3600))
+# Seconds a request waits for a free connection before failing.
+POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+
+# Seconds of replication lag past which a replica is not read from.
+REPLICA_MAX_LAG = float(os.environ.get("DATABASE_REPLICA_MAX_LAG", 5))
+# Seconds between two checks of the lag of a replica.
+REPLICA_CHECK_INTERVAL = float(os.environ.get("DATABASE_REPLICA_CHECK_INTERVAL", 5))
+# Seconds to wait for a replica connection before reading from the primary instead.
+REPLICA_TIMEOUT = float(os.environ.get("DATABASE_REPLICA_TIMEOUT", 1))
+
+# Zero on a primary, or on a replica that replayed all it received.
+REPLICA_LAG = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() IS NULL OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+        THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END;
+"""
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+_replicas = {}
+_replicas_pid = None
+# url: (monotonic time of the check, usable)
+_replica_state = {}
+_next_replica = itertools.count()
+
+
+def new_pool(url, name, **kwargs):
+    return ConnectionPool(
+        conninfo=url,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_idle=POOL_MAX_IDLE,
+        max_lifetime=POOL_MAX_LIFETIME,
+        timeout=POOL_TIMEOUT,
+        check=ConnectionPool.check_connection,
+        connection_class=metrics.TimedConnection,
+        name=name,
+        open=True,
+        **kwargs,
+    )
+
+
+def get_pool():
+    """Return the connection pool of the current process, creating it if needed.
+
+    The pool is keyed on the process id so that it is only ever opened inside
+    a gunicorn worker (after the fork), never shared with the master process.
+    """
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = new_pool(DATABASE_URL, f"app-{pid}")
+            _pool_pid = pid
+    return _pool
+
+
+def get_replica_pool(index):
+    """Return the pool of the replica ``REPLICA_URLS[index]`` of the current process."""
+    global _replicas, _replicas_pid
+
+    pid = os.getpid()
+    with _pool_lock:
+        if _replicas_pid != pid:
+            _replicas = {}
+            _replica_state.clear()
+            _replicas_pid = pid
+        if index not in _replicas:
+            # Read-only, so that a write sent here by mistake fails instead of being lost.
+            _replicas[index] = new_pool(REPLICA_URLS[index], f"replica{index}-{pid}",
+                                        kwargs={"options": "-c default_transaction_read_only=on"})
+    return _replicas[index]
+
+
+def replica_usable(index):
+    """Whether the replica answers and lags less than ``REPLICA_MAX_LAG``, checked at most every few seconds."""
+    now = time.monotonic()
+    checked_at, usable = _replica_state.get(index, (None, False))
+    if checked_at is not None and now - checked_at < REPLICA_CHECK_INTERVAL:
+        return usable
+
+    try:
+        with get_replica_pool(index).connection(timeout=REPLICA_TIMEOUT) as conn:
+            lag = conn.execute(REPLICA_LAG).fetchone()[0]
+        usable = lag <= REPLICA_MAX_LAG
+        if not usable:
+            log.warning(f"Replica {index} lags {lag:.1f}s behind, reading from the primary.")
+    except (PoolTimeout, psycopg.Error) as error:
+        usable = False
+        log.warning(f"Replica {index} is unavailable, reading from the primary: {error}")
+    _replica_state[index] = (time.monotonic(), usable)
+    return usable
+
+
+def read_pool():
+    """The pool of the next usable replica, in turn, or the primary pool if there is none."""
+    first = next(_next_replica)
+    for offset in range(len(REPLICA_URLS)):
+        index = (first + offset) % len(REPLICA_URLS)
+        if replica_usable(index):
+            return get_replica_pool(index)
+    return get_pool()
+
+
+@contextmanager
+def connection(replica=False):
+    """Borrow a connection from the pool, to be used as a context manager.
+
+    The connection is returned to the pool when the block exits; the
+    transaction is committed on success and rolled back on error. With
+    ``replica``, the connection is to a read replica when one is configured
+    and usable; it is read-only then.
+    """
+    pool = read_pool() if replica and REPLICA_URLS else get_pool()
+
+    start = time.perf_counter()
+    with pool.connection() as conn:
+        metrics.connection_acquired(time.perf_counter() - start)
+        yield conn
+
+
+def pool_stats():
+    """Return the pool counters (connections, waiting requests, errors...)."""
+    if _pool is None or _pool_pid != os.getpid():
+        return {}
+    return _pool.get_stats()
+
+
+def replica_stats():
+    """Return the pool counters and state of every replica opened by this process."""
+    if _replicas_pid != os.getpid():
+        return {}
+    return {
+        REPLICA_URLS[index].rsplit("@", 1)[-1]: {**pool.get_stats(), "usable": _replica_state.get(index, (None, None))[1]}
+        for index, pool in _replicas.items()
+    }
+
+
+@atexit.register
+def close_pool():
+    global _pool
+
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    _pool = None
+
+    if _replicas_pid == os.getpid():
+        for pool in _replicas.values():
+            pool.close()
+    _replicas.clear()
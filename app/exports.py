@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""Streaming exports of the consultation facts and of the client histories, as CSV or NDJSON.
+
+CSV comes straight out of ``COPY ... TO STDOUT`` and NDJSON out of a
+server-side cursor over ``row_to_json``; either way rows are passed on a
+chunk at a time as they arrive, so memory use does not depend on how many
+rows are exported. Only the filters that are set end up in the query.
+"""
+import api
+from db import connection
+
+# COPY sends one message per row: they are gathered into chunks of about this many bytes.
+CHUNK = 64 * 1024
+
+# format: mimetype
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# The rows of the facts_consultations view, read from the rollup that holds the same numbers.
+FACTS = """
+    SELECT r.VAT AS vat, r.date, cl.zip, r.num_diagnostic_codes, r.num_procedures
+    FROM consultation_rollup AS r
+    JOIN client AS cl ON cl.VAT = r.VAT
+    {where}
+    ORDER BY r.date, r.VAT
+"""
+
+# One row per appointment, with the consultation, if any, and its procedures and diagnostics.
+HISTORIES = """
+    SELECT a.VAT_client AS vat, cl.name, cl.zip, a.VAT_doctor AS vat_doctor, a.date_timestamp, a.description,
+        co.SOAP_S AS soap_s, co.SOAP_O AS soap_o, co.SOAP_A AS soap_a, co.SOAP_P AS soap_p,
+        (SELECT string_agg(pc.name, '; ' ORDER BY pc.name)
+         FROM procedure_in_consultation AS pc
+         WHERE pc.VAT_doctor = a.VAT_doctor AND pc.date_timestamp = a.date_timestamp) AS procedures,
+        (SELECT string_agg(cd.ID, '; ' ORDER BY cd.ID)
+         FROM consultation_diagnostic AS cd
+         WHERE cd.VAT_doctor = a.VAT_doctor AND cd.date_timestamp = a.date_timestamp) AS diagnostic_codes
+    FROM appointment AS a
+    JOIN client AS cl ON cl.VAT = a.VAT_client
+    LEFT JOIN consultation AS co ON co.VAT_doctor = a.VAT_doctor AND co.date_timestamp = a.date_timestamp
+    {where}
+    ORDER BY a.VAT_client, a.date_timestamp, a.VAT_doctor
+"""
+
+# kind: (query, {filter: condition, used when the filter is set})
+# The rollup keeps no doctor, so the facts cannot be filtered by one.
+EXPORTS = {
+    "facts": (FACTS, {
+        "start": "r.date >= %(start)s::date",
+        "end": "r.date < %(end)s::date + 1",
+        "zip": "cl.zip = %(zip)s",
+        "client": "r.VAT = %(client)s",
+    }),
+    "histories": (HISTORIES, {
+        "start": "a.date_timestamp >= %(start)s::date",
+        "end": "a.date_timestamp < %(end)s::date + 1",
+        "zip": "cl.zip = %(zip)s",
+        "client": "a.VAT_client = %(client)s",
+        "doctor": "a.VAT_doctor = %(doctor)s",
+    }),
+}
+
+
+def unsupported(kind, filters):
+    """The names of the filters that are set but that the ``kind`` export has no condition for."""
+    return sorted(name for name, value in filters.items() if value and name not in EXPORTS[kind][1])
+
+
+def statement(kind, filters):
+    query, conditions = EXPORTS[kind]
+    where = [condition for name, condition in conditions.items() if filters.get(name)]
+    return query.format(where="WHERE " + " AND ".join(where) if where else "")
+
+
+def stream_csv(kind, filters, replica=False):
+    """Yield the CSV export, header first, ``CHUNK`` bytes at a time."""
+    with connection(replica=replica) as conn:
+        with conn.cursor() as cur:
+            # COPY takes no server-side parameters: psycopg merges them into the statement.
+            with cur.copy(f"COPY ({statement(kind, filters)}) TO STDOUT WITH (FORMAT csv, HEADER)", filters) as copy:
+                buffer = bytearray()
+                for data in copy:
+                    buffer += data
+                    if len(buffer) >= CHUNK:
+                        yield bytes(buffer)
+                        buffer.clear()
+                if buffer:
+                    yield bytes(buffer)
+
+
+def stream_ndjson(kind, filters, replica=False):
+    """Yield the NDJSON export, ``api.BATCH`` lines at a time."""
+    query = f"SELECT row_to_json(e)::text FROM ({statement(kind, filters)}) AS e;"
+    for lines in api.stream_documents(query, filters, name=f"export_{kind}", replica=replica):
+        yield lines.encode()
+
+
+def stream(kind, fmt, filters, replica=False):
+    """The ``kind`` export in ``fmt`` (one of ``FORMATS``), as an iterator of bytes."""
+    if fmt == "csv":
+        return stream_csv(kind, filters, replica=replica)
+    return stream_ndjson(kind, filters, replica=replica)
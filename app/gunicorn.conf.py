@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+"""gunicorn settings, read from the working directory by every ``gunicorn wsgi:app``."""
+
+
+def post_worker_init(worker):
+    # The worker has loaded the app and does not accept connections until this returns.
+    # Imported here, not in the master, so that startup times count from the worker's own start.
+    import warmup
+
+    warmup.run(worker.wsgi)
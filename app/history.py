@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+"""Loads the rows shown on the client page: the client and a page of its timeline.
+
+The timeline lists the appointments of the client, newest first, a page at a
+time; older pages are loaded on demand, and the SOAP notes of a consultation
+only when it is expanded. The queries are independent of each other: the
+WSGI app sends them in one pipeline, the asyncio app runs them concurrently.
+"""
+from datetime import datetime
+
+import queries
+
+# name: query
+PARTS = {
+    "version": queries.CLIENT_VERSION,
+    "client": queries.CLIENT,
+    "timeline": queries.CLIENT_TIMELINE,
+}
+
+
+def params(VAT, before=None, size=20):
+    """Query parameters of the page of ``size`` appointments before ``before``, a (date_timestamp, VAT_doctor) pair.
+
+    One more row than ``size`` is asked for, to know whether there are older ones.
+    """
+    before_date, before_doctor = before or (None, None)
+    return {"VAT": VAT, "before_date": before_date, "before_doctor": before_doctor, "limit": size + 1}
+
+
+def before_from_args(args):
+    """The (date_timestamp, VAT_doctor) of the ``before_date``/``before_doctor`` query arguments, or None."""
+    before_date = args.get("before_date")
+    before_doctor = args.get("before_doctor")
+    if not before_date or before_doctor is None:
+        return None
+    try:
+        return datetime.fromisoformat(before_date), before_doctor
+    except ValueError:
+        return None
+
+
+def page(rows, size):
+    """The first ``size`` of ``rows`` and the arguments of the next (older) page, or None if it is the last."""
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, {"before_date": rows[-1].date_timestamp.isoformat(sep=" "), "before_doctor": rows[-1].vat_doctor}
+
+
+def load(conn, VAT, *parts, before=None, size=20):
+    """Return a dict with the rows of each of the requested ``parts``.
+
+    The ``timeline`` holds at most ``size`` appointments, and ``older`` the
+    arguments of the next page, if any.
+    """
+    cursors = {}
+    with conn.pipeline():
+        for part in parts:
+            cur = conn.cursor(row_factory=PARTS[part].rows)
+            PARTS[part].execute(cur, params(VAT, before, size))
+            cursors[part] = cur
+
+    bundle = {}
+    for part, cur in cursors.items():
+        bundle[part] = PARTS[part].result(cur)
+        cur.close()
+    if "timeline" in bundle:
+        bundle["timeline"], bundle["older"] = page(bundle["timeline"], size)
+    return bundle
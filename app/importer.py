@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""Bulk import of clients and appointments from CSV or NDJSON.
+
+Rows are streamed through ``COPY`` into a temporary staging table, validated
+there with set-based statements, and the valid ones are merged into the real
+table in the same transaction. Rejected rows, with the reason they were
+rejected, are written out as CSV. Nothing is ever held in memory but the row
+being read, so memory use does not depend on the size of the input.
+"""
+import csv
+import json
+from datetime import datetime
+
+KINDS = {
+    "clients": {
+        "table": "client",
+        "columns": ["VAT", "name", "birth_date", "street", "city", "zip", "gender"],
+        "lengths": {"VAT": 20, "name": 80, "street": 255, "city": 30, "zip": 12, "gender": 1},
+        "key": ["VAT"],
+        "casts": {"birth_date": "date"},
+        "checks": [
+            ("zip is too short", "length(s.zip) < 2"),
+            ("VAT client already exists", "EXISTS (SELECT 1 FROM client AS c WHERE c.VAT = s.VAT)"),
+        ],
+    },
+    "appointments": {
+        "table": "appointment",
+        "columns": ["VAT_doctor", "date_timestamp", "VAT_client", "description"],
+        "lengths": {"VAT_doctor": 20, "VAT_client": 20},
+        "key": ["VAT_doctor", "date_timestamp"],
+        "casts": {"date_timestamp": "timestamp"},
+        "checks": [
+            ("unknown doctor", "NOT EXISTS (SELECT 1 FROM doctor AS d WHERE d.VAT = s.VAT_doctor)"),
+            ("unknown client", "NOT EXISTS (SELECT 1 FROM client AS c WHERE c.VAT = s.VAT_client)"),
+            ("doctor already has an appointment at this time", """
+                EXISTS (SELECT 1 FROM appointment AS a
+                        WHERE a.VAT_doctor = s.VAT_doctor AND a.date_timestamp = s.date_timestamp::timestamp)
+            """),
+        ],
+    },
+}
+
+
+def validate_timestamp(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        return True
+    except ValueError:
+        return False
+
+
+def read_rows(stream, fmt, columns):
+    """Yield ``(values, reason)`` for each record of a CSV or NDJSON text stream."""
+    keys = [column.lower() for column in columns]
+
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            record = {(key or "").strip().lower(): value for key, value in record.items()}
+            yield [record.get(key) or None for key in keys], None
+        return
+
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("not an object")
+        except ValueError:
+            yield [None] * len(keys), "invalid JSON"
+            continue
+        record = {key.lower(): value for key, value in record.items()}
+        yield [None if record.get(key) is None else str(record.get(key)) for key in keys], None
+
+
+def import_file(conn, kind, stream, fmt, rejects, validate_date):
+    """Import ``stream`` into the table of ``kind`` and write rejected rows to ``rejects``.
+
+    Returns the number of imported and rejected rows. The caller commits.
+    """
+    spec = KINDS[kind]
+    columns = spec["columns"]
+
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE import_staging (
+                line BIGINT,
+                reason TEXT,
+                {", ".join(f"{column} TEXT" for column in columns)}
+            ) ON COMMIT DROP;
+        """)
+
+        with cur.copy(f"COPY import_staging (line, reason, {', '.join(columns)}) FROM STDIN") as copy:
+            for line, (values, reason) in enumerate(read_rows(stream, fmt, columns), start=1):
+                if reason is None:
+                    record = dict(zip(columns, values))
+                    if kind == "clients" and record["birth_date"] and not validate_date(record["birth_date"]):
+                        reason = "birthdate is invalid"
+                    elif kind == "appointments" and record["date_timestamp"] \
+                            and not validate_timestamp(record["date_timestamp"]):
+                        reason = "date_timestamp is invalid"
+                copy.write_row([line, reason] + values)
+        cur.execute("ANALYZE import_staging;")
+
+        checks = [("missing " + column, f"s.{column} IS NULL") for column in columns]
+        checks += [(f"{column} is too long", f"length(s.{column}) > {length}")
+                   for column, length in spec["lengths"].items()]
+        checks += spec["checks"]
+        for reason, condition in checks:
+            cur.execute(f"""
+                UPDATE import_staging AS s
+                SET reason = %(reason)s
+                WHERE CASE WHEN s.reason IS NULL THEN ({condition}) ELSE FALSE END;
+            """, {"reason": reason})
+
+        key = ", ".join(spec["key"])
+        cur.execute(f"""
+            UPDATE import_staging AS s
+            SET reason = 'duplicate in file'
+            FROM (
+                SELECT line, row_number() OVER (PARTITION BY {key} ORDER BY line) AS occurrence
+                FROM import_staging
+                WHERE reason IS NULL
+            ) AS d
+            WHERE s.line = d.line AND d.occurrence > 1;
+        """)
+
+        values = ", ".join(f"s.{column}::{spec['casts'][column]}" if column in spec["casts"] else f"s.{column}"
+                           for column in columns)
+        cur.execute(f"""
+            INSERT INTO {spec["table"]} ({", ".join(columns)})
+            SELECT {values}
+            FROM import_staging AS s
+            WHERE s.reason IS NULL
+            ORDER BY s.line;
+        """)
+        imported = cur.rowcount
+
+        cur.execute("SELECT COUNT(*) FROM import_staging WHERE reason IS NOT NULL;")
+        rejected = cur.fetchone()[0]
+
+        with cur.copy(f"""
+            COPY (
+                SELECT line, reason, {", ".join(columns)}
+                FROM import_staging
+                WHERE reason IS NOT NULL
+                ORDER BY line
+            ) TO STDOUT WITH (FORMAT csv, HEADER true)
+        """) as copy:
+            for data in copy:
+                rejects.write(bytes(data))
+
+    return {"imported": imported, "rejected": rejected}
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+"""Request and database instrumentation, exported in the Prometheus text format.
+
+The pool hands out ``TimedConnection``s, whose cursors add the time spent in
+``execute``/``fetch*`` and the rows they return to the stats of the current
+request, and hand slow statements to ``slowlog``. At the end of the request
+the totals are observed once, so the cost per query is a couple of
+``perf_counter`` calls and an attribute update.
+
+With several gunicorn workers, point ``PROMETHEUS_MULTIPROC_DIR`` to an empty
+directory so that ``/metrics`` aggregates every worker, not just the one that
+answered the scrape.
+"""
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+
+import psycopg
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+
+import slowlog
+
+REQUEST_SECONDS = Histogram("app_request_duration_seconds", "Time to serve a request.",
+                            ["route", "method", "status"])
+DB_SECONDS = Histogram("app_request_db_seconds", "Time spent in the database per request.", ["route"])
+RENDER_SECONDS = Histogram("app_request_render_seconds", "Time spent rendering templates per request.", ["route"])
+WAIT_SECONDS = Histogram("app_request_connection_wait_seconds", "Time spent waiting for a pooled connection per request.",
+                         ["route"], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+QUERIES = Histogram("app_request_queries", "SQL statements executed per request.", ["route"],
+                    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+ROWS = Histogram("app_request_rows", "Rows fetched per request.", ["route"],
+                 buckets=(0, 1, 10, 100, 1000, 10000, 100000))
+QUERIES_TOTAL = Counter("app_db_queries", "SQL statements executed.", ["route"])
+
+
+class RequestStats:
+    __slots__ = ("route", "queries", "rows", "db_seconds", "wait_seconds", "render_seconds", "started",
+                 "render_started")
+
+    def __init__(self, route):
+        self.route = route
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.render_seconds = 0.0
+        self.started = time.perf_counter()
+        self.render_started = None
+
+
+# Stats of the request being served; None outside of requests (CLI, listener threads).
+current = contextvars.ContextVar("request_stats", default=None)
+
+
+def start_request(route):
+    current.set(RequestStats(route))
+
+
+def finish_request(method, status):
+    stats = current.get()
+    current.set(None)
+    if stats is None:
+        return
+
+    route = stats.route
+    REQUEST_SECONDS.labels(route, method, status).observe(time.perf_counter() - stats.started)
+    DB_SECONDS.labels(route).observe(stats.db_seconds)
+    RENDER_SECONDS.labels(route).observe(stats.render_seconds)
+    WAIT_SECONDS.labels(route).observe(stats.wait_seconds)
+    QUERIES.labels(route).observe(stats.queries)
+    ROWS.labels(route).observe(stats.rows)
+    QUERIES_TOTAL.labels(route).inc(stats.queries)
+
+
+def start_render():
+    stats = current.get()
+    if stats is not None:
+        stats.render_started = (time.perf_counter(), stats.db_seconds)
+
+
+def finish_render():
+    stats = current.get()
+    if stats is not None and stats.render_started is not None:
+        started, db_seconds = stats.render_started
+        # Streamed pages run queries while rendering; that time is counted as database time.
+        stats.render_seconds += (time.perf_counter() - started) - (stats.db_seconds - db_seconds)
+        stats.render_started = None
+
+
+def connection_acquired(seconds):
+    stats = current.get()
+    if stats is not None:
+        stats.wait_seconds += seconds
+
+
+def query_done(seconds, rows=0, executed=False):
+    stats = current.get()
+    if stats is not None:
+        stats.db_seconds += seconds
+        stats.rows += rows
+        if executed:
+            stats.queries += 1
+
+
+def executed(conn, query, params, seconds):
+    query_done(seconds, executed=True)
+    if conn.pipelined is not None:
+        # Only queued: the statement runs when the pipeline is synced.
+        conn.pipelined.append((query, params))
+        return
+    stats = current.get()
+    slowlog.recorder.record(conn, query, params, seconds, stats.route if stats is not None else None)
+
+
+def pipeline_done(conn, statements, seconds):
+    query_done(seconds)
+    stats = current.get()
+    slowlog.recorder.record_pipeline(conn, statements, seconds, stats.route if stats is not None else None)
+
+
+def count(result):
+    if result is None:
+        return 0
+    return len(result) if isinstance(result, list) else 1
+
+
+class TimedCursorMixin:
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            executed(self.connection, query, params, time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            query_done(time.perf_counter() - start, executed=True)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        query_done(time.perf_counter() - start, count(row))
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        query_done(time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        query_done(time.perf_counter() - start, len(rows))
+        return rows
+
+    def __iter__(self):
+        rows = super().__iter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                query_done(time.perf_counter() - start)
+                return
+            query_done(time.perf_counter() - start, 1)
+            yield row
+
+
+class TimedCursor(TimedCursorMixin, psycopg.Cursor):
+    pass
+
+
+class TimedServerCursor(TimedCursorMixin, psycopg.ServerCursor):
+    pass
+
+
+class TimedConnection(psycopg.Connection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = TimedCursor
+        self.server_cursor_factory = TimedServerCursor
+        self.pipelined = None
+        self.url = None
+
+    @classmethod
+    def connect(cls, conninfo="", **kwargs):
+        conn = super().connect(conninfo, **kwargs)
+        # The database the statements run on, where slowlog explains them.
+        conn.url = conninfo
+        return conn
+
+    @contextmanager
+    def pipeline(self):
+        # The queued statements are sent, and waited for, when the block exits.
+        self.pipelined = []
+        try:
+            with super().pipeline() as pipeline:
+                yield pipeline
+                start = time.perf_counter()
+            pipeline_done(self, self.pipelined, time.perf_counter() - start)
+        finally:
+            self.pipelined = None
+
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            executed(self.connection, query, params, time.perf_counter() - start)
+
+    async def fetchone(self):
+        start = time.perf_counter()
+        row = await super().fetchone()
+        query_done(time.perf_counter() - start, count(row))
+        return row
+
+    async def fetchall(self):
+        start = time.perf_counter()
+        rows = await super().fetchall()
+        query_done(time.perf_counter() - start, len(rows))
+        return rows
+
+
+class TimedAsyncConnection(psycopg.AsyncConnection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = TimedAsyncCursor
+        self.pipelined = None
+        self.url = None
+
+    @classmethod
+    async def connect(cls, conninfo="", **kwargs):
+        conn = await super().connect(conninfo, **kwargs)
+        conn.url = conninfo
+        return conn
+
+    @asynccontextmanager
+    async def pipeline(self):
+        self.pipelined = []
+        try:
+            async with super().pipeline() as pipeline:
+                yield pipeline
+                start = time.perf_counter()
+            pipeline_done(self, self.pipelined, time.perf_counter() - start)
+        finally:
+            self.pipelined = None
+
+
+def export():
+    """Return the body and content type of the ``/metrics`` response."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+"""Versioned schema migrations, applied by ``flask migrate``.
+
+Each migration runs once, in its own transaction, and is recorded in the
+``schema_migrations`` table; an advisory lock keeps two processes started at
+the same time from applying the same migration twice. New migrations are
+appended to ``MIGRATIONS`` with the next version number, never edited once
+released.
+
+``PLAN_CHECKS`` lists the queries of the busiest pages, which must read the
+large tables through an index: ``flask check-plans`` fails when one of them
+is planned as a sequential scan on a seeded database. tests/test_plans.py
+runs the same check on a small generated dataset.
+"""
+import json
+
+from psycopg.rows import dict_row
+
+import analytics
+import availability
+import consultation
+import history
+import refdata
+import rollup
+import search as client_search
+import versions
+
+# Any constant, shared by every process that migrates this database.
+LOCK = 7202301
+
+TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations(
+        version INTEGER,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY(version)
+    );
+"""
+
+# The BRIN indexes of the project notebook (work/02-e3-project.ipynb): the keys
+# are not correlated with the physical order of the rows, so lookups can't use them.
+NOTEBOOK_INDEXES = ["idx_client", "idx_client_vat", "idx_client_zip", "idx_consult", "idx_consult_vat_doctor",
+                    "idx_consult_date_timestamp", "idx_app", "idx_app_vat_client", "idx_app_vat_doctor",
+                    "idx_app_date_timestamp", "idx_cd", "idx_cd_vat_doctor", "idx_cd_date_timestamp", "idx_cd_id",
+                    "idx_pc", "idx_pc_name", "idx_pc_vat_doctor", "idx_pc_date_timestamp"]
+
+# (version, name, statements)
+MIGRATIONS = [
+    # The rollup is filled here: the dashboard and the exports read it, and bump() only adds deltas to it.
+    (1, "app tables", [rollup.CREATE_TABLE, rollup.POPULATE] + client_search.SCHEMA + refdata.SCHEMA + versions.SCHEMA
+     + versions.REFERENCE_SCHEMA + analytics.SCHEMA),
+    (2, "indexes of the hot queries", [
+        # Client page: the appointments of a client, newest first, paged on (date_timestamp, VAT_doctor).
+        """
+        CREATE INDEX IF NOT EXISTS appointment_client_timeline
+        ON appointment (VAT_client, date_timestamp, VAT_doctor);
+        """,
+        # Availability and booking: the appointments of a window of days, per doctor.
+        """
+        CREATE INDEX IF NOT EXISTS appointment_date_doctor
+        ON appointment (date_timestamp, VAT_doctor);
+        """,
+        # The primary keys of these start with the procedure name; consultation,
+        # consultation_diagnostic and consultation_assistant already start with
+        # (VAT_doctor, date_timestamp).
+        """
+        CREATE INDEX IF NOT EXISTS procedure_in_consultation_consultation
+        ON procedure_in_consultation (VAT_doctor, date_timestamp, name);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS procedure_charting_consultation
+        ON procedure_charting (VAT_doctor, date_timestamp, name);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS procedure_imaging_consultation
+        ON procedure_imaging (VAT_doctor, date_timestamp, name);
+        """,
+    ]),
+    (3, "drop the notebook BRIN indexes", [f"DROP INDEX IF EXISTS {name};" for name in NOTEBOOK_INDEXES]),
+]
+
+# A consultation with a procedure, and the week around it.
+SAMPLE = """
+    SELECT a.VAT_client AS "VAT", a.VAT_doctor AS "VAT_doctor", a.date_timestamp AS "date_timestamp",
+        pc.name AS "name", date_trunc('day', a.date_timestamp) AS "start",
+        date_trunc('day', a.date_timestamp) + interval '7 days' AS "end", ARRAY[a.VAT_doctor] AS "doctors",
+        a.date_timestamp + interval '1 year' AS "before_date", a.VAT_doctor AS "before_doctor", 21 AS "limit"
+    FROM procedure_in_consultation AS pc
+    JOIN appointment AS a ON a.VAT_doctor = pc.VAT_doctor AND a.date_timestamp = pc.date_timestamp
+    LIMIT 1;
+"""
+
+# Tables that grow with the activity of the clinic.
+LARGE_TABLES = {"client", "appointment", "consultation", "procedure_in_consultation", "consultation_diagnostic",
+                "consultation_assistant", "consultation_rollup"}
+
+# name: query, run with the parameters of SAMPLE
+PLAN_CHECKS = {
+    **{f"client page: {part}": history.PARTS[part].sql for part in ("client", "timeline")},
+    **{f"consultation page: {part}": consultation.PARTS[part].sql
+       for part in ("appointment", "consultation", "procedures", "procedure", "diagnosis", "nurses")},
+    "availability": availability.BOOKED,
+    "booking suggestions": availability.OCCUPANCY,
+}
+
+
+def pending(conn):
+    """The migrations not applied yet, in order."""
+    with conn.cursor() as cur:
+        cur.execute(TABLE)
+        cur.execute("SELECT version FROM schema_migrations;")
+        applied = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def apply(conn):
+    """Apply the pending migrations, each in its own transaction; return their names."""
+    names = []
+    for version, name, statements in pending(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%(lock)s);", {"lock": LOCK})
+            # Another process may have applied it while we waited for the lock.
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %(version)s;", {"version": version})
+            if cur.fetchone() is None:
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute("""
+                    INSERT INTO schema_migrations (version, name)
+                    VALUES (%(version)s, %(name)s);
+                """, {"version": version, "name": name})
+                names.append(name)
+        conn.commit()
+    return names
+
+
+def seq_scans(plan):
+    """The large tables that ``plan`` (an EXPLAIN (FORMAT JSON) node) reads sequentially."""
+    tables = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in LARGE_TABLES:
+        tables.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables.extend(seq_scans(child))
+    return tables
+
+
+def check_plans(conn):
+    """Return ``{query name: [tables scanned sequentially]}`` for the failing ``PLAN_CHECKS``.
+
+    Returns None when the database has no consultation with a procedure to
+    take the parameters from.
+    """
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(SAMPLE)
+        params = cur.fetchone()
+        if params is None:
+            return None
+
+        failures = {}
+        for name, query in PLAN_CHECKS.items():
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()["QUERY PLAN"]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = seq_scans(plan[0]["Plan"])
+            if tables:
+                failures[name] = tables
+    conn.rollback()
+    return failures
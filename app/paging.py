@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""Keyset (cursor-based) pagination over server-side cursors."""
+from psycopg import sql
+from psycopg.rows import namedtuple_row
+
+from db import connection
+
+# Rows fetched from the server per round trip while a page is being streamed.
+ITERSIZE = 500
+
+
+class KeysetPage:
+    """One page of a query ordered on a unique key, e.g. ``("name", "VAT")``.
+
+    ``query`` is a ``psycopg.sql.SQL`` with ``{keyset}``, ``{order}`` and
+    ``{limit}`` placeholders which are filled in for the requested page.
+    Rows are read lazily from a server-side cursor while the page is iterated,
+    so it can be handed straight to a streamed template. ``has_previous``,
+    ``has_next`` and the link arguments are only final once it was iterated.
+    ``fetch`` reads the page into a list first instead.
+    """
+
+    def __init__(self, query, params, key, size, after=None, before=None, name="keyset_page", replica=False):
+        self.query = query
+        self.params = params
+        self.key = key
+        self.size = size
+        self.after = after
+        self.before = before
+        self.name = name
+        self.replica = replica
+        self.first = None
+        self.last = None
+        self.has_previous = after is not None
+        self.has_next = before is not None
+        self.rows = None
+
+    @classmethod
+    def from_args(cls, args, query, params, key, size, **kwargs):
+        """Build the page requested by the ``after_*``/``before_*`` query arguments."""
+        after = cls._bound_from_args(args, "after", key)
+        before = cls._bound_from_args(args, "before", key)
+        return cls(query, params, key, size, after=after, before=before, **kwargs)
+
+    @staticmethod
+    def _attribute(column):
+        return column.split(".")[-1].lower()
+
+    @classmethod
+    def _bound_from_args(cls, args, prefix, key):
+        values = tuple(args.get(f"{prefix}_{cls._attribute(column)}") for column in key)
+        if any(value is None for value in values):
+            return None
+        return values
+
+    def _statement(self):
+        backward = self.before is not None
+        bound = self.before if backward else self.after
+        # Key columns are written as in the queries, unquoted: fold them as PostgreSQL does.
+        columns = [sql.Identifier(*column.lower().split(".")) for column in self.key]
+        params = dict(self.params)
+
+        if bound is None:
+            keyset = sql.SQL("TRUE")
+        else:
+            placeholders = [sql.Placeholder(f"_key{i}") for i in range(len(self.key))]
+            keyset = sql.SQL("({}) {} ({})").format(
+                sql.SQL(", ").join(columns),
+                sql.SQL("<" if backward else ">"),
+                sql.SQL(", ").join(placeholders),
+            )
+            params.update({f"_key{i}": value for i, value in enumerate(bound)})
+
+        direction = sql.SQL("DESC" if backward else "ASC")
+        order = sql.SQL(", ").join(sql.SQL("{} {}").format(column, direction) for column in columns)
+        statement = self.query.format(keyset=keyset, order=order, limit=sql.Literal(self.size + 1))
+        return statement, params
+
+    def _key_of(self, row):
+        return tuple(getattr(row, self._attribute(column)) for column in self.key)
+
+    def fetch(self):
+        """Read the whole page now; iterating it later goes over these rows."""
+        self.rows = list(self._read())
+        return self
+
+    def __iter__(self):
+        if self.rows is not None:
+            return iter(self.rows)
+        return self._read()
+
+    def _read(self):
+        statement, params = self._statement()
+        with connection(replica=self.replica) as conn:
+            with conn.cursor(name=self.name, row_factory=namedtuple_row) as cur:
+                cur.itersize = min(self.size + 1, ITERSIZE)
+                cur.execute(statement, params)
+
+                if self.before is not None:
+                    # Walking backwards: the page is read in reverse order.
+                    rows = cur.fetchmany(self.size + 1)
+                    self.has_previous = len(rows) > self.size
+                    rows = rows[:self.size][::-1]
+                else:
+                    rows = cur
+
+                count = 0
+                for row in rows:
+                    if count == self.size:
+                        self.has_next = True
+                        break
+                    if count == 0:
+                        self.first = self._key_of(row)
+                    self.last = self._key_of(row)
+                    count += 1
+                    yield row
+
+                if count == 0:
+                    # Nothing to anchor links on, e.g. a stale bookmark.
+                    self.has_previous = self.has_next = False
+
+    def _link_args(self, prefix, bound):
+        return {f"{prefix}_{self._attribute(column)}": value for column, value in zip(self.key, bound)}
+
+    def next_args(self):
+        """``url_for`` arguments of the page after this one."""
+        return self._link_args("after", self.last)
+
+    def previous_args(self):
+        """``url_for`` arguments of the page before this one."""
+        return self._link_args("before", self.first)
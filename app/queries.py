@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+"""Catalog of the queries shared by the pages, with the columns of their rows.
+
+Each ``Query`` declares the columns it selects; its rows are instances of a
+class with one slot per column, built once when the catalog is imported,
+instead of a namedtuple class looked up from the cursor description on every
+execute. The class is its own psycopg row maker, so fetching a row costs one
+allocation.
+
+Queries marked ``prepare`` are the ones of the busiest pages: psycopg
+prepares them on the server the first time a connection runs them, and every
+later run on that connection skips parsing and planning. Other queries are
+left to psycopg's default, which prepares a query once a connection has run
+it a few times.
+"""
+from psycopg import ProgrammingError
+
+
+class Row:
+    """Base of the row classes: attributes by column name, no ``__dict__``.
+
+    Rows compare and hash by their values, like the namedtuples they replace,
+    so they can go in sets and be dict keys; do not change a row once it is in one.
+    """
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={value!r}' for name, value in zip(self.__slots__, self))})"
+
+    def _asdict(self):
+        return dict(zip(self.__slots__, self))
+
+
+def row_class(name, columns):
+    """A ``Row`` subclass with one slot per column, built from a sequence of values."""
+    namespace = {}
+    # Same technique as collections.namedtuple: the names are identifiers from this module, never user input.
+    exec(f"def __init__(self, values):\n    {', '.join('self.' + column for column in columns)}, = values", namespace)
+    return type(name, (Row,), {"__slots__": tuple(columns), "__init__": namespace["__init__"]})
+
+
+class Query:
+    """A named query, the columns of its rows and how its result is fetched ("one" or "all")."""
+
+    __slots__ = ("name", "sql", "columns", "fetch", "prepare", "row")
+
+    def __init__(self, name, sql, columns, fetch="all", prepare=False):
+        self.name = name
+        self.sql = sql
+        self.columns = tuple(columns)
+        self.fetch = fetch
+        # None lets psycopg decide, after a few runs on the same connection.
+        self.prepare = True if prepare else None
+        self.row = row_class("".join(part.title() for part in name.split("_")) + "Row", self.columns)
+
+    def rows(self, cursor):
+        """psycopg row factory of the query."""
+        names = tuple(column.name for column in cursor.description)
+        if names != self.columns:
+            raise ProgrammingError(f"Query {self.name} returned columns {names}, expected {self.columns}.")
+        return self.row
+
+    def execute(self, cur, params):
+        """Run the query on ``cur``, a cursor created with ``row_factory=query.rows`` (awaitable on async cursors)."""
+        return cur.execute(self.sql, params, prepare=self.prepare)
+
+    def result(self, cur):
+        return cur.fetchone() if self.fetch == "one" else cur.fetchall()
+
+    def __repr__(self):
+        return f"Query({self.name!r})"
+
+
+CLIENT_VERSION = Query("client_version", """
+    SELECT COALESCE((SELECT version FROM client_version WHERE VAT = %(VAT)s), 0) AS version;
+""", ["version"], fetch="one", prepare=True)
+
+# The client version and the version of the reference tables the consultation page shows.
+CONSULTATION_VERSION = Query("consultation_version", """
+    SELECT COALESCE((SELECT version FROM client_version WHERE VAT = %(VAT)s), 0)
+        || '.' || COALESCE((SELECT version FROM reference_version), 0) AS version;
+""", ["version"], fetch="one", prepare=True)
+
+CLIENT = Query("client", """
+    SELECT VAT, name, birth_date, street, city, zip, gender
+    FROM client
+    WHERE VAT = %(VAT)s;
+""", ["vat", "name", "birth_date", "street", "city", "zip", "gender"], fetch="one", prepare=True)
+
+# One page of the appointments of a client, newest first, before the
+# (%(before_date)s, %(before_doctor)s) keyset when it is set. No SOAP notes:
+# the timeline only says which appointments became a consultation.
+CLIENT_TIMELINE = Query("client_timeline", """
+    SELECT a.VAT_doctor, a.date_timestamp, a.VAT_client, a.description,
+        EXISTS (
+            SELECT 1 FROM consultation AS c
+            WHERE c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
+        ) AS is_in_consultation
+    FROM appointment AS a
+    WHERE a.VAT_client = %(VAT)s
+        AND (a.date_timestamp, a.VAT_doctor)
+            < (COALESCE(%(before_date)s::timestamp, 'infinity'), COALESCE(%(before_doctor)s::text, ''))
+    ORDER BY a.date_timestamp DESC, a.VAT_doctor DESC
+    LIMIT %(limit)s;
+""", ["vat_doctor", "date_timestamp", "vat_client", "description", "is_in_consultation"], prepare=True)
+
+# The queries of a consultation join its rows straight to the appointment,
+# which pins both the consultation and the client.
+APPOINTMENT = Query("appointment", """
+    SELECT VAT_doctor, date_timestamp, VAT_client, description
+    FROM appointment
+    WHERE VAT_client = %(VAT)s AND VAT_doctor = %(VAT_doctor)s AND date_timestamp = %(date_timestamp)s;
+""", ["vat_doctor", "date_timestamp", "vat_client", "description"], fetch="one", prepare=True)
+
+CONSULTATION = Query("consultation", """
+    SELECT c.VAT_doctor,  c.date_timestamp, c.soap_s, c.soap_o, c.soap_a, c.soap_p
+    FROM consultation AS c
+    JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
+    WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
+""", ["vat_doctor", "date_timestamp", "soap_s", "soap_o", "soap_a", "soap_p"], fetch="one", prepare=True)
+
+PROCEDURES = Query("procedures", """
+    SELECT pc.name, pc.VAT_doctor, pc.date_timestamp, pc.description
+    FROM procedure_in_consultation AS pc
+    JOIN appointment AS a ON pc.VAT_doctor = a.VAT_doctor AND pc.date_timestamp = a.date_timestamp
+    WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s
+    ORDER BY pc.date_timestamp;
+""", ["name", "vat_doctor", "date_timestamp", "description"], prepare=True)
+
+PROCEDURE = Query("procedure", """
+    SELECT pc.name, pc.VAT_doctor, pc.date_timestamp, pc.description
+    FROM procedure_in_consultation AS pc
+    JOIN appointment AS a ON pc.VAT_doctor = a.VAT_doctor AND pc.date_timestamp = a.date_timestamp
+    WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s
+        AND pc.name = %(name)s;
+""", ["name", "vat_doctor", "date_timestamp", "description"], fetch="one")
+
+DIAGNOSES = Query("diagnoses", """
+    SELECT dc.ID, dc.description
+    FROM diagnostic_code AS dc
+    JOIN consultation_diagnostic AS cd ON cd.ID = dc.ID
+    JOIN appointment AS a ON cd.VAT_doctor = a.VAT_doctor AND cd.date_timestamp = a.date_timestamp
+    WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s
+    ORDER BY cd.date_timestamp;
+""", ["id", "description"], prepare=True)
+
+NURSES = Query("nurses", """
+    SELECT n.VAT, e.name
+    FROM nurse AS n
+    JOIN employee AS e ON e.VAT = n.VAT
+    JOIN consultation_assistant AS ca ON ca.VAT_nurse = n.VAT
+    JOIN appointment AS a ON ca.VAT_doctor = a.VAT_doctor AND ca.date_timestamp = a.date_timestamp
+    WHERE a.VAT_client = %(VAT)s AND a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s;
+""", ["vat", "name"], prepare=True)
+
+# Whether a consultation already has a procedure or a diagnostic, before adding it.
+HAS_PROCEDURE = Query("has_procedure", """
+    SELECT name
+    FROM procedure_in_consultation
+    WHERE date_timestamp = %(date_timestamp)s AND VAT_doctor = %(VAT_doctor)s AND name = %(name)s;
+""", ["name"], fetch="one")
+
+HAS_DIAGNOSTIC = Query("has_diagnostic", """
+    SELECT ID
+    FROM consultation_diagnostic
+    WHERE date_timestamp = %(date_timestamp)s AND VAT_doctor = %(VAT_doctor)s AND ID = %(ID)s;
+""", ["id"], fetch="one")
+
+# Doctors without an appointment at %(date_timestamp)s.
+FREE_DOCTORS = Query("free_doctors", """
+    SELECT e.name, d.specialization, d.email, d.biography, e.VAT
+    FROM doctor AS d JOIN employee as e ON e.VAT = d.VAT
+    WHERE d.VAT NOT IN(
+        SELECT d1.VAT
+        FROM doctor AS d1
+        JOIN appointment AS a ON a.VAT_doctor = d1.VAT
+        WHERE a.date_timestamp = %(date_timestamp)s
+    )
+    ORDER BY e.VAT;
+""", ["name", "specialization", "email", "biography", "vat"])
+
+
+def run(conn, query, params):
+    """The result of ``query``: one row (or None) or the list of rows."""
+    with conn.cursor(row_factory=query.rows) as cur:
+        query.execute(cur, params)
+        return query.result(cur)
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""In-process cache of the reference tables: procedures, nurses and diagnostic codes.
+
+Entries expire after ``REFDATA_TTL`` seconds. Triggers created by ``SCHEMA``
+send a ``NOTIFY refdata, '<table>'`` whenever one of the tables changes, and a
+listener thread in every worker drops the matching entry, so changes show up
+within seconds without waiting for the TTL. Entries are loaded from the
+primary, never from a replica: the NOTIFY comes from the primary, and a
+lagging replica would hand back the rows it drops, to be kept for the TTL.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import psycopg
+
+from db import DATABASE_URL
+from db import connection
+
+log = logging.getLogger(__name__)
+
+REFDATA_TTL = float(os.environ.get("REFDATA_TTL", 300))
+# Seconds to wait before reconnecting the listener after an error.
+LISTEN_RETRY = 5
+CHANNEL = "refdata"
+
+# table: (query, how the rows are stored)
+DATASETS = {
+    "procedure": ("""
+        SELECT name, type
+        FROM procedure;
+    """, dict),
+    "nurse": ("""
+        SELECT VAT
+        FROM nurse;
+    """, frozenset),
+    "diagnostic_code": ("""
+        SELECT ID, description
+        FROM diagnostic_code;
+    """, dict),
+}
+
+SCHEMA = [
+    f"""
+    CREATE OR REPLACE FUNCTION notify_refdata() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{CHANNEL}', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+] + [
+    f"""
+    CREATE OR REPLACE TRIGGER {table}_refdata
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_refdata();
+    """
+    for table in DATASETS
+]
+
+
+class ReferenceCache:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = Counter()
+        self.misses = Counter()
+        self._entries = {}
+        self._generation = Counter()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+        # Set once the listener of this process listens, after dropping what it may have missed.
+        self._listening = threading.Event()
+
+    def get(self, table, conn=None):
+        """Return the cached rows of ``table``, loading them on ``conn`` (a primary connection) or a pooled one."""
+        self._ensure_listener()
+
+        entry = self._entries.get(table)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.hits[table] += 1
+            return entry[1]
+
+        self.misses[table] += 1
+        generation = self._generation[table]
+        loaded_at = time.monotonic()
+        value = self._load(table, conn)
+        with self._lock:
+            # Do not store rows that were invalidated while they were loading.
+            if self._generation[table] == generation:
+                self._entries[table] = (loaded_at, value)
+        return value
+
+    def _load(self, table, conn):
+        query, kind = DATASETS[table]
+        if conn is None:
+            with connection() as conn:
+                rows = conn.execute(query).fetchall()
+        else:
+            rows = conn.execute(query).fetchall()
+
+        if kind is frozenset:
+            return frozenset(row[0] for row in rows)
+        return {row[0]: row[1] for row in rows}
+
+    def prime(self, timeout=LISTEN_RETRY):
+        """Load every table, once the listener is up so that its first invalidation doesn't drop them."""
+        self._ensure_listener()
+        self._listening.wait(timeout)
+        return {table: len(self.get(table)) for table in DATASETS}
+
+    def invalidate(self, table=None):
+        with self._lock:
+            for name in ([table] if table else list(DATASETS)):
+                self._generation[name] += 1
+                self._entries.pop(name, None)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            table: {
+                "hits": self.hits[table],
+                "misses": self.misses[table],
+                "age": round(now - self._entries[table][0], 1) if table in self._entries else None,
+            }
+            for table in DATASETS
+        }
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid != pid:
+                # A forked worker inherits nothing it can trust: start afresh.
+                self._entries.clear()
+                self._listening = threading.Event()
+                threading.Thread(target=self._listen, name="refdata-listener", daemon=True).start()
+                self._listener_pid = pid
+
+    def _listen(self):
+        while True:
+            try:
+                with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL};")
+                    # Changes may have been missed while we were not listening.
+                    self.invalidate()
+                    self._listening.set()
+                    for notify in conn.notifies():
+                        if notify.payload in DATASETS:
+                            self.invalidate(notify.payload)
+            except psycopg.Error as error:
+                log.warning(f"Reference data listener disconnected: {error}")
+            time.sleep(LISTEN_RETRY)
+
+
+cache = ReferenceCache(REFDATA_TTL)
+
+
+def procedures(conn=None):
+    """``{name: type}`` of every procedure."""
+    return cache.get("procedure", conn)
+
+
+def nurses(conn=None):
+    """``frozenset`` of the VAT of every nurse."""
+    return cache.get("nurse", conn)
+
+
+def diagnostic_codes(conn=None):
+    """``{ID: description}`` of every diagnostic code."""
+    return cache.get("diagnostic_code", conn)
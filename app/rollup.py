@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+"""Per-(client VAT, consultation date) totals of procedures and diagnostic codes.
+
+The ``consultation_rollup`` table holds the same numbers as the
+``facts_consultations`` view, but is maintained incrementally by the handlers
+that add or remove consultations, procedures and diagnostics, so the dashboard
+never has to recompute them from the base tables.
+"""
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS consultation_rollup(
+        VAT VARCHAR(20),
+        date TIMESTAMP,
+        num_procedures BIGINT NOT NULL DEFAULT 0,
+        num_diagnostic_codes BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY(VAT, date)
+    );
+"""
+
+
+# The totals of every consultation, computed from the base tables; rows already there are overwritten.
+# The children are counted in one pass each and hash joined, so it takes no index: migration 1 runs
+# it before migration 2 creates the one on procedure_in_consultation (VAT_doctor, date_timestamp).
+POPULATE = """
+    INSERT INTO consultation_rollup (VAT, date, num_procedures, num_diagnostic_codes)
+    SELECT a.VAT_client, c.date_timestamp, SUM(COALESCE(p.total, 0)), SUM(COALESCE(d.total, 0))
+    FROM consultation AS c
+    JOIN appointment AS a ON c.VAT_doctor = a.VAT_doctor AND c.date_timestamp = a.date_timestamp
+    LEFT JOIN (
+        SELECT VAT_doctor, date_timestamp, COUNT(*) AS total
+        FROM procedure_in_consultation
+        GROUP BY VAT_doctor, date_timestamp
+    ) AS p ON p.VAT_doctor = c.VAT_doctor AND p.date_timestamp = c.date_timestamp
+    LEFT JOIN (
+        SELECT VAT_doctor, date_timestamp, COUNT(*) AS total
+        FROM consultation_diagnostic
+        GROUP BY VAT_doctor, date_timestamp
+    ) AS d ON d.VAT_doctor = c.VAT_doctor AND d.date_timestamp = c.date_timestamp
+    GROUP BY a.VAT_client, c.date_timestamp
+    ON CONFLICT (VAT, date) DO UPDATE
+    SET num_procedures = EXCLUDED.num_procedures, num_diagnostic_codes = EXCLUDED.num_diagnostic_codes;
+"""
+
+
+def bump(cur, VAT_doctor, date_timestamp, procedures=0, diagnostic_codes=0):
+    """Add the given deltas to the rollup row of a consultation.
+
+    Must run on the cursor (and thus in the transaction) of the write that
+    caused the change. The client VAT is resolved from the appointment.
+    """
+    cur.execute("""
+        INSERT INTO consultation_rollup (VAT, date, num_procedures, num_diagnostic_codes)
+        SELECT a.VAT_client, a.date_timestamp, %(procedures)s, %(diagnostic_codes)s
+        FROM appointment AS a
+        WHERE a.VAT_doctor = %(VAT_doctor)s AND a.date_timestamp = %(date_timestamp)s
+        ON CONFLICT (VAT, date) DO UPDATE
+        SET num_procedures = consultation_rollup.num_procedures + EXCLUDED.num_procedures,
+            num_diagnostic_codes = consultation_rollup.num_diagnostic_codes + EXCLUDED.num_diagnostic_codes;
+    """, {"VAT_doctor": VAT_doctor, "date_timestamp": date_timestamp,
+          "procedures": procedures, "diagnostic_codes": diagnostic_codes})
+
+
+def rebuild(conn):
+    """Recompute the whole rollup from the base tables in one transaction."""
+    with conn.cursor() as cur:
+        cur.execute(CREATE_TABLE)
+        cur.execute("LOCK TABLE consultation_rollup IN EXCLUSIVE MODE;")
+        cur.execute("DELETE FROM consultation_rollup;")
+        cur.execute(POPULATE)
+        rows = cur.rowcount
+    conn.commit()
+    return rows
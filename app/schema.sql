@@ -0,0 +1,321 @@
+-- Clinic schema, as defined in work/02-e3-project.ipynb.
+-- Running it drops and recreates every table.
+
+/* Drop all tables */
+-- The app migrations are applied again on the new tables by `flask migrate`.
+DROP TABLE IF EXISTS schema_migrations;
+DROP TABLE IF EXISTS reference_version;
+DROP TABLE IF EXISTS client_version;
+DROP TABLE IF EXISTS consultation_rollup;
+DROP VIEW IF EXISTS facts_consultations;
+DROP VIEW IF EXISTS dim_date;
+DROP VIEW IF EXISTS dim_client;
+DROP VIEW IF EXISTS dim_location;
+DROP TABLE IF EXISTS procedure_imaging;
+DROP TABLE IF EXISTS procedure_charting;
+DROP TABLE IF EXISTS teeth;
+DROP TABLE IF EXISTS procedure_in_consultation;
+DROP TABLE IF EXISTS procedure;
+DROP TABLE IF EXISTS prescription;
+DROP TABLE IF EXISTS medication;
+DROP TABLE IF EXISTS consultation_diagnostic;
+DROP TABLE IF EXISTS diagnostic_code_relation;
+DROP TABLE IF EXISTS diagnostic_code;
+DROP TABLE IF EXISTS consultation_assistant;
+DROP TABLE IF EXISTS consultation;
+DROP TABLE IF EXISTS appointment;
+DROP TABLE IF EXISTS supervison_report;
+DROP TABLE IF EXISTS trainee_doctor;
+DROP TABLE IF EXISTS permanent_doctor;
+DROP TABLE IF EXISTS doctor;
+DROP TABLE IF EXISTS nurse;
+DROP TABLE IF EXISTS receptionist;
+DROP TABLE IF EXISTS phone_number_employee;
+DROP TABLE IF EXISTS employee;
+DROP TABLE IF EXISTS phone_number_client;
+DROP TABLE IF EXISTS client;
+
+CREATE TABLE client(
+    VAT VARCHAR(20),
+    name VARCHAR(80) NOT NULL,
+    birth_date DATE NOT NULL,
+    street VARCHAR(255) NOT NULL,
+    city VARCHAR(30) NOT NULL,
+    zip VARCHAR(12) NOT NULL,
+    gender CHAR(1) NOT NULL,
+    PRIMARY KEY(VAT),
+    CHECK(LENGTH(zip) >= 2)
+);
+
+CREATE TABLE phone_number_client(
+    VAT VARCHAR(20), 
+    phone VARCHAR(15), 
+    PRIMARY KEY(VAT, phone),
+    FOREIGN KEY(VAT) REFERENCES client(VAT),
+    CHECK(LENGTH(phone) >= 3)
+);
+
+CREATE TABLE employee(
+    VAT VARCHAR(20),
+    name VARCHAR(80) NOT NULL,
+    birth_date DATE NOT NULL,
+    street VARCHAR(255) NOT NULL,
+    city VARCHAR(30) NOT NULL,
+    zip VARCHAR(12) NOT NULL,
+    IBAN VARCHAR(30) NOT NULL,
+    salary NUMERIC(16,4) NOT NULL,
+    PRIMARY KEY(VAT),
+    UNIQUE(IBAN),
+    CHECK(salary > 0),
+    CHECK(LENGTH(zip) >= 2)
+    /* -- No Employee can exist at the same time in both the table 'nurse' 
+    and in the table 'doctor' */
+    /* -- No Employee can exist at the same time in both the table 'receptionist' 
+    and in the table 'doctor' */
+    /* -- No Employee can exist at the same time in both the table 'nurse' and 
+    in the table 'receptionist' */
+    /* -- Every Employee must exist either in the table 'nurse' or in the table 'doctor'
+    or in the table 'receptionist' */
+);
+
+CREATE TABLE phone_number_employee(
+    VAT VARCHAR(20), 
+    phone VARCHAR(15), 
+    PRIMARY KEY(VAT, phone),
+    FOREIGN KEY(VAT) REFERENCES employee(VAT),
+    CHECK(LENGTH(phone) >= 3)
+);
+
+CREATE TABLE receptionist(
+    VAT VARCHAR(20),
+    PRIMARY KEY(VAT),
+    FOREIGN KEY(VAT) REFERENCES employee(VAT)
+);
+
+CREATE TABLE nurse(
+    VAT VARCHAR(20),
+    PRIMARY KEY(VAT),
+    FOREIGN KEY(VAT) REFERENCES employee(VAT)
+);
+
+CREATE TABLE doctor(
+    VAT VARCHAR(20),
+    specialization VARCHAR(200) NOT NULL,
+    biography TEXT NOT NULL, 
+    email VARCHAR(254) NOT NULL,
+    PRIMARY KEY(VAT),
+    FOREIGN KEY(VAT) REFERENCES employee(VAT),
+    UNIQUE(email),
+    CHECK(LENGTH(email) >= 6)
+    /* -- No Doctor can exist at the same time in both the table 'permanent_doctor' 
+    and in the table 'trainee_doctor' */
+    /* -- Every Doctor must exist either in the table 'permanent_doctor' or 
+    in the table 'trainee_doctor' */
+);
+
+CREATE TABLE permanent_doctor(
+    VAT VARCHAR(20),
+    years INTEGER NOT NULL,
+    PRIMARY KEY(VAT),
+    FOREIGN KEY(VAT) REFERENCES doctor(VAT),
+    CHECK(years >= 0)
+);
+
+CREATE TABLE trainee_doctor(
+    VAT VARCHAR(20),
+    supervisor VARCHAR(20) NOT NULL,
+    PRIMARY KEY(VAT),
+    FOREIGN KEY(VAT) REFERENCES doctor(VAT),
+    FOREIGN KEY(supervisor) REFERENCES permanent_doctor(VAT) 
+       
+);
+
+CREATE TABLE supervison_report(
+    VAT VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    description TEXT NOT NULL,
+    evaluation NUMERIC(3,2) NOT NULL, 
+    PRIMARY KEY(VAT, date_timestamp),
+    FOREIGN KEY(VAT) REFERENCES trainee_doctor(VAT),
+    CHECK(evaluation >= 1 and evaluation <= 5)
+);
+
+CREATE TABLE appointment(
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    VAT_client VARCHAR(20) NOT NULL,
+    description TEXT NOT NULL,
+    PRIMARY KEY(VAT_doctor, date_timestamp),
+    FOREIGN KEY(VAT_doctor) REFERENCES doctor(VAT),
+    FOREIGN KEY(VAT_client) REFERENCES client(VAT)
+);
+
+CREATE TABLE consultation(
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    SOAP_S TEXT NOT NULL,
+    SOAP_O TEXT NOT NULL,
+    SOAP_A TEXT NOT NULL,
+    SOAP_P TEXT NOT NULL,
+    PRIMARY KEY(VAT_doctor, date_timestamp),
+    FOREIGN KEY(VAT_doctor, date_timestamp) 
+        REFERENCES appointment(VAT_doctor, date_timestamp) 
+    /* -- Consultations are always assigned to at least one assistant nurse */
+);
+
+CREATE TABLE consultation_assistant(
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    VAT_nurse VARCHAR(20) NOT NULL,    
+    PRIMARY KEY(VAT_doctor, date_timestamp),
+    FOREIGN KEY(VAT_doctor, date_timestamp) 
+        REFERENCES consultation(VAT_doctor, date_timestamp),
+    FOREIGN KEY(VAT_nurse) REFERENCES nurse(VAT)
+);
+
+CREATE TABLE diagnostic_code(
+    ID VARCHAR(7), 
+    description TEXT NOT NULL,
+    PRIMARY KEY(ID)
+);
+
+CREATE TABLE diagnostic_code_relation(
+    ID1 VARCHAR(7), 
+    ID2 VARCHAR(7),
+    type VARCHAR(200) NOT NULL,
+    PRIMARY KEY(ID1, ID2),
+    FOREIGN KEY(ID1) REFERENCES diagnostic_code(ID),
+    FOREIGN KEY(ID2) REFERENCES diagnostic_code(ID)
+);
+
+CREATE TABLE consultation_diagnostic(
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    ID VARCHAR(7), 
+    PRIMARY KEY(VAT_doctor, date_timestamp, ID),
+    FOREIGN KEY(VAT_doctor, date_timestamp) 
+        REFERENCES consultation(VAT_doctor, date_timestamp),
+    FOREIGN KEY(ID) REFERENCES diagnostic_code(ID)
+);
+
+CREATE TABLE medication(
+    name VARCHAR(255),
+    lab VARCHAR(200),
+    PRIMARY KEY(name, lab)
+);
+
+CREATE TABLE prescription(
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    ID VARCHAR(7),
+    name VARCHAR(255),
+    lab VARCHAR(200),
+    dosage VARCHAR(80) NOT NULL,
+    description TEXT NOT NULL,
+    PRIMARY KEY(VAT_doctor, date_timestamp, ID, name, lab),
+    FOREIGN KEY(VAT_doctor, date_timestamp, ID) 
+        REFERENCES consultation_diagnostic(VAT_doctor, date_timestamp, ID),
+    FOREIGN KEY(name, lab) REFERENCES medication(name, lab)
+       
+);
+
+CREATE TABLE procedure(
+    name VARCHAR(200),
+    type VARCHAR(150) NOT NULL,
+    PRIMARY KEY(name)
+);
+
+CREATE TABLE procedure_in_consultation(
+    name VARCHAR(200),
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    description TEXT NOT NULL,
+    PRIMARY KEY(name, VAT_doctor, date_timestamp),
+    FOREIGN KEY(name) REFERENCES procedure(name),
+    FOREIGN KEY(VAT_doctor, date_timestamp) 
+        REFERENCES consultation(VAT_doctor, date_timestamp) 
+       
+);
+
+CREATE TABLE teeth(
+    quadrant CHAR(1),
+    number CHAR(1),
+    name VARCHAR(200) NOT NULL,
+    PRIMARY KEY(quadrant, number)
+);
+
+CREATE TABLE procedure_charting(
+    name VARCHAR(200),
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    quadrant CHAR(1),
+    number CHAR(1),
+    description TEXT NOT NULL,
+    measure NUMERIC(6,2) NOT NULL, 
+    PRIMARY KEY(name, VAT_doctor, date_timestamp, quadrant, number),
+    FOREIGN KEY(name, VAT_doctor, date_timestamp) 
+        REFERENCES procedure_in_consultation(name, VAT_doctor, date_timestamp),
+    FOREIGN KEY(quadrant, number) REFERENCES teeth(quadrant, number)
+       
+);
+
+CREATE TABLE procedure_imaging(
+    name VARCHAR(200),
+    VAT_doctor VARCHAR(20),
+    date_timestamp TIMESTAMP,
+    file TEXT,
+    PRIMARY KEY(name, VAT_doctor, date_timestamp, file),
+    FOREIGN KEY(name, VAT_doctor, date_timestamp) 
+        REFERENCES procedure_in_consultation(name, VAT_doctor, date_timestamp)
+       
+);
+
+DROP VIEW IF EXISTS dim_date;
+
+CREATE VIEW dim_date AS
+SELECT DISTINCT
+    date_timestamp AS date,
+    EXTRACT(DAY FROM date_timestamp) AS day,
+    EXTRACT(MONTH FROM date_timestamp) AS month,
+    EXTRACT(YEAR FROM date_timestamp) AS year
+FROM consultation;
+
+DROP VIEW IF EXISTS dim_client;
+
+CREATE VIEW dim_client AS
+SELECT
+    VAT,
+    gender,
+    EXTRACT(YEAR FROM age(birth_date)) AS age
+FROM client;
+
+DROP VIEW IF EXISTS dim_location;
+
+CREATE VIEW dim_location AS
+SELECT DISTINCT
+    zip,
+    city
+FROM client;
+
+DROP VIEW IF EXISTS facts_consultations;
+
+CREATE VIEW facts_consultations AS
+SELECT
+    c.VAT,
+    d.date,
+    l.zip,
+    (SELECT COUNT(cd.ID)
+        FROM consultation_diagnostic cd 
+        WHERE cd.date_timestamp = cc.date_timestamp 
+            AND cd.VAT_doctor = cc.VAT_doctor) AS num_diagnostic_codes,
+    (SELECT COUNT(pc.name)
+        FROM procedure_in_consultation pc
+        WHERE pc.date_timestamp = cc.date_timestamp 
+            AND pc.VAT_doctor = cc.VAT_doctor) AS num_procedures
+FROM dim_client c 
+    JOIN client cl ON cl.VAT = c.VAT
+    JOIN dim_location l ON cl.zip = l.zip
+    JOIN appointment a ON a.VAT_client = c.VAT
+    JOIN consultation cc ON cc.date_timestamp = a.date_timestamp 
+        AND cc.VAT_doctor = a.VAT_doctor
+    JOIN dim_date d ON d.date = cc.date_timestamp;
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+"""Indexed client search.
+
+Matches are ranked as exact VAT first, then clients whose name starts with the
+search term, then fuzzy (trigram) matches on name, street, city or zip. Every
+branch is answered from an index created by ``SCHEMA``. ``search_page``
+pages through the best matches for the client list.
+"""
+from psycopg import sql
+
+from paging import KeysetPage
+
+# Terms shorter than this cannot use the trigram indexes, so they only match
+# on VAT and name prefix.
+MIN_FUZZY_LENGTH = 3
+
+SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+    "CREATE INDEX IF NOT EXISTS client_name_prefix_idx ON client (lower(name) text_pattern_ops);",
+    "CREATE INDEX IF NOT EXISTS client_name_trgm_idx ON client USING GIN (name gin_trgm_ops);",
+    "CREATE INDEX IF NOT EXISTS client_street_trgm_idx ON client USING GIN (street gin_trgm_ops);",
+    "CREATE INDEX IF NOT EXISTS client_city_trgm_idx ON client USING GIN (city gin_trgm_ops);",
+    "CREATE INDEX IF NOT EXISTS client_zip_trgm_idx ON client USING GIN (zip gin_trgm_ops);",
+]
+
+# Each client once, with its best match; every branch keeps its best %(candidates)s matches.
+MATCHES = """
+    SELECT DISTINCT ON (VAT) *
+    FROM (
+        SELECT c.VAT, c.name, c.birth_date, c.street, c.city, c.zip, c.gender,
+            0 AS relevance, 1.0::real AS score
+        FROM client AS c
+        WHERE c.VAT = %(search)s
+        UNION ALL
+        (SELECT c.VAT, c.name, c.birth_date, c.street, c.city, c.zip, c.gender,
+            1 AS relevance, similarity(c.name, %(search)s) AS score
+        FROM client AS c
+        WHERE lower(c.name) LIKE %(prefix)s
+        ORDER BY lower(c.name)
+        LIMIT %(candidates)s)
+        UNION ALL
+        (SELECT c.VAT, c.name, c.birth_date, c.street, c.city, c.zip, c.gender,
+            2 AS relevance,
+            GREATEST(word_similarity(%(search)s, c.name), word_similarity(%(search)s, c.street),
+                word_similarity(%(search)s, c.city), word_similarity(%(search)s, c.zip)) AS score
+        FROM client AS c
+        WHERE %(fuzzy)s
+            AND (c.name ILIKE %(search_like)s
+                OR c.street ILIKE %(search_like)s
+                OR c.city ILIKE %(search_like)s
+                OR c.zip ILIKE %(search_like)s
+                OR %(search)s <%% c.name)
+        ORDER BY score DESC
+        LIMIT %(candidates)s)
+    ) AS matches
+    ORDER BY VAT, relevance, score DESC
+"""
+
+SEARCH_CLIENTS = f"""
+    SELECT VAT, name, birth_date, street, city, zip, gender, relevance
+    FROM ({MATCHES}) AS best
+    ORDER BY relevance, score DESC, name, VAT
+    LIMIT %(limit)s;
+"""
+
+# The best %(limit)s matches numbered in order, for a ``KeysetPage`` on ``("rank",)``. One more
+# candidate than that is ranked, so that ``truncated`` tells whether any match was left out.
+SEARCH_PAGE = sql.SQL(f"""
+    SELECT *
+    FROM (
+        SELECT VAT, name, birth_date, street, city, zip, gender, relevance,
+            row_number() OVER (ORDER BY relevance, score DESC, name, VAT) AS rank,
+            count(*) OVER () > %(limit)s AS truncated
+        FROM ({MATCHES}) AS best
+    ) AS ranked
+    WHERE rank <= %(limit)s AND {{keyset}}
+    ORDER BY {{order}}
+    LIMIT {{limit}};
+""")
+
+
+def like_escape(term):
+    """Escape the LIKE wildcards of a user supplied term."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_params(search, limit, candidates):
+    """The parameters of the queries for the stripped, non-empty ``search``."""
+    escaped = like_escape(search)
+    return {
+        "search": search,
+        "prefix": escaped.lower() + "%",
+        "search_like": "%" + escaped + "%",
+        "fuzzy": len(search) >= MIN_FUZZY_LENGTH,
+        "limit": limit,
+        "candidates": candidates,
+    }
+
+
+def search_clients(cur, search, limit):
+    """Return at most ``limit`` clients matching ``search``, best matches first."""
+    search = (search or "").strip()
+    if not search:
+        return []
+
+    cur.execute(SEARCH_CLIENTS, search_params(search, limit, limit))
+    return cur.fetchall()
+
+
+def search_page(args, search, limit, size, replica=False):
+    """The page of the best ``limit`` clients matching ``search`` requested by ``args``, or None for no search."""
+    search = (search or "").strip()
+    if not search:
+        return None
+
+    return KeysetPage.from_args(args, SEARCH_PAGE, search_params(search, limit, limit + 1), key=("rank",),
+                                size=size, name="client_search", replica=replica)
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+"""Recorder of the SQL statements slower than ``SLOW_QUERY_MS``.
+
+The last ``SLOW_QUERY_BUFFER`` slow statements are kept in memory with their
+normalized SQL, redacted parameters, route and duration. A sampled subset
+(``SLOW_QUERY_EXPLAIN_RATE``, at most once a minute per statement) is run again
+by a background thread under ``EXPLAIN (ANALYZE, BUFFERS)``, in a transaction
+that is rolled back, on the database the statement ran on (the primary or a
+replica), and the plan is attached to the entry with the values it prints
+redacted. Statements sent together in a pipeline are only timed together:
+they are kept as one entry, and not explained.
+"""
+import itertools
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections import deque
+from datetime import datetime
+
+import psycopg
+from psycopg import sql
+
+log = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_BUFFER = int(os.environ.get("SLOW_QUERY_BUFFER", 200))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+# Seconds before the same statement is explained again.
+EXPLAIN_INTERVAL = 60
+# Milliseconds an EXPLAIN ANALYZE may run before it is cancelled.
+EXPLAIN_TIMEOUT = 10_000
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+QUOTED = re.compile(r"'(?:[^']|'')*'")
+SPACES = re.compile(r"\s+")
+# Plan lines that print the conditions of a node, with the values of the parameters inlined.
+CONDITION = re.compile(r"^(?!\s*Rows Removed)(\s*[\w -]*(?:Cond|Filter|Key)\w*: )(.*)$")
+# Quoted values and numbers, but not the $1 of parameters or subplans.
+PLAN_VALUES = re.compile(r"'(?:[^']|'')*'|(?<![$\w.])\d+(?:\.\d+)?\b")
+
+
+def normalize(query):
+    """The statement with its literals replaced by ``?`` and whitespace collapsed."""
+    return SPACES.sub(" ", LITERALS.sub("?", query)).strip()
+
+
+def redact_plan(plan):
+    """The plan with every quoted value, and the numbers of its conditions, replaced by ``?``.
+
+    Costs, timings and row counts are kept.
+    """
+    lines = []
+    for line in plan.splitlines():
+        match = CONDITION.match(line)
+        if match:
+            line = match.group(1) + PLAN_VALUES.sub("?", match.group(2))
+        lines.append(QUOTED.sub("?", line))
+    return "\n".join(lines)
+
+
+def text(conn, query):
+    """The SQL of ``query``, which may be composed or bytes."""
+    if isinstance(query, sql.Composable):
+        return query.as_string(conn)
+    if isinstance(query, bytes):
+        return query.decode()
+    return query
+
+
+def redact(params):
+    """Parameter names (or positions) and types, without their values."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+class SlowQueryLog:
+
+    def __init__(self, threshold_ms, size, explain_rate):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.entries = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        # normalized statement: monotonic time it was last explained, for at most ``size`` statements
+        self._explained = OrderedDict()
+        self._queue = queue.Queue(maxsize=16)
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def record(self, conn, query, params, seconds, route):
+        """Keep the statement if it took longer than the threshold."""
+        if seconds < self.threshold:
+            return
+        query = text(conn, query)
+        normalized = normalize(query)
+        entry = self._add(route, seconds, normalized, redact(params))
+
+        if self._should_explain(normalized, query):
+            try:
+                # The raw parameters never leave this queue.
+                self._queue.put_nowait((entry, conn.url, query, params))
+                entry["plan"] = "pending"
+                self._ensure_worker()
+            except queue.Full:
+                pass
+
+    def record_pipeline(self, conn, statements, seconds, route):
+        """Keep the ``(query, params)`` sent together in a pipeline as one entry, if slower than the threshold.
+
+        They are only timed together, so which of them is slow is not known,
+        and none of them is explained.
+        """
+        if seconds < self.threshold:
+            return
+        self._add(route, seconds, "; ".join(normalize(text(conn, query)) for query, params in statements),
+                  [redact(params) for query, params in statements], pipelined=len(statements))
+
+    def _add(self, route, seconds, normalized, params, pipelined=None):
+        entry = {
+            "id": next(self._ids),
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "route": route,
+            "ms": round(seconds * 1000, 1),
+            "sql": normalized,
+            "params": params,
+            "pipelined": pipelined,
+            "plan": None,
+        }
+        self.entries.append(entry)
+        log.warning(f"Slow {'pipeline' if pipelined else 'query'} ({entry['ms']}ms) on {route}: {normalized[:200]}")
+        return entry
+
+    def _should_explain(self, normalized, query):
+        if random.random() >= self.explain_rate:
+            return False
+        if not query.lstrip().upper().startswith(("SELECT", "WITH")):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(normalized, -EXPLAIN_INTERVAL) < EXPLAIN_INTERVAL:
+                return False
+            self._explained[normalized] = now
+            self._explained.move_to_end(normalized)
+            if len(self._explained) > self.entries.maxlen:
+                self._explained.popitem(last=False)
+        return True
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return
+        with self._lock:
+            if self._worker_pid != pid:
+                threading.Thread(target=self._explain, name="slow-query-explain", daemon=True).start()
+                self._worker_pid = pid
+
+    def _explain(self):
+        # url: connection, one per database the statements ran on (the primary or a replica)
+        conns = {}
+        while True:
+            entry, url, query, params = self._queue.get()
+            try:
+                conn = conns.get(url)
+                if conn is None or conn.closed:
+                    conn = conns[url] = psycopg.connect(url)
+                with conn.transaction(force_rollback=True):
+                    conn.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT};")
+                    rows = conn.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params).fetchall()
+                entry["plan"] = redact_plan("\n".join(row[0] for row in rows))
+            except psycopg.Error as error:
+                entry["plan"] = f"EXPLAIN failed: {error}"
+
+    def recent(self):
+        """The recorded statements, slowest first."""
+        return sorted(self.entries, key=lambda entry: entry["ms"], reverse=True)
+
+
+recorder = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_BUFFER, SLOW_QUERY_EXPLAIN_RATE)
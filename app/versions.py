@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""Version counters of each client's data, used as ETags of the client pages.
+
+Triggers created by ``SCHEMA`` bump ``client_version.version`` whenever the
+client, one of its appointments or anything attached to one of its
+consultations changes, whoever makes the change. They run once per
+statement, so a bulk import or a batch edit bumps each client once. A page is therefore
+unchanged as long as the counter is, and the counter is one primary key
+lookup away (``queries.CLIENT_VERSION``).
+
+The consultation page also shows the names of nurses and the descriptions of
+diagnostic codes, which belong to no client: ``REFERENCE_SCHEMA`` keeps a
+single counter of those tables, which is part of the version of that page
+(``queries.CONSULTATION_VERSION``). The digest of the templates is part of
+the ETag so that a deploy that changes a page invalidates what browsers kept.
+"""
+import hashlib
+import os
+
+# The client of a changed row r of a consultation table, found through the appointment.
+CONSULTATION_CLIENT = ("a.VAT_client",
+                       "JOIN appointment AS a ON a.VAT_doctor = r.VAT_doctor AND a.date_timestamp = r.date_timestamp")
+
+# table: (the client of a changed row r, the join it takes)
+TABLES = {
+    "client": ("r.VAT", ""),
+    "appointment": ("r.VAT_client", ""),
+    "consultation": CONSULTATION_CLIENT,
+    "procedure_in_consultation": CONSULTATION_CLIENT,
+    "consultation_diagnostic": CONSULTATION_CLIENT,
+    "consultation_assistant": CONSULTATION_CLIENT,
+}
+
+# Bumps each client of the changed rows ``{rows}`` once.
+BUMP = """
+            INSERT INTO client_version AS v (VAT, version)
+            SELECT DISTINCT {vat}, 1
+            FROM {rows} AS r
+            {join}
+            WHERE {vat} IS NOT NULL
+            ON CONFLICT (VAT) DO UPDATE SET version = v.version + 1;"""
+
+
+def bump_client_version(table):
+    """The statement trigger function of ``table``: the changed rows are in its transition tables."""
+    vat, join = TABLES[table]
+    return f"""
+    CREATE OR REPLACE FUNCTION bump_client_version_{table}() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN{BUMP.format(vat=vat, join=join, rows="new_rows")}
+        ELSIF TG_OP = 'DELETE' THEN{BUMP.format(vat=vat, join=join, rows="old_rows")}
+        ELSE{BUMP.format(vat=vat, join=join, rows="(SELECT * FROM old_rows UNION ALL SELECT * FROM new_rows)")}
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+
+
+# A trigger with transition tables fires on one event only.
+EVENTS = {
+    "insert": "INSERT ON {table} REFERENCING NEW TABLE AS new_rows",
+    "update": "UPDATE ON {table} REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "delete": "DELETE ON {table} REFERENCING OLD TABLE AS old_rows",
+}
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS client_version(
+        VAT VARCHAR(20),
+        version BIGINT NOT NULL,
+        PRIMARY KEY(VAT)
+    );
+    """,
+] + [bump_client_version(table) for table in TABLES] + [
+    f"""
+    CREATE OR REPLACE TRIGGER {table}_client_version_{event}
+    AFTER {referencing.format(table=table)}
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version_{table}();
+    """
+    for table in TABLES
+    for event, referencing in EVENTS.items()
+]
+
+# Tables shown on the consultation page that belong to no client.
+REFERENCE_TABLES = ["employee", "diagnostic_code"]
+
+REFERENCE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS reference_version(
+        id BOOLEAN DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL,
+        PRIMARY KEY(id)
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bump_reference_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO reference_version AS v (version)
+        VALUES (1)
+        ON CONFLICT (id) DO UPDATE SET version = v.version + 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+] + [
+    f"""
+    CREATE OR REPLACE TRIGGER {table}_reference_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+    """
+    for table in REFERENCE_TABLES
+]
+
+
+def templates_digest(folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")):
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(folder)):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_DIGEST = templates_digest()
+
+
+def etag(page, version):
+    """ETag of ``page`` for data at ``version``."""
+    return f"{page}-{version}-{TEMPLATES_DIGEST}"
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+"""Warm-up of a worker before it takes traffic, and the readiness reported by ``/readyz``.
+
+``run`` opens the connections of the pools, runs the queries of the client
+and consultation pages once on each connection, so that the prepared ones
+are prepared everywhere, compiles every template and loads the reference
+data cache. gunicorn runs it in each worker before the worker accepts
+connections (``post_worker_init`` in gunicorn.conf.py), and hypercorn when a
+worker starts serving (asgi.py). A worker whose warm-up failed, e.g. because
+the database was not up yet, warms up again in the background on its next
+``/readyz``, which answers not ready in the meantime.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+import psycopg
+from psycopg_pool import PoolTimeout
+
+import consultation
+import history
+import refdata
+from db import REPLICA_URLS
+from db import get_pool
+from db import get_replica_pool
+
+log = logging.getLogger(__name__)
+
+# Seconds the warm-up waits for the pools to open their connections.
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", 10))
+# Seconds a database check of /readyz is reused for.
+READY_CHECK_INTERVAL = float(os.environ.get("READY_CHECK_INTERVAL", 1))
+# Seconds /readyz waits for a connection before answering not ready.
+READY_TIMEOUT = float(os.environ.get("READY_TIMEOUT", 1))
+
+# Keys of no client or consultation: the queries run, and return nothing.
+NO_CLIENT = ""
+NO_CONSULTATION = {"VAT": NO_CLIENT, "VAT_doctor": "", "date_timestamp": "1970-01-01 00:00:00"}
+
+# Monotonic time this process imported the app.
+STARTED = time.monotonic()
+
+_state = {}
+_state_pid = None
+_lock = threading.Lock()
+
+
+def state():
+    """The warm-up state of the current process, reset after a fork."""
+    global _state, _state_pid
+
+    if _state_pid != os.getpid():
+        _state = {"warmed": False, "startup_seconds": None, "steps": {}, "checked_at": None, "database": False}
+        _state_pid = os.getpid()
+    return _state
+
+
+def warm_pool(pool, timeline_size):
+    """Open the ``min_size`` connections of ``pool`` and run the page queries on each; return how many."""
+    pool.wait(timeout=WARMUP_TIMEOUT)
+    with ExitStack() as stack:
+        # Held together, so that each query runs on every connection.
+        conns = [stack.enter_context(pool.connection()) for _ in range(pool.min_size)]
+        for conn in conns:
+            history.load(conn, NO_CLIENT, *history.PARTS, size=timeline_size)
+            consultation.load(conn, *NO_CONSULTATION.values(), *consultation.PARTS)
+    return len(conns)
+
+
+def compile_templates(app):
+    """Compile every template of ``app``; return how many."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def run(app):
+    """Warm up this process for ``app``; return whether it succeeded."""
+    steps = {}
+
+    def step(name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        steps[name] = {"seconds": round(time.perf_counter() - start, 3), "result": result}
+
+    try:
+        timeline_size = app.config.get("TIMELINE_PAGE_SIZE", 20)
+        step("pool", warm_pool, get_pool(), timeline_size)
+        for index in range(len(REPLICA_URLS)):
+            step(f"replica{index}", warm_pool, get_replica_pool(index), timeline_size)
+        step("templates", compile_templates, app)
+        step("refdata", refdata.cache.prime)
+    except (PoolTimeout, psycopg.Error) as error:
+        log.warning(f"Warm-up failed, it will be retried on the next /readyz: {error}")
+        return False
+
+    current = state()
+    current.update(warmed=True, startup_seconds=round(time.monotonic() - STARTED, 3), steps=steps)
+    log.info(f"Worker {os.getpid()} warmed up, ready {current['startup_seconds']}s after start: "
+             + ", ".join(f"{name} {timing['seconds']}s" for name, timing in steps.items()))
+    return True
+
+
+def database_reachable():
+    """Whether the primary answers, checked at most every ``READY_CHECK_INTERVAL`` seconds."""
+    current = state()
+    now = time.monotonic()
+    if current["checked_at"] is not None and now - current["checked_at"] < READY_CHECK_INTERVAL:
+        return current["database"]
+
+    try:
+        with get_pool().connection(timeout=READY_TIMEOUT) as conn:
+            conn.execute("SELECT 1;")
+        current["database"] = True
+    except (PoolTimeout, psycopg.Error) as error:
+        current["database"] = False
+        log.warning(f"Readiness check: the database is unreachable: {error}")
+    current["checked_at"] = time.monotonic()
+    return current["database"]
+
+
+def retry(app):
+    """Run the warm-up again; the caller holds ``_lock``, released when done."""
+    try:
+        if not state()["warmed"]:
+            run(app)
+    finally:
+        _lock.release()
+
+
+def ready(app):
+    """Whether this process is warmed up and reaches the database.
+
+    A process that is not warmed up starts its warm-up in the background, if
+    it is not already running, and is not ready until it is done: the check
+    itself never waits for it.
+    """
+    if not state()["warmed"]:
+        if _lock.acquire(blocking=False):
+            threading.Thread(target=retry, args=(app,), name="warmup", daemon=True).start()
+        return False
+    return database_reachable()